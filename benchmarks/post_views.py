@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares copy.deepcopy of posts with :func:`livebridge.base.BasePost.view`.
+
+Usage: PYTHONPATH=. python benchmarks/post_views.py [posts] [targets]"""
+import copy
+import sys
+import time
+import tracemalloc
+from livebridge.base import BasePost
+
+
+class BenchPost(BasePost):
+    source = "bench"
+
+    @property
+    def id(self):
+        return self.data["_id"]
+
+
+def make_data(num):
+    """Builds a raw source post of roughly 40 KB, similar to a liveblog post with media."""
+    return {
+        "_id": "post-{}".format(num),
+        "groups": [{
+            "refs": [{
+                "item": {
+                    "_id": "item-{}-{}".format(num, x),
+                    "text": "<p>{}</p>".format("Lorem ipsum dolor sit amet. " * 20),
+                    "meta": {"media": {"renditions": {
+                        size: {"href": "https://example.com/{}/{}.jpg".format(size, x), "width": 800, "height": 600}
+                        for size in ("original", "thumbnail", "viewImage", "baseImage")}}},
+                }
+            } for x in range(40)]
+        }],
+    }
+
+
+def run(func, posts, targets):
+    tracemalloc.start()
+    start = time.process_time()
+    copies = [func(post) for post in posts for _ in range(targets)]
+    duration = time.process_time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del copies
+    return duration, peak
+
+
+def main(num_posts=200, targets=8):
+    posts = [BenchPost(make_data(x)) for x in range(num_posts)]
+    print("{} posts x {} targets".format(num_posts, targets))
+    for name, func in (("deepcopy", copy.deepcopy), ("view", lambda post: post.view())):
+        duration, peak = run(func, posts, targets)
+        print("{:>10}: {:8.3f}s CPU {:10.1f} KB peak allocated".format(name, duration, peak / 1024))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
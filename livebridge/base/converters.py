@@ -15,8 +15,7 @@
 # limitations under the License.
 import logging
 import os.path
-import uuid
-import aiohttp
+from livebridge.images import get_image_cache
 
 
 logger = logging.getLogger(__name__)
@@ -42,24 +41,19 @@ class BaseConverter(object):
         pass
 
     async def _download_image(self, data):
+        """Returns path of the image in the shared :class:`livebridge.images.ImageCache`, which \
+           has to be released by :func:`remove_images`."""
         basename = os.path.basename(data["media"])
         file_ext = os.path.splitext(basename)[1]
-        filename = "{}-{}{}".format(
-            str(uuid.uuid4())[:8],
-            basename,
-            FILE_EXT[data["mimetype"]] if not file_ext else ""
-        )
-        filepath = os.path.join("/tmp/", filename)
-        async with aiohttp.ClientSession() as session:
-            async with session.get(data["href"]) as resp:
-                test = await resp.read()
-                with open(filepath, "wb") as file:
-                    file.write(test)
-        return filepath
+        return await get_image_cache().get(data["href"], ext=file_ext or FILE_EXT[data["mimetype"]])
 
     async def remove_images(self, images):
+        """Releases images of the image cache, other files get deleted."""
+        cache = get_image_cache()
         try:
             for filepath in images:
+                if cache.release(filepath):
+                    continue
                 os.remove(filepath)
                 logger.info("Removed image {}".format(filepath))
         except Exception as exc:
@@ -68,7 +62,7 @@ class BaseConverter(object):
 
     async def convert(self, post):
         """Convert incoming content of the incoming raw source post to a string suitable to the \
-           target as content.
+           target as content. The raw source post is read-only, it's shared by all targets.
 
            :param post: raw source post
            :type dictionary: dictionary
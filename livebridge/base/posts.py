@@ -13,6 +13,74 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import copy
+
+
+def _read_only(*args, **kwargs):
+    raise TypeError("Source data of a post view is read-only.")
+
+
+def _frozen(value):
+    if isinstance(value, dict) and not isinstance(value, _FrozenDict):
+        return _FrozenDict(value)
+    if isinstance(value, list) and not isinstance(value, _FrozenList):
+        return _FrozenList(value)
+    return value
+
+
+class _FrozenDict(dict):
+    """Read-only view of source data, nested dicts and lists are returned read-only too. \
+       Copies of it are plain, mutable dicts."""
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __getitem__(self, key):
+        return _frozen(dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        return _frozen(dict.get(self, key, default))
+
+    def values(self):
+        return [_frozen(v) for v in dict.values(self)]
+
+    def items(self):
+        return [(k, _frozen(v)) for k, v in dict.items(self)]
+
+    def copy(self):
+        return dict(dict.items(self))
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.copy(), memo)
+
+    def __reduce__(self):
+        return (dict, (self.copy(),))
+
+
+class _FrozenList(list):
+    """Read-only list of source data, see :class:`_FrozenDict`."""
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+
+    def __getitem__(self, index):
+        return _frozen(list.__getitem__(self, index))
+
+    def __iter__(self):
+        for value in list.__iter__(self):
+            yield _frozen(value)
+
+    def copy(self):
+        return list(list.__iter__(self))
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.copy(), memo)
+
+    def __reduce__(self):
+        return (list, (self.copy(),))
 
 
 class BasePost(object):
@@ -36,6 +104,7 @@ class BasePost(object):
         self.content = content
         self.images = images
         self._existing = None
+        self.prefetched = False
         self._target_id = None
         self._target_doc = None
 
@@ -124,11 +193,31 @@ class BasePost(object):
             self._target_id = self._existing.get("target_id")
         return self._target_id
 
-    def set_existing(self, existing):
+    def view(self):
+        """Returns a copy of the post for the delivery to a single target.
+
+        The raw source **data** is shared with the original post and exposed read-only, \
+        changing it raises a :class:`TypeError`, copies of it are mutable. Only the target \
+        related state (**content**, **images**, the existing doc, the target doc and the \
+        target id) is held per copy. Much cheaper than a deep copy of the post.
+
+        :returns: :class:`livebridge.base.BasePost`"""
+        post = copy.copy(self)
+        post.data = _frozen(self.data)
+        post.images = list(self.images)
+        post._existing = copy.deepcopy(self._existing)
+        post._target_doc = copy.deepcopy(self._target_doc)
+        post._target_id = None
+        return post
+
+    def set_existing(self, existing, *, prefetched=False):
         """Takes existing doc at target.
 
-        :param existing: - dict, resource doc at target."""
+        :param existing: - dict, resource doc at target.
+        :param prefetched: - True, if *existing* was read before the delivery, see \
+            :func:`livebridge.base.BaseTarget.prefetch_posts`."""
         self._existing = existing
+        self.prefetched = prefetched
 
     def get_existing(self):
         """Returns existing resource at target.
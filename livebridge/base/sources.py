@@ -13,8 +13,14 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import logging
+from collections import OrderedDict
 from livebridge.components import get_db_client
+from livebridge.config import KNOWN_POSTS_CHUNK_SIZE, KNOWN_POSTS_CONCURRENCY
+from livebridge.knownposts import get_known_posts
+from livebridge.lastupdated import get_last_updated_index
+from livebridge.metrics import metrics
 
 
 logger = logging.getLogger(__name__)
@@ -46,6 +52,10 @@ class BaseSource(object):
     async def filter_new_posts(self, source_id, post_ids):
         """Filters ist of post_id for new ones.
 
+        Ids are looked up in the process-wide cache of the source first, see \
+        :class:`livebridge.knownposts.KnownPosts`. Remaining ids are looked up in the storage in \
+        chunks of **known_posts_chunk_size** ids, **LB_KNOWN_POSTS_CONCURRENCY** chunks at once.
+
         :param source_id: id of the source
         :type string:
         :param post_ids: list of post ids
@@ -54,20 +64,58 @@ class BaseSource(object):
         new_ids = []
         try:
             db_client = self._db
-            posts_in_db = await db_client.get_known_posts(source_id, post_ids)
-            new_ids = [p for p in post_ids if p not in posts_in_db]
+            cache = get_known_posts(source_id)
+            known, lookup_ids = set(), post_ids
+            if cache is not None:
+                if not cache.warmed:
+                    await cache.warm(db_client)
+                known, unknown, lookup_ids = cache.lookup(list(OrderedDict.fromkeys(post_ids)))
+            if lookup_ids or cache is None:
+                found = set()
+                for chunk in await self._get_known_posts(db_client, source_id, lookup_ids):
+                    found.update(chunk)
+                known.update(found)
+                if cache is not None:
+                    cache.add([p for p in lookup_ids if p in found])
+            new_ids = [p for p in post_ids if p not in known]
         except Exception as exc:
             logger.error("Error when filtering for new posts {} {}".format(source_id, post_ids))
             logger.exception(exc)
         return new_ids
 
+    async def _get_known_posts(self, db_client, source_id, post_ids):
+        unique = list(OrderedDict.fromkeys(post_ids))
+        size = KNOWN_POSTS_CHUNK_SIZE or getattr(db_client, "known_posts_chunk_size", None)
+        if not isinstance(size, int) or len(unique) <= size:
+            return [await db_client.get_known_posts(source_id, unique)]
+        semaphore = asyncio.Semaphore(max(1, KNOWN_POSTS_CONCURRENCY))
+
+        async def lookup(chunk):
+            async with semaphore:
+                return await db_client.get_known_posts(source_id, chunk)
+
+        return await asyncio.gather(*[lookup(unique[x:x + size]) for x in range(0, len(unique), size)])
+
     async def get_last_updated(self, source_id):
         """Returns latest update-timestamp from storage for source.
 
+        The timestamp is taken from the process-wide index if possible, see \
+        :class:`livebridge.lastupdated.LastUpdatedIndex`.
+
         :param source_id: id of the source (source_id, ticker_id, blog_id pp)
         :type string:
         :returns: :py:class:`datetime.datetime` object of latest update datetime in db."""
+        index = get_last_updated_index()
+        if index is not None and index.fresh(source_id):
+            metrics.incr("last_updated_cache_total", result="hit")
+            return index.get(source_id)
         last_updated = await self._db.get_last_updated(source_id)
+        if index is not None:
+            metrics.incr("last_updated_cache_total", result="miss")
+            if last_updated is not None:
+                # None is returned for failed queries too
+                index.set(source_id, last_updated)
+            last_updated = index.get(source_id) or last_updated
         logger.info("LAST UPDATED: {} {}".format(last_updated, self))
         return last_updated
 
@@ -117,3 +165,16 @@ class StreamingSource(BaseSource):
 
            :return: True"""
         raise NotImplementedError("Method 'stop' not implemented.")
+
+    async def pause(self):
+        """Method can be implemented by the concrete inherited source class.
+
+           Gets called, when the delivery queues of the bridge are saturated. The source should stop \
+           reading from its stream until :func:`resume` gets called."""
+        pass
+
+    async def resume(self):
+        """Method can be implemented by the concrete inherited source class.
+
+           Gets called, when the delivery queues of a paused bridge have drained again."""
+        pass
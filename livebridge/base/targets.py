@@ -13,8 +13,14 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import logging
 from livebridge.components import get_converter, get_db_client
+from livebridge.conversions import get_conversion_cache
+from livebridge.knownposts import remember_posts, forget_post
+from livebridge.lastupdated import advance_last_updated
+from livebridge.limits import get_type_limiter
+from livebridge.metrics import metrics
 
 
 logger = logging.getLogger(__name__)
@@ -32,10 +38,23 @@ class BaseTarget(object):
        at the target.
 
     If a method above is not needed, for example when no update is possible at the target, \
-    use :func:`livebridge.posts.base.BasePost.get_action` to **ignore** this action."""
+    use :func:`livebridge.posts.base.BasePost.get_action` to **ignore** this action.
+
+    Targets with bulk endpoints can declare a **batch_size** greater than 1 and implement \
+    :func:`post_items` and :func:`update_items`, posts are then delivered in batches via \
+    :func:`handle_posts`.
+
+    Requests to a service with quotas can be limited for all targets of a type by the class \
+    attributes **concurrency** (requests in flight) and **rate_limit** (requests per second, \
+    with bursts up to **rate_burst**). Single targets can be limited by the same keys in their \
+    entry of the control file."""
     __module__ = "livebridge.base"
 
     type = "base"
+    batch_size = 1
+    concurrency = None
+    rate_limit = None
+    rate_burst = None
 
     def __init__(self, *, config={}, **kwargs):
         """Base constructor for targets.
@@ -58,6 +77,22 @@ class BaseTarget(object):
         from service, empty if failed."""
         raise NotImplementedError()
 
+    def post_items(self, posts):
+        """Creates new resources at target with a single request, needed for **batch_size** > 1.
+
+        :param posts: - list of :class:`livebridge.posts.base.BasePost`
+        :returns: - list with a :class:`livebridge.base.TargetResponse` per post, in the order of \
+        *posts*, empty for posts which failed."""
+        raise NotImplementedError()
+
+    def update_items(self, posts):
+        """Updates existing resources at target with a single request, needed for **batch_size** > 1.
+
+        :param posts: - list of :class:`livebridge.posts.base.BasePost`
+        :returns: - list with a :class:`livebridge.base.TargetResponse` per post, in the order of \
+        *posts*, empty for posts which failed."""
+        raise NotImplementedError()
+
     def delete_item(self, post):
         """Deletes an existing resource at target.
 
@@ -83,8 +118,29 @@ class BaseTarget(object):
         from service, empty or None if nothing has changed at resource."""
         raise NotImplementedError()
 
+    async def _limited(self, method, post):
+        """Calls *method* of the target, when the limits of target and target type allow it."""
+        # the limiter shared by the type is acquired last, a target waiting for its own limits
+        # must not hold a slot of the other targets of its type
+        limiters = [limiter for limiter in [getattr(self, "limiter", None), get_type_limiter(self.__class__)]
+                    if limiter]
+        if not limiters:
+            return await method(post)
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        acquired = []
+        try:
+            for limiter in limiters:
+                await limiter.acquire()
+                acquired.append(limiter)
+            metrics.observe("target_limit_wait_seconds", loop.time() - start, target=self.type)
+            return await method(post)
+        finally:
+            for limiter in reversed(acquired):
+                limiter.release()
+
     async def _handle_new(self, post):
-        new_doc = await self.post_item(post)
+        new_doc = await self._limited(self.post_item, post)
         logger.debug("Target CREATE: {}".format(new_doc))
         if not new_doc:
             logger.error("Post {} wasn't saved in {}".format(post.id, self.target_id))
@@ -92,7 +148,7 @@ class BaseTarget(object):
         return new_doc
 
     async def _handle_delete(self, post):
-        del_res = await self.delete_item(post)
+        del_res = await self._limited(self.delete_item, post)
         logger.debug("Target DELETE: {}".format(del_res))
         if not del_res:
             logger.error("Deleting post failed: [{}] on {}".format(post.id, post.target_id))
@@ -101,11 +157,12 @@ class BaseTarget(object):
             post.target_id,
             post.id
         )
+        forget_post(post.id)
         logger.info("Deleted post: [{}] on {}".format(post.id, post.target_id))
         return True
 
     async def _handle_update(self, post):
-        update_res = await self.update_item(post)
+        update_res = await self._limited(self.update_item, post)
         logger.debug("Target UPDATE: {}".format(update_res))
         if not update_res:
             logger.error("Target Update failed {} / {}".format(post.id, post.content))
@@ -116,24 +173,72 @@ class BaseTarget(object):
     def _get_converter(self, post):
         return get_converter(post.source, self.type)
 
-    async def handle_post(self, post):
-        # convert
+    async def _prepare(self, post):
+        """Converts post and determines action at target.
+
+        :returns: - tuple of conversion and action, action is None if post got ignored. The \
+        conversion is shared with other targets of the same type and has to be released by \
+        :func:`_release`."""
         converter = self._get_converter(post)
+        conversion = None
         if converter:
-            # convert from source to target
-            conversion = await converter.convert(post.data)
-            post.content = conversion.content
-            post.images = conversion.images
+            # convert from source to target, once for all targets of this type
+            conversion = await get_conversion_cache().acquire(converter, post, self.type)
+            post.content = conversion.result.content
+            post.images = list(conversion.result.images)
             logger.debug("CONVERSION RESULTS: {}".format(post.content))
 
             if not post.content and not post.is_deleted:
                 logger.warning("Empty text, post got ignored.")
-                return None
+                return conversion, None
 
-        post.set_existing(await self._db.get_post(self.target_id, post.id))
-        action = post.get_action()
+        try:
+            if getattr(post, "prefetched", False) is True:
+                # retries read the doc again
+                post.prefetched = False
+            else:
+                post.set_existing(await self._db.get_post(self.target_id, post.id))
+            action = post.get_action()
+        except Exception:
+            await self._release(conversion)
+            raise
         logger.info("POST ACTION: {} - {} - {}".format(action, self.target_id, post.id))
-        if action == "ignore":
+        return conversion, action
+
+    async def _release(self, conversion):
+        # images get removed, when the last target is done with them
+        if conversion:
+            await get_conversion_cache().release(conversion)
+
+    async def prefetch_posts(self, post_ids):
+        """Reads the stored docs of *post_ids* at the target with one storage request.
+
+        :param post_ids: - list of post ids
+        :returns: - dict of post id and doc for known posts, None if the request failed."""
+        return await self._db.get_posts(self.target_id, post_ids)
+
+    def _put_params(self, post):
+        return {
+            "target_id": self.target_id,
+            "post_id": post.id,
+            "source_id": post.source_id,
+            "text": str(post.content),
+            "sticky": post.is_sticky,
+            "created": post.created,
+            "updated": post.updated,
+            "target_doc": post.target_doc.data,
+        }
+
+    async def handle_post(self, post):
+        conversion, action = await self._prepare(post)
+        try:
+            await self._handle_action(post, action)
+        finally:
+            # clean up converter images
+            await self._release(conversion)
+
+    async def _handle_action(self, post, action):
+        if action is None or action == "ignore":
             return None
         elif action == "create":
             post.target_doc = await self._handle_new(post)
@@ -144,28 +249,102 @@ class BaseTarget(object):
             return None
 
         # handle extra traits of target
-        extra_doc = await self.handle_extras(post)
+        extra_doc = await self._limited(self.handle_extras, post)
         if extra_doc:
             # use updated doc from target
             post.target_doc = extra_doc
 
         if post:
             # save new doc
-            put_params = {
-                "target_id": self.target_id,
-                "post_id": post.id,
-                "source_id": post.source_id,
-                "text": str(post.content),
-                "sticky": post.is_sticky,
-                "created": post.created,
-                "updated": post.updated,
-                "target_doc": post.target_doc.data,
-            }
+            put_params = self._put_params(post)
             if action == "create":
-                await self._db.insert_post(**put_params)
+                if await self._db.insert_post(**put_params):
+                    remember_posts(post.source_id, [post.id])
+                    advance_last_updated(post.source_id, post.updated)
             elif action == "update":
-                await self._db.update_post(**put_params)
+                if await self._db.update_post(**put_params):
+                    advance_last_updated(post.source_id, post.updated)
 
-        # clean up converter images
-        if converter:
-            await converter.remove_images(post.images)
+    async def handle_posts(self, posts):
+        """Delivers a batch of posts, create and update actions of all posts are sent \
+        with one request via :func:`post_items` and :func:`update_items`. Targets with a \
+        **batch_size** of 1 handle one post after another with :func:`handle_post`.
+
+        :param posts: - list of :class:`livebridge.posts.base.BasePost`, one per post id
+        :returns: - list with the exception per failed post and None per delivered post, in the \
+        order of *posts*."""
+        errors = {}
+        if self.batch_size <= 1:
+            for x, post in enumerate(posts):
+                try:
+                    await self.handle_post(post)
+                except Exception as exc:
+                    errors[x] = exc
+            return [errors.get(x) for x in range(len(posts))]
+
+        prepared = []
+        for x, post in enumerate(posts):
+            try:
+                conversion, action = await self._prepare(post)
+                prepared.append((x, post, conversion, action))
+            except Exception as exc:
+                errors[x] = exc
+
+        try:
+            await self._handle_prepared(prepared, errors)
+        finally:
+            # clean up converter images
+            for x, post, conversion, action in prepared:
+                await self._release(conversion)
+        return [errors.get(x) for x in range(len(posts))]
+
+    async def _handle_prepared(self, prepared, errors):
+        # bulk requests to target
+        for action, method in [("create", self.post_items), ("update", self.update_items)]:
+            group = [(x, post) for x, post, _, act in prepared if act == action]
+            if not group:
+                continue
+            try:
+                docs = await self._limited(method, [post for _, post in group])
+                logger.debug("Target {} of {} posts: {}".format(action.upper(), len(group), docs))
+            except Exception as exc:
+                logger.error("Target {} of {} posts failed: {}".format(action, len(group), exc))
+                docs = [None] * len(group)
+            if not isinstance(docs, (list, tuple)) or len(docs) != len(group):
+                # posts without doc count as failed, none is taken as delivered
+                logger.error("Target {} of {} posts returned {} docs.".format(
+                    action, len(group), len(docs) if isinstance(docs, (list, tuple)) else type(docs).__name__))
+                docs = list(docs)[:len(group)] if isinstance(docs, (list, tuple)) else []
+                docs.extend([None] * (len(group) - len(docs)))
+            for (x, post), doc in zip(group, docs):
+                if doc:
+                    post.target_doc = doc
+                else:
+                    errors[x] = Exception("Target {} of post {} failed on {}".format(action, post.id, self.target_id))
+
+        stored = {"create": [], "update": []}
+        for x, post, _, action in prepared:
+            if x in errors:
+                continue
+            try:
+                if action == "delete":
+                    await self._handle_delete(post)
+                elif action in stored:
+                    # handle extra traits of target
+                    extra_doc = await self._limited(self.handle_extras, post)
+                    if extra_doc:
+                        post.target_doc = extra_doc
+                    stored[action].append(self._put_params(post))
+            except Exception as exc:
+                errors[x] = exc
+
+        # save new docs
+        if stored["create"]:
+            if await self._db.insert_posts(stored["create"]):
+                for params in stored["create"]:
+                    remember_posts(params["source_id"], [params["post_id"]])
+                    advance_last_updated(params["source_id"], params["updated"])
+        if stored["update"]:
+            if await self._db.update_posts(stored["update"]):
+                for params in stored["update"]:
+                    advance_last_updated(params["source_id"], params["updated"])
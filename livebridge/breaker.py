@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import logging
+from livebridge.config import BREAKER_THRESHOLD, BREAKER_COOLDOWN
+from livebridge.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker(object):
+    """Circuit breaker for a target service, shared by all targets using the same service.
+
+    After *threshold* consecutive failures the breaker opens, items for the service get parked
+    instead of delivered. After *cooldown* seconds a single item is let through as probe, when
+    it succeeds the breaker closes and parked items get delivered again.
+
+    :param key: identifies the target service
+    :param threshold: number of consecutive failures opening the breaker
+    :param cooldown: seconds until the next probe"""
+
+    def __init__(self, key, *, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.key = key
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self.parked = []
+        self.timer = None
+        self.loop = asyncio.get_event_loop()
+
+    def __repr__(self):
+        return "<CircuitBreaker {} {}>".format(self.key, self.state)
+
+    def allow(self):
+        """Returns True, when an item may be delivered."""
+        if self.state == OPEN and self.loop.time() >= self.opened + self.cooldown:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self.probing:
+            logger.info("Probing target {}.".format(self.key))
+            self.probing = True
+            return True
+        return self.state == CLOSED
+
+    def success(self):
+        self.failures = 0
+        self.probing = False
+        if self.state != CLOSED:
+            logger.info("Target {} is available again, delivering {} parked items.".format(
+                self.key, len(self.parked)))
+            self._set_state(CLOSED)
+            self._cancel_timer()
+            self.drain()
+
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+            logger.warning("Target {} failed {} times, parking items for {} seconds.".format(
+                self.key, self.failures, self.cooldown))
+            self._set_state(OPEN)
+            self.opened = self.loop.time()
+            metrics.incr("breaker_opened_total", key=self.key)
+            self._cancel_timer()
+            self.timer = self.loop.call_later(self.cooldown, self._probe)
+
+    def park(self, lane, item):
+        """Keeps *item* of *lane* until the target is available again."""
+        self.parked.append((lane, item))
+
+    def discard(self, lane):
+        """Removes parked items of *lane* and returns them."""
+        items = [item for parked_lane, item in self.parked if parked_lane is lane]
+        self.parked = [(parked_lane, item) for parked_lane, item in self.parked if parked_lane is not lane]
+        return items
+
+    def drain(self):
+        parked, self.parked = self.parked, []
+        for lane, item in parked:
+            if not lane.stopped:
+                lane.retry(item)
+
+    def _probe(self):
+        # re-enqueue one parked item, it gets delivered as probe
+        self.timer = None
+        # a probe without success or failure until now got lost, e.g. with its stopped lane
+        self.probing = False
+        while self.parked:
+            lane, item = self.parked.pop(0)
+            if not lane.stopped:
+                lane.retry(item)
+                # probe again, when this one gets lost too
+                self.timer = self.loop.call_later(self.cooldown, self._probe)
+                return
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.set("breaker_state", [CLOSED, OPEN, HALF_OPEN].index(state), key=self.key)
+
+    def _cancel_timer(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def info(self):
+        retry_in = None
+        if self.state == OPEN:
+            retry_in = max(0, round(self.opened + self.cooldown - self.loop.time(), 1))
+        return {
+            "key": self.key,
+            "state": self.state,
+            "failures": self.failures,
+            "parked": len(self.parked),
+            "retry_in": retry_in,
+        }
+
+
+_breakers = {}
+
+
+def get_breaker(key):
+    """Returns the process-wide :class:`CircuitBreaker` of *key*, None if disabled \
+       by **LB_BREAKER_THRESHOLD**."""
+    if not BREAKER_THRESHOLD:
+        return None
+    breaker = _breakers.get(key)
+    if breaker is None or breaker.loop is not asyncio.get_event_loop():
+        breaker = _breakers[key] = CircuitBreaker(key)
+    return breaker
+
+
+def get_breakers():
+    """Returns info about all circuit breakers."""
+    return [breaker.info() for key, breaker in sorted(_breakers.items())]
@@ -14,11 +14,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import asyncio
-import copy
 import logging
-from livebridge.config import RETRY_MULTIPLIER, MAX_RETRIES
-from livebridge.components import get_source, get_db_client, get_hash
+from livebridge.config import MAX_RETRIES, DELIVERY_MODE, DELIVERY_QUEUE_SIZE, DRAIN_TIMEOUT, POLL_TIMEOUT
+from livebridge.components import get_source, get_db_client, get_hash, get_source_key
 from livebridge.base import InvalidTargetResource
+from livebridge.breaker import get_breaker, OPEN
+from livebridge.delivery import DeliveryLane
+from livebridge.metrics import metrics
+from livebridge.outbox import get_outbox
+from livebridge.retries import get_retry_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -33,12 +37,21 @@ class LiveBridge(object):
         self.source_id = self.config.get("source_id")
         self.endpoint = self.config.get("endpoint")
         self.label = self.config.get("label", "-")
-        self.retry_multiplier = RETRY_MULTIPLIER
         self.max_retries = MAX_RETRIES
         self.db = get_db_client()
-        self.queue = asyncio.Queue()
-        self.queue_task = None
-        self.sleep_tasks = []
+        self.retries = get_retry_scheduler()
+        self.pipelined = DELIVERY_MODE == "pipelined"
+        self.lanes = {}
+        self.queue_size = DELIVERY_QUEUE_SIZE
+        self.paused = False
+        self.last_poll_count = None
+        self.poll_timeout = self.config.get("poll_timeout", POLL_TIMEOUT)
+        self._capacity = asyncio.Event()
+        self._capacity.set()
+        self.draining = False
+        self._idle = asyncio.Event()
+        self.outbox = get_outbox()
+        self.replayed = False
 
     def __repr__(self):
         return "<LiveBridge [{}] {} {} MD5:{}>".format(self.label, self.endpoint, self.source_id, self.hash)
@@ -51,94 +64,423 @@ class LiveBridge(object):
         self.api_client = get_source(self.config)
         return self.api_client
 
+    @property
+    def source_key(self):
+        """Identity of the source, bridges with the same key share one source."""
+        return get_source_key(self.config)
+
+    @property
+    def outbox_key(self):
+        """Key of the bridge in the outbox, derived from the source only. Pending items survive \
+           changes of other settings of the bridge."""
+        return self.source_key
+
+    def _target_key(self, target):
+        targets = self.config.get("targets", [])
+        pos = self.targets.index(target)
+        return get_hash(targets[pos]) if pos < len(targets) else str(target.target_id)
+
+    @property
+    def saturated(self):
+        """True, when a delivery lane of the bridge reached the high-water mark."""
+        if not self.queue_size:
+            return False
+        return any(len(lane) >= self.queue_size for lane in self.lanes.values())
+
+    def _lane_items(self, lane):
+        # queued, held back and parked items of a lane
+        items = list(lane.items)
+        items.extend(i for held in lane.pending.values() for i in held)
+        if getattr(lane, "breaker", None):
+            items.extend(lane.breaker.discard(lane))
+        return items
+
+    @property
+    def idle(self):
+        """True, when no delivery of the bridge is queued, in flight or waiting for a retry."""
+        return not any(len(lane) for lane in self.lanes.values())
+
+    def _check_idle(self):
+        if self.idle:
+            self._idle.set()
+        else:
+            self._idle.clear()
+
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        """Stops intake of new posts and waits up to *timeout* seconds for queued and retrying \
+           deliveries to finish, before the bridge gets stopped. Unfinished deliveries stay in \
+           the outbox, if enabled.
+
+        :returns: True, when all deliveries were finished."""
+        started = asyncio.get_event_loop().time()
+        self.draining = True
+        self._check_idle()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        left = sum(len(lane) for lane in self.lanes.values())
+        self.stop()
+        duration = asyncio.get_event_loop().time() - started
+        metrics.observe("bridge_drain_seconds", duration)
+        if left:
+            logger.warning("Stopped {} after {:.2f}s, {} posts not delivered{}.".format(
+                self, duration, left, ", kept in outbox" if self.outbox else ""))
+            metrics.incr("bridge_drain_left_total", left, bridge=self.hash)
+        else:
+            logger.info("Stopped {} after {:.2f}s, all deliveries finished.".format(self, duration))
+        return not left
+
     def stop(self):
-        # stop queue task first
-        if self.queue_task:
-            self.queue_task.cancel()
-        # stop sleeping tasks
-        for task in self.sleep_tasks:
-            task.cancel()
+        items = [entry.item for entry in self.retries.pending(bridge=self)]
+        for lane in self.lanes.values():
+            items.extend(self._lane_items(lane))
+        if self.outbox:
+            # queued items stay in the outbox, a successor of the bridge can replay them
+            self.outbox.release([i["outbox"] for i in items if i.get("outbox")])
+        # stop delivery lanes first
+        for lane in self.lanes.values():
+            lane.stop()
+        self._capacity.set()
+        # drop pending retries
+        self.retries.cancel(bridge=self)
         return True
 
     def add_target(self, target):
         logger.debug("Adding target {} to {}".format(target, self))
         self.targets.append(target)
 
-    async def listen_ws(self):
-        return asyncio.Task(self.source.listen(self.new_posts))
+    def remove_target(self, target):
+        """Removes *target* from the running bridge. Its queued deliveries and pending retries \
+           are dropped, other targets and the source are not affected.
+
+        :returns: number of dropped deliveries"""
+        logger.debug("Removing target {} from {}".format(target, self))
+        items = [entry.item for entry in self.retries.pending(bridge=self, target=target)]
+        self.retries.cancel(bridge=self, target=target)
+        lane = self.lanes.pop(target, None)
+        if lane:
+            items.extend(self._lane_items(lane))
+            lane.stop()
+        if self.outbox:
+            # the target is gone for good, nobody would replay its items
+            for item in items:
+                if item.get("outbox"):
+                    asyncio.ensure_future(self.outbox.remove(item["outbox"]))
+        self.targets.remove(target)
+        self._check_backpressure()
+        return len(items)
+
+    def replace_target(self, old, new, conf):
+        """Replaces the client *old* of a target, whose settings changed, by *new*. Queued \
+           deliveries, pending retries and outbox records of the target are kept and handed \
+           to *new*.
+
+        :param conf: new configuration of the target
+        :returns: number of handed over deliveries"""
+        logger.debug("Replacing target {} of {} by {}".format(old, self, new))
+        self.targets[self.targets.index(old)] = new
+        items = [entry.item for entry in self.retries.pending(bridge=self, target=old)]
+        lane = self.lanes.pop(old, None)
+        if lane:
+            self.lanes[new] = lane
+            lane.target = new
+            items.extend(lane.items)
+            items.extend(lane.heads.values())
+            items.extend(i for held in lane.pending.values() for i in held)
+            items.extend(lane.current)
+            breaker = getattr(lane, "breaker", None)
+            if breaker and breaker is not get_breaker(self._breaker_key(new)):
+                # parked items get checked by the breaker of the new service
+                parked = breaker.discard(lane)
+                lane.breaker = get_breaker(self._breaker_key(new))
+                for item in parked:
+                    lane.retry(item)
+                items.extend(parked)
+            elif breaker:
+                items.extend(item for parked_lane, item in breaker.parked if parked_lane is lane)
+        key = get_hash(conf)
+        unique = list({id(item): item for item in items}.values())
+        for item in unique:
+            item["target"] = new
+            record = item.get("outbox")
+            if record and record["target"] != key:
+                record["target"] = key
+                if self.outbox:
+                    asyncio.ensure_future(self.outbox.put(record))
+        return len(unique)
+
+    def reconfigure(self, config, targets, *, replaced=None):
+        """Applies changed target configuration *config* to the running bridge.
+
+        :param config: new configuration of the bridge, with an unchanged source
+        :param targets: target clients in order of the targets in *config*, existing targets \
+                        of the bridge are kept, missing ones are removed.
+        :param replaced: dict of old and new clients of targets with changed settings, see \
+                         :func:`replace_target`"""
+        for old, new in (replaced or {}).items():
+            self.replace_target(old, new, config["targets"][targets.index(new)])
+        for target in [t for t in self.targets if t not in targets]:
+            self.remove_target(target)
+        for target in [t for t in targets if t not in self.targets]:
+            self.add_target(target)
+        self.targets = list(targets)
+        self.config = config
+        self.hash = get_hash(config)
+        logger.info("Reconfigured {} with {} targets.".format(self, len(self.targets)))
+
+    async def listen_ws(self, callback=None):
+        await self.replay()
+        return asyncio.Task(self.source.listen(callback or self.new_posts))
 
-    async def check_posts(self):
+    async def replay(self, *, wait=True):
+        """Re-enqueues pending items of the bridge from the outbox, only once after start. With \
+           *wait*, it waits for capacity of the delivery queues while intake is paused."""
+        if self.replayed or not self.outbox:
+            return 0
+        self.replayed = True
+        targets = {self._target_key(t): t for t in self.targets}
+        count = 0
+        for record in await self.outbox.pending(self.outbox_key):
+            target = targets.get(record["target"])
+            if not target or not self.outbox.claim(record):
+                # target belongs to another bridge with the same source or item is still in flight
+                continue
+            post = self.outbox.restore(record)
+            if not post:
+                continue
+            if self.paused and wait:
+                await self._capacity.wait()
+            await self._put_to_queue({"post": post, "target": target, "count": record["count"], "outbox": record})
+            count += 1
+        if count:
+            logger.info("Replayed {} pending deliveries of {} from outbox.".format(count, self))
+            metrics.incr("outbox_replayed", count, bridge=self.hash)
+        return count
+
+    async def check_posts(self, bridges=None):
+        """Polls the source and hands new posts to *bridges* sharing the source, defaults to \
+           this bridge only."""
+        bridges = bridges or [self]
+        self.last_poll_count = None
+        if self.draining:
+            return True
+        if any(bridge.paused for bridge in bridges):
+            # backpressure, don't hold a poll slot while waiting for capacity
+            logger.warning("Skipping poll of {}, intake is paused.".format(self))
+            metrics.incr("poll_skipped", reason="backpressure", bridge=self.hash)
+            return True
         try:
-            posts = await self.source.poll()
+            # a fetched batch is enqueued completely, the next poll waits for capacity
+            for bridge in bridges:
+                await bridge.replay(wait=False)
+            if self.poll_timeout:
+                # don't let a hanging source block the bridge
+                posts = await asyncio.wait_for(self.source.poll(), self.poll_timeout)
+            else:
+                posts = await self.source.poll()
+            self.last_poll_count = len(posts) if posts else 0
             if posts:
-                await self.new_posts(posts)
+                await asyncio.gather(*[bridge.new_posts(posts, wait=False) for bridge in bridges])
+        except asyncio.TimeoutError:
+            logger.warning("Polling {} timed out after {} seconds.".format(self, self.poll_timeout))
+            metrics.incr("poll_timeouts_total", source=getattr(self.source, "type", "-"), bridge=self.hash)
         except Exception as exc:
             logger.error("Fatal checking {}{}".format(getattr(self, "endpoint", "-"), self.source_id))
             logger.exception(exc)
         return True
 
-    async def _sleep(self, seconds):
+    def _check_backpressure(self):
+        if not self.queue_size:
+            return
+        if not self.paused and self.saturated:
+            logger.warning("Delivery queue of {} saturated, pausing intake.".format(self))
+            self.paused = True
+            self._capacity.clear()
+            metrics.incr("delivery_backpressure_total", bridge=self.hash)
+        elif self.paused and all(len(lane) <= self.queue_size // 2 for lane in self.lanes.values()):
+            logger.info("Delivery queue of {} drained, resuming intake.".format(self))
+            self.paused = False
+            self._capacity.set()
+        else:
+            return
+        metrics.set("delivery_backpressure", int(self.paused), bridge=self.hash, label=self.label)
+        if self.source.mode == "streaming":
+            asyncio.ensure_future(self._signal_source(self.paused))
+
+    async def _signal_source(self, pause):
         try:
-            task = asyncio.ensure_future(asyncio.sleep(seconds))
-            self.sleep_tasks.append(task)
-            await task
-        except asyncio.CancelledError:
-            pass
-        finally:
-            self.sleep_tasks.remove(task)
+            if pause:
+                await self.source.pause()
+            else:
+                await self.source.resume()
+        except Exception as exc:
+            logger.error("Signalling backpressure to {} failed: {}".format(self.source, exc))
+
+    def _get_lane(self, target):
+        if target not in self.lanes:
+            batch_size = getattr(target, "batch_size", 1)
+            if isinstance(batch_size, int) and batch_size > 1:
+                lane = DeliveryLane(self, target, self._process_lane_item,
+                                    process_batch=self._process_lane_batch, batch_size=batch_size)
+            else:
+                lane = DeliveryLane(self, target, self._process_lane_item)
+            lane.breaker = get_breaker(self._breaker_key(target))
+            self.lanes[target] = lane
+        return self.lanes[target]
+
+    def _breaker_key(self, target):
+        key = getattr(target, "breaker_key", None)
+        if isinstance(key, str):
+            return key
+        return "{}:{}".format(getattr(target, "type", "-"), target.target_id)
+
+    def _check_breaker(self, lane, items):
+        """Parks *items*, when the target is not available."""
+        breaker = getattr(lane, "breaker", None)
+        if breaker and breaker.allow() is False:
+            for item in items:
+                breaker.park(lane, item)
+            return False
         return True
 
-    async def _action_done(self, future, item):
-        # set task as done
-        self.queue.task_done()
+    def _record_breaker(self, lane, errors):
+        breaker = getattr(lane, "breaker", None)
+        if not breaker:
+            return
+        if any(e is None or isinstance(e, InvalidTargetResource) for e in errors):
+            breaker.success()
+        else:
+            breaker.failure()
 
-        # handle action result
-        exc = future.exception()
-        if exc and type(exc) is InvalidTargetResource:
+    async def _process_lane_item(self, lane, item):
+        if not self._check_breaker(lane, [item]):
+            return
+        error = None
+        try:
+            await item["target"].handle_post(item["post"])
+        except Exception as exc:
+            error = exc
+        self._record_breaker(lane, [error])
+        await self._finish_lane_item(lane, item, error)
+
+    async def _process_lane_batch(self, lane, items):
+        if not self._check_breaker(lane, items):
+            return
+        try:
+            errors = await lane.target.handle_posts([item["post"] for item in items])
+        except Exception as exc:
+            errors = [exc] * len(items)
+        self._record_breaker(lane, errors)
+        for item, error in zip(items, errors):
+            await self._finish_lane_item(lane, item, error)
+
+    async def _finish_lane_item(self, lane, item, exc=None):
+        record = item.get("outbox")
+        if lane.stopped is True and item["target"] not in self.targets:
+            # target was removed while the item was in flight
+            if record:
+                await self.outbox.remove(record)
+            return
+        if isinstance(exc, InvalidTargetResource):
             logger.warning("POST {post.id} not distributed to {target.target_id} [{count}], no retry.".format(**item))
             logger.warning(exc)
-        elif exc:
+        elif exc is not None:
             logger.error("TARGET ACTION FAILED, WILL RETRY: [{}] {} {} [{}]".format(
                 item["count"], item["post"], item["target"], exc))
+            breaker = getattr(lane, "breaker", None)
+            if breaker and breaker.state == OPEN:
+                # target is down, wait for it without using up retries
+                breaker.park(lane, item)
+                return
             if item["count"] >= self.max_retries:
                 logger.info("DISTRIBUTION ABORTED: {post.id} {target.target_id} [{count}]".format(**item))
+                if record:
+                    await self.outbox.bury(record)
+                    record = None
             else:
                 item["count"] = item["count"] + 1
-                await self._sleep(self.retry_multiplier * item["count"])
-                await self._put_to_queue(item)
+                if record:
+                    record["count"] = item["count"]
+                    await self.outbox.put(record)
+                # post stays busy in its lane until the retry is done
+                self.retries.schedule(item, lane.retry, bridge=self)
+                return
         else:
             logger.info("POST {post.id} distributed to {target.target_id} [{count}]".format(**item))
+        if record:
+            await self.outbox.remove(record)
+        lane.done(item)
+        self._check_backpressure()
+        if self.draining:
+            self._check_idle()
 
     async def _put_to_queue(self, item):
-        if not self.queue_task:
-            self.queue_task = asyncio.ensure_future(self._queue_consumer())
-        await self.queue.put(item)
+        if self.outbox and "outbox" not in item:
+            # persist item before accepting it for delivery
+            item["outbox"] = self.outbox.record(self.outbox_key, self._target_key(item["target"]), item)
+            await self.outbox.put(item["outbox"])
+        superseded = self._get_lane(item["target"]).put(item)
+        if superseded:
+            kind = "delete" if item["post"].is_deleted is True else "update"
+            logger.info("POST {post.id} for {target.target_id} replaced {} queued versions.".format(
+                len(superseded), **item))
+            metrics.incr("delivery_coalesced_total", len(superseded), bridge=self.hash, kind=kind)
+            for old in superseded:
+                if old.get("outbox"):
+                    await self.outbox.remove(old["outbox"])
+        self._check_backpressure()
 
-    async def _process_action(self, task):
-        fut = asyncio.ensure_future(task["target"].handle_post(task["post"]))
-        callback = lambda fn: asyncio.ensure_future(self._action_done(fn, task))
-        fut.add_done_callback(callback)
+    async def _prefetch(self, posts):
+        """Reads the stored docs of *posts* with one storage request per target.
 
-    async def _queue_consumer(self):
-        try:
-            while True:
-                task = await self.queue.get()
-                asyncio.ensure_future(self._process_action(task))
-        except asyncio.CancelledError:
-            pass
-        except Exception as exc:
-            logger.error("WORKER QUEUE FAILED: {}".format(exc))
-            logger.exception(exc)
+        :returns: dict of target and dict of post id and doc, None is used as doc of unknown posts. \
+            Posts busy in the lane of a target are left out, the delivery changes their docs."""
+        async def prefetch(target):
+            lane = self._get_lane(target)
+            post_ids = [post.id for post in posts if not lane.is_busy(post.id)]
+            if not post_ids:
+                return None
+            try:
+                docs = await target.prefetch_posts(post_ids)
+            except Exception as exc:
+                logger.warning("Prefetching {} posts for {} failed: {}".format(len(post_ids), target, exc))
+                return None
+            if not isinstance(docs, dict):
+                return None
+            # storages may return ids as strings
+            docs = {str(post_id): doc for post_id, doc in docs.items()}
+            return {post_id: docs.get(str(post_id)) for post_id in post_ids}
+
+        targets = list(self.targets)
+        return dict(zip(targets, await asyncio.gather(*[prefetch(target) for target in targets])))
 
-    async def new_posts(self, posts):
+    async def new_posts(self, posts, *, wait=True):
+        if self.draining:
+            logger.warning("Ignoring {} posts from {}, bridge is stopping.".format(len(posts), self.source))
+            return
         try:
             logger.info("##### Received {} posts from {}".format(len(posts), self.source))
+            prefetched = await self._prefetch(posts)
+            seen = set()
             for new_post in posts:
-                for target in self.targets:
-                    post = copy.deepcopy(new_post)
+                if self.paused and wait:
+                    # wait until delivery queues have drained
+                    await self._capacity.wait()
+                for target in list(self.targets):
+                    if target not in self.targets:
+                        # removed while waiting for the outbox
+                        continue
+                    post = new_post.view()
+                    docs = prefetched.get(target)
+                    if docs is not None and post.id in docs and post.id not in seen \
+                            and not self._get_lane(target).is_busy(post.id):
+                        post.set_existing(docs[post.id], prefetched=True)
                     item = {"post": post, "target": target, "count": 0}
                     await self._put_to_queue(item)
-                # wait until post is processed
-                await self.queue.join()
+                seen.add(new_post.id)
+                if not self.pipelined:
+                    # wait until post is processed
+                    await asyncio.gather(*[lane.join() for lane in self.lanes.values()])
         except Exception as exc:
             logger.error("Handling new posts failed [{}]: {}".format(self.source, exc))
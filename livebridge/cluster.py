@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import bisect
+import logging
+import os
+import socket
+import time
+from livebridge.config import CLUSTER_NODE, CLUSTER_LEASE_TTL, CLUSTER_LEASE_CONCURRENCY
+from livebridge.components import get_db_client, get_hash, get_source_key
+from livebridge.controller import Controller
+from livebridge.metrics import metrics
+from livebridge.supervisor import Supervisor
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing(object):
+    """Consistent hash ring of cluster nodes, every node is placed *replicas* times on the ring.
+
+    When a node joins or leaves, only the keys between the node and its neighbours move."""
+
+    def __init__(self, nodes, *, replicas=64):
+        self.nodes = sorted(set(nodes))
+        self.ring = sorted((self._hash("{}:{}".format(node, x)), node) for node in self.nodes for x in range(replicas))
+        self.points = [point for point, node in self.ring]
+
+    def _hash(self, key):
+        return int(get_hash(key), 16)
+
+    def node_for(self, key):
+        """Returns the node responsible for *key*, None if the ring is empty."""
+        if not self.ring:
+            return None
+        pos = bisect.bisect(self.points, self._hash(key)) % len(self.ring)
+        return self.ring[pos][1]
+
+
+class ClusterMixin(object):
+    """Runs only a share of the bridges of the control data on this node of a cluster.
+
+    Nodes announce themselves by a lease **node:[id]**, which is renewed every third of
+    **LB_CLUSTER_LEASE_TTL**. Bridges are distributed by their source over the live nodes by a
+    :class:`HashRing`, a node runs the bridges of a source only while holding the lease
+    **source:[key]**, written with a conditional write to the storage. Up to
+    **LB_CLUSTER_LEASE_CONCURRENCY** leases are renewed at once. Bridges moving to another node
+    are stopped before their lease is released, bridges of dead nodes are taken over after their
+    leases expired."""
+
+    def __init__(self, *args, **kwargs):
+        super(ClusterMixin, self).__init__(*args, **kwargs)
+        self.node_id = CLUSTER_NODE or "{}-{}".format(socket.gethostname(), os.getpid())
+        self.lease_ttl = CLUSTER_LEASE_TTL
+        self.lease_concurrency = CLUSTER_LEASE_CONCURRENCY
+        self.lease_db = get_db_client()
+        self.candidates = {}
+        self.owned = {}
+        self.expires = {}
+        self.members = []
+        self.cluster_timer = None
+        self._rebalancing = asyncio.Lock()
+
+    @property
+    def renew_interval(self):
+        return self.lease_ttl / 3
+
+    async def run(self):
+        if not self.cluster_timer:
+            self._watch_cluster()
+        return await super(ClusterMixin, self).run()
+
+    def _watch_cluster(self):
+        def callback():
+            asyncio.ensure_future(self._renew())
+        self.cluster_timer = asyncio.get_event_loop().call_later(self.renew_interval, callback)
+
+    async def _renew(self):
+        if self.shutdown is True:
+            return
+        try:
+            await self.rebalance()
+        except Exception as exc:
+            logger.error("[CLUSTER] Rebalancing failed: {}".format(exc))
+            logger.exception(exc)
+        self._watch_cluster()
+
+    async def add_bridges(self, bridge_configs):
+        for bridge_config in bridge_configs:
+            self.candidates[get_hash(bridge_config)] = bridge_config
+        await self.rebalance()
+
+    async def remove_bridges(self, bridge_configs):
+        for bridge_config in bridge_configs:
+            self.candidates.pop(get_hash(bridge_config), None)
+        await self.rebalance()
+
+    async def update_bridges(self, changes):
+        # changed bridges keep their source, so they stay on this node with the lease of their source
+        async with self._rebalancing:
+            running = []
+            for change in changes:
+                old_hash, new_hash = get_hash(change["old"]), get_hash(change["new"])
+                self.candidates.pop(old_hash, None)
+                self.candidates[new_hash] = change["new"]
+                if self.owned.pop(old_hash, None) is not None:
+                    self.owned[new_hash] = change["new"]
+                    running.append(change)
+            if running:
+                await super(ClusterMixin, self).update_bridges(running)
+
+    async def heartbeat(self):
+        """Renews the lease of this node and returns the ids of all live nodes."""
+        now = time.time()
+        alive = await self.lease_db.acquire_lease("node:" + self.node_id, self.node_id, now + self.lease_ttl, now)
+        members = {lease["owner"] for lease in await self.lease_db.get_leases(prefix="node:")
+                   if lease["expires"] >= now}
+        if alive:
+            members.add(self.node_id)
+        else:
+            logger.error("[CLUSTER] Renewing lease of node {} failed.".format(self.node_id))
+            members.discard(self.node_id)
+        return sorted(members)
+
+    async def _bounded(self, func, keys):
+        # runs lease requests concurrently, but not more than lease_concurrency at once
+        semaphore = asyncio.Semaphore(max(1, self.lease_concurrency))
+
+        async def run(key):
+            async with semaphore:
+                return await func(key)
+        return dict(zip(keys, await asyncio.gather(*[run(key) for key in keys])))
+
+    async def _acquire(self, source_key):
+        now = time.time()
+        if await self.lease_db.acquire_lease("source:" + source_key, self.node_id, now + self.lease_ttl, now):
+            return now + self.lease_ttl
+        return None
+
+    async def _release(self, source_key):
+        return await self.lease_db.release_lease("source:" + source_key, self.node_id)
+
+    async def rebalance(self):
+        """Acquires and renews leases of the sources assigned to this node, stops bridges \
+           assigned to other nodes and bridges with lost leases."""
+        async with self._rebalancing:
+            started = time.time()
+            members = await self.heartbeat()
+            if members != self.members:
+                logger.info("[CLUSTER] Nodes: {}".format(", ".join(members) or "-"))
+                self.members = members
+            ring = HashRing(members)
+            # bridges of the same source run on the same node, where they share the source and its lease
+            sources = {}
+            for bridge_hash, bridge_config in self.candidates.items():
+                source_key = get_source_key(bridge_config)
+                if ring.node_for(source_key) == self.node_id:
+                    sources.setdefault(source_key, []).append(bridge_hash)
+            to_start, to_stop = [], []
+            for bridge_hash in list(self.owned):
+                if bridge_hash not in self.candidates or get_source_key(self.owned[bridge_hash]) not in sources:
+                    to_stop.append(bridge_hash)
+            to_release = [key for key in self.expires if key not in sources]
+            leases = await self._bounded(self._acquire, list(sources))
+            now = time.time()
+            for source_key, bridge_hashes in sources.items():
+                if leases[source_key]:
+                    self.expires[source_key] = leases[source_key]
+                    to_start.extend(h for h in bridge_hashes if h not in self.owned)
+                elif source_key in self.expires and now + self.renew_interval >= self.expires[source_key]:
+                    # lease can expire before the next renewal, another node may take over
+                    logger.error("[CLUSTER] Lost lease of source {}.".format(source_key))
+                    del self.expires[source_key]
+                    to_stop.extend(h for h in bridge_hashes if h in self.owned)
+            if to_stop:
+                stopped = [self.owned.pop(bridge_hash) for bridge_hash in to_stop]
+                await super(ClusterMixin, self).remove_bridges(stopped)
+            if to_release:
+                for source_key in to_release:
+                    del self.expires[source_key]
+                await self._bounded(self._release, to_release)
+            if to_start:
+                for bridge_hash in to_start:
+                    self.owned[bridge_hash] = self.candidates[bridge_hash]
+                await super(ClusterMixin, self).add_bridges([self.candidates[h] for h in to_start])
+            if to_start or to_stop:
+                logger.info("[CLUSTER] Started {} and stopped {} bridges, running {} of {}.".format(
+                    len(to_start), len(to_stop), len(self.owned), len(self.candidates)))
+            duration = time.time() - started
+            metrics.observe("cluster_rebalance_seconds", duration)
+            if duration > self.renew_interval:
+                logger.warning("[CLUSTER] Renewing {} leases took {:.1f}s, more than the renewal interval of "
+                               "{:.1f}s. Raise LB_CLUSTER_LEASE_CONCURRENCY or the throughput of the lease "
+                               "storage.".format(len(sources), duration, self.renew_interval))
+            metrics.set("cluster_nodes", len(members))
+            metrics.set("cluster_sources", len(self.expires), node=self.node_id)
+            metrics.set("cluster_bridges", len(self.owned), node=self.node_id)
+
+    async def clean_shutdown(self):
+        if self.cluster_timer:
+            self.cluster_timer.cancel()
+        await super(ClusterMixin, self).clean_shutdown()
+        # bridges are stopped, other nodes can take over
+        await self._bounded(self._release, list(self.expires))
+        self.owned = {}
+        self.expires = {}
+        await self.lease_db.release_lease("node:" + self.node_id, self.node_id)
+
+
+class ClusterController(ClusterMixin, Controller):
+    """:class:`livebridge.controller.Controller` running its share of bridges in a cluster."""
+
+
+class ClusterSupervisor(ClusterMixin, Supervisor):
+    """:class:`livebridge.supervisor.Supervisor` running its share of bridges in a cluster."""
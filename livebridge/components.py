@@ -16,6 +16,7 @@
 import hashlib
 import logging
 from livebridge import config
+from livebridge.limits import get_limiter
 from livebridge.storages import DynamoClient, SQLStorage, MongoStorage, DummyStorage
 
 
@@ -24,6 +25,7 @@ logger = logging.getLogger(__name__)
 
 SOURCE_MAP = {}
 CONVERTER_MAP = {}
+CONVERTERS = {}
 POST_MAP = {}
 TARGET_MAP = {}
 
@@ -44,10 +46,15 @@ def add_source(cls):
 
 def get_converter(source, target):
     try:
-        return CONVERTER_MAP[source][target]()
+        converter_cls = CONVERTER_MAP[source][target]
     except KeyError:
         logger.error("No converter found for {} -> {}".format(source, target))
-    return None
+        return None
+    # converters keep no state per post, all targets share one instance
+    converter = CONVERTERS.get((source, target))
+    if type(converter) is not converter_cls:
+        converter = CONVERTERS[(source, target)] = converter_cls()
+    return converter
 
 
 def add_converter(cls):
@@ -69,6 +76,10 @@ def get_target(conf):
     if TARGET_MAP.get(conf.get("type")):
         target_cls = TARGET_MAP[conf.get("type")]
         client = target_cls(config=conf)
+        # limits of single target from control data, shared by bridges with the same target entry
+        client.limiter = get_limiter(get_hash(conf), conf)
+        # targets using the same service share a circuit breaker
+        client.breaker_key = "{}:{}".format(conf.get("type"), get_hash([conf.get("endpoint"), conf.get("auth")]))
     else:
         logger.error("No target client found for {}.".format(conf))
     return client
@@ -93,5 +104,16 @@ def get_db_client(**kwargs):
     return DynamoClient(**params)
 
 
+def reset_db_clients():
+    """Drops the shared storage clients and their connections, needed in forked worker processes."""
+    for cls in [DynamoClient, SQLStorage, MongoStorage, DummyStorage]:
+        cls._instance = None
+
+
 def get_hash(data):
     return hashlib.md5(str(data).encode("utf-8")).hexdigest()
+
+
+def get_source_key(conf):
+    """Returns identity of the source of bridge config *conf*, derived from its type, endpoint and source_id."""
+    return get_hash([conf.get("type"), conf.get("endpoint"), conf.get("source_id")])
@@ -24,14 +24,58 @@ CONTROLFILE_WATCH = bool(os.environ.get("LB_CONTROLFILE_WATCH"))
 
 POLL_INTERVAL = int(os.environ.get("LB_POLL_INTERVAL", 60))
 POLL_CONTROL_INTERVAL = int(os.environ.get("LB_POLL_CONTROL_INTERVAL", 60))
+POLL_CONCURRENCY = int(os.environ.get("LB_POLL_CONCURRENCY", 20))
+POLL_JITTER = float(os.environ.get("LB_POLL_JITTER", 1.0))
+POLL_TIMEOUT = int(os.environ.get("LB_POLL_TIMEOUT", 300))
+POLL_OVERRUN = os.environ.get("LB_POLL_OVERRUN", "remaining")
 
 RETRY_MULTIPLIER = int(os.environ.get("LB_RETRY_MULTIPLIER", 5))
+RETRY_MAX_DELAY = int(os.environ.get("LB_RETRY_MAX_DELAY", 300))
 MAX_RETRIES = int(os.environ.get("LB_MAX_RETRIES", 10))
 
+BREAKER_THRESHOLD = int(os.environ.get("LB_BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN = int(os.environ.get("LB_BREAKER_COOLDOWN", 60))
+
+WORKERS = int(os.environ.get("LB_WORKERS", 0))
+
+DELIVERY_MODE = os.environ.get("LB_DELIVERY_MODE", "pipelined")
+DELIVERY_WORKERS = int(os.environ.get("LB_DELIVERY_WORKERS", 50))
+DELIVERY_QUEUE_SIZE = int(os.environ.get("LB_DELIVERY_QUEUE_SIZE", 0))
+DRAIN_TIMEOUT = float(os.environ.get("LB_DRAIN_TIMEOUT", 10))
+
+CLUSTER = bool(os.environ.get("LB_CLUSTER"))
+CLUSTER_NODE = os.environ.get("LB_CLUSTER_NODE")
+CLUSTER_LEASE_TTL = int(os.environ.get("LB_CLUSTER_LEASE_TTL", 30))
+CLUSTER_LEASE_CONCURRENCY = int(os.environ.get("LB_CLUSTER_LEASE_CONCURRENCY", 20))
+
+KNOWN_POSTS_CHUNK_SIZE = int(os.environ.get("LB_KNOWN_POSTS_CHUNK_SIZE", 0))
+KNOWN_POSTS_CONCURRENCY = int(os.environ.get("LB_KNOWN_POSTS_CONCURRENCY", 4))
+KNOWN_POSTS_CACHE_SIZE = int(os.environ.get("LB_KNOWN_POSTS_CACHE_SIZE", 10000))
+KNOWN_POSTS_BLOOM = bool(os.environ.get("LB_KNOWN_POSTS_BLOOM"))
+KNOWN_POSTS_BLOOM_ERROR = float(os.environ.get("LB_KNOWN_POSTS_BLOOM_ERROR", 0.01))
+
+LAST_UPDATED_CACHE = os.environ.get("LB_LAST_UPDATED_CACHE", "local")
+LAST_UPDATED_TTL = float(os.environ.get("LB_LAST_UPDATED_TTL", 60))
+
+CONVERSION_CACHE_TTL = float(os.environ.get("LB_CONVERSION_CACHE_TTL", 30))
+
+IMAGE_CACHE_PATH = os.environ.get("LB_IMAGE_CACHE_PATH", "/tmp/livebridge-images")
+IMAGE_CACHE_SIZE = int(os.environ.get("LB_IMAGE_CACHE_SIZE", 512))
+IMAGE_CACHE_TTL = int(os.environ.get("LB_IMAGE_CACHE_TTL", 3600))
+IMAGE_CACHE_MAX_AGE = int(os.environ.get("LB_IMAGE_CACHE_MAX_AGE", 60))
+IMAGE_DOWNLOAD_CONCURRENCY = int(os.environ.get("LB_IMAGE_DOWNLOAD_CONCURRENCY", 8))
+IMAGE_DOWNLOAD_TIMEOUT = int(os.environ.get("LB_IMAGE_DOWNLOAD_TIMEOUT", 60))
+IMAGE_MAX_SIZE = int(os.environ.get("LB_IMAGE_MAX_SIZE", 20))
+
+OUTBOX = os.environ.get("LB_OUTBOX")
+OUTBOX_PATH = os.environ.get("LB_OUTBOX_PATH", "livebridge-outbox.db")
+
 DB = {
     "dsn": os.environ.get("LB_DB_DSN"),
     "table_name": os.environ.get("LB_DB_TABLE", "livebridge_dev"),
-    "control_table_name": os.environ.get("LB_DB_CONTROL_TABLE")
+    "control_table_name": os.environ.get("LB_DB_CONTROL_TABLE"),
+    "outbox_table_name": os.environ.get("LB_DB_OUTBOX_TABLE"),
+    "lease_table_name": os.environ.get("LB_DB_LEASE_TABLE"),
 }
 
 AWS = {
@@ -41,6 +85,10 @@ AWS = {
     "endpoint_url": os.environ.get("LB_DYNAMO_ENDPOINT"),
     "table_name": os.environ.get("LB_DYNAMO_TABLE", "livebridge-dev"),
     "control_table_name": os.environ.get("LB_DYNAMO_CONTROL_TABLE"),
+    "outbox_table_name": os.environ.get("LB_DYNAMO_OUTBOX_TABLE"),
+    "lease_table_name": os.environ.get("LB_DYNAMO_LEASE_TABLE"),
+    "lease_read_capacity": int(os.environ.get("LB_DYNAMO_LEASE_RCU", 5)),
+    "lease_write_capacity": int(os.environ.get("LB_DYNAMO_LEASE_WCU", 25)),
     "sqs_s3_queue": os.environ.get("LB_SQS_S3_QUEUE", ""),
 }
 
@@ -50,5 +98,6 @@ WEB = {
     "auth": {
         "user": os.environ.get("LB_WEB_USER"),
         "password": os.environ.get("LB_WEB_PWD")
-    }
+    },
+    "hook_secret": os.environ.get("LB_WEB_HOOK_SECRET"),
 }
@@ -24,6 +24,9 @@ from livebridge.controldata.storage import StorageControl
 
 logger = logging.getLogger(__name__)
 
+# keys of target configs, which change a running target instead of replacing it
+TARGET_SETTINGS = ("auth", "label", "concurrency", "rate_limit", "rate_burst")
+
 
 class ControlData(object):
 
@@ -39,6 +42,7 @@ class ControlData(object):
         self.control_data = {}
         self.new_bridges = []
         self.removed_bridges = []
+        self.changed_bridges = []
 
     async def close(self):
         if self.control_client:
@@ -73,6 +77,8 @@ class ControlData(object):
     def _remove_doubles(self, control_data):
         bridges = []
         filtered = {"auth": control_data.get("auth", {}), "bridges": []}
+        if "limits" in control_data:
+            filtered["limits"] = control_data["limits"]
         # clear double source->target connections
         for bridge in control_data.get("bridges", []):
             # filter sources
@@ -92,6 +98,8 @@ class ControlData(object):
 
     def _remove_inactives(self, control_data):
         actives = {"auth": control_data.get("auth", {}), "bridges": []}
+        if "limits" in control_data:
+            actives["limits"] = control_data["limits"]
         for x, bridge in enumerate(control_data.get("bridges",[])):
             if bridge.get("active") != False:
                 actives["bridges"].append(copy.deepcopy(bridge))
@@ -126,8 +134,55 @@ class ControlData(object):
                             if n not in self.control_data.get("bridges", [])]
         self.removed_bridges = [OrderedDict(r) for r in self.control_data.get("bridges", [])
                                 if r not in control_data.get("bridges", [])]
+        self.changed_bridges = self._pair_changes()
         self.control_data = control_data
 
+    def _source_part(self, bridge):
+        source = copy.deepcopy(dict(bridge))
+        source.pop("targets", None)
+        return source
+
+    def _target_identity(self, target):
+        # settings of a target can change without making it another target
+        return {k: v for k, v in target.items() if k not in TARGET_SETTINGS}
+
+    def _pair_targets(self, added, removed):
+        """Pairs added and removed targets with the same identity and takes them out of \
+           *added* and *removed*."""
+        changed = []
+        for old in list(removed):
+            identity = self._target_identity(old)
+            new = next((t for t in added if self._target_identity(t) == identity), None)
+            if new is None:
+                continue
+            changed.append({"old": old, "new": new})
+            removed.remove(old)
+            added.remove(new)
+        return changed
+
+    def _pair_changes(self):
+        """Pairs removed and new bridges with the same source, which differ only by their \
+           targets, and takes them out of new and removed bridges."""
+        changes = []
+        for old in list(self.removed_bridges):
+            source = self._source_part(old)
+            new = next((n for n in self.new_bridges if self._source_part(n) == source), None)
+            if new is None:
+                continue
+            old_targets, new_targets = old.get("targets", []), new.get("targets", [])
+            added = [t for t in new_targets if t not in old_targets]
+            removed = [t for t in old_targets if t not in new_targets]
+            changes.append({
+                "old": old,
+                "new": new,
+                "changed": self._pair_targets(added, removed),
+                "added": added,
+                "removed": removed,
+            })
+            self.removed_bridges.remove(old)
+            self.new_bridges.remove(new)
+        return changes
+
     async def save(self, path, data):
         if self.control_client is None:
             await self._set_client(path)
@@ -139,6 +194,18 @@ class ControlData(object):
     def list_removed_bridges(self):
         return self.removed_bridges
 
+    def list_changed_bridges(self):
+        """Returns bridges with changed targets, as dicts with keys **old** and **new** config, \
+           the **added** and **removed** target configs and the **changed** targets as dicts \
+           with **old** and **new** target config. Targets are changed, when only their \
+           settings like **auth** or limits differ, but not their type or the keys \
+           identifying them, like **target_id** or **endpoint**."""
+        return self.changed_bridges
+
+    def list_limits(self):
+        """Returns limits per target type, see :func:`livebridge.limits.set_type_limits`."""
+        return self.control_data.get("limits", {})
+
     def list_bridges(self):
         return self.control_data.get("bridges", [])
 
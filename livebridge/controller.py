@@ -15,15 +15,29 @@
 # limitations under the License.
 import asyncio
 import logging
-from livebridge.components import get_target, get_hash
+from livebridge.components import get_target, get_hash, get_db_client
 from livebridge.bridge import LiveBridge
 from livebridge.controldata import ControlData
+from livebridge.conversions import get_conversion_cache
+from livebridge.delivery import get_scheduler
+from livebridge.downloads import get_downloader
+from livebridge.images import get_image_cache
+from livebridge.lastupdated import get_last_updated_index
+from livebridge.limits import set_type_limits
+from livebridge.metrics import metrics
+from livebridge.multiplex import SharedSource
+from livebridge.outbox import get_outbox
+from livebridge.polling import get_poll_scheduler, AdaptiveInterval
+from livebridge.retries import get_retry_scheduler
 
 logger = logging.getLogger(__name__)
 
 
 class Controller(object):
 
+    # bridges run in this process, not in worker processes
+    runs_bridges = True
+
     def __init__(self, config, control_file):
         self.config = config
         self.control_file = control_file
@@ -36,23 +50,69 @@ class Controller(object):
         self.retry_run_interval = 30
         self.control_data = None  # access to data from control file
         self.watch_timer = None
+        self._shutdown_event = None
         self.shutdown = False
+        self.drain_timeout = config.DRAIN_TIMEOUT
+        self.sources = {}
+        self._stopped = None
+
+    @property
+    def shutdown(self):
+        return self._shutdown
+
+    @shutdown.setter
+    def shutdown(self, value):
+        self._shutdown = value
+        if self._shutdown_event is not None:
+            if value is True:
+                self._shutdown_event.set()
+            else:
+                self._shutdown_event.clear()
+
+    async def wait_shutdown(self):
+        """Waits until shutdown is requested, without waking up before."""
+        if self.shutdown is True:
+            return
+        if self._shutdown_event is None:
+            self._shutdown_event = asyncio.Event()
+        await self._shutdown_event.wait()
 
     async def clean_shutdown(self):
         logger.info("Requesting proper shutdown of tasks.")
         self.shutdown = True
+        self._stopped = asyncio.Event()
+        if not self.bridges:
+            self._stopped.set()
         await self.close_control_data()
         await self.stop_bridges()
-        while len(self.bridges) > 0:
-            logger.debug("Running bridges left: {}".format(len(self.bridges)))
-            await asyncio.sleep(1)
+        try:
+            # runners end after their current poll
+            await asyncio.wait_for(self._stopped.wait(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Running bridges left: {}".format(len(self.bridges)))
+        get_poll_scheduler().stop()
+        get_retry_scheduler().stop()
+        get_scheduler().stop()
+        await get_conversion_cache().clear()
+        await get_image_cache().clear()
+        await get_downloader().close()
+        if get_outbox():
+            await get_outbox().close()
 
     async def stop_bridges(self):
-        """Stop all sleep tasks to allow bridges to end."""
+        """Stop all sleep tasks to allow bridges to end and drain their deliveries."""
         for task in self.sleep_tasks:
             task.cancel()
-        for bridge in self.bridges:
-            bridge.stop()
+        await self.drain_bridges(list(self.bridges))
+
+    async def drain_bridges(self, bridges):
+        """Drains *bridges* concurrently within **LB_DRAIN_TIMEOUT**."""
+        if not bridges:
+            return
+        started = asyncio.get_event_loop().time()
+        results = await asyncio.gather(*[bridge.drain(self.drain_timeout) for bridge in bridges])
+        logger.info("Drained {} bridges in {:.2f}s, {} with undelivered posts.".format(
+            len(bridges), asyncio.get_event_loop().time() - started, results.count(False)))
 
     async def read_control_data(self):
         if self.watch_timer:
@@ -113,7 +173,9 @@ class Controller(object):
         if loaded and self.control_data:
             try:
                 logger.info("Using fetched control data.")
+                self.set_limits(self.control_data.list_limits())
                 await self.remove_old_bridges()
+                await self.update_changed_bridges()
                 await self.add_new_bridges()
                 if self.control_data.is_auto_update() is True or \
                         self.force_check_control_data is True:
@@ -128,24 +190,100 @@ class Controller(object):
         self.tasked.append(asyncio.Task(self.retry_run()))
         return False
 
+    def set_limits(self, limits):
+        """Applies limits per target type from the control data."""
+        set_type_limits(limits)
+
     async def add_new_bridges(self):
+        await self.add_bridges(self.control_data.list_new_bridges())
+
+    async def add_bridges(self, bridge_configs):
+        await self.load_last_updated(bridge_configs)
         # append content bridges
-        for bridge_config in self.control_data.list_new_bridges():
+        for bridge_config in bridge_configs:
             bridge = self.append_bridge(bridge_config)
             self.tasked.append(asyncio.Task(self.bridges[bridge]))
 
+    async def load_last_updated(self, bridge_configs):
+        # sources of new bridges read their last updated timestamp from the index
+        index = get_last_updated_index()
+        source_ids = [c["source_id"] for c in bridge_configs if c.get("source_id") is not None]
+        if index is None or not source_ids:
+            return
+        try:
+            await index.load(get_db_client(), source_ids)
+        except Exception as exc:
+            logger.error("Loading last updated timestamps failed: {}".format(exc))
+
     async def remove_old_bridges(self):
+        await self.remove_bridges(self.control_data.list_removed_bridges())
+
+    async def remove_bridges(self, bridge_configs):
         # identify removed bridges
-        removed = [get_hash(c) for c in self.control_data.list_removed_bridges()]
+        removed = [get_hash(c) for c in bridge_configs]
         to_stop = [bridge for bridge in self.bridges if bridge.hash in removed]
         # stop removed bridges
         for bridge in to_stop:
             self.bridges[bridge].close()
             await self.remove_bridge(bridge)
-            bridge.stop()
+        await self.drain_bridges(to_stop)
+
+    async def update_changed_bridges(self):
+        await self.update_bridges(self.control_data.list_changed_bridges())
+
+    async def update_bridges(self, changes):
+        # patch targets of running bridges, the source keeps running
+        for change in changes:
+            old_hash = get_hash(change["old"])
+            bridge = next((b for b in self.bridges if b.hash == old_hash), None)
+            if bridge is None:
+                logger.warning("Bridge {} to update is not running, adding it.".format(old_hash))
+                await self.add_bridges([change["new"]])
+                continue
+            old_targets = change["old"].get("targets", [])
+            # changed targets get a new client, which takes over the deliveries of the old one
+            changed = {get_hash(c["new"]): c["old"] for c in change.get("changed", [])}
+            targets, replaced = [], {}
+            for tconf in change["new"].get("targets", []):
+                old_conf = tconf if tconf in old_targets else changed.get(get_hash(tconf))
+                pos = old_targets.index(old_conf) if old_conf is not None else len(bridge.targets)
+                if pos >= len(bridge.targets):
+                    targets.append(get_target(tconf))
+                elif old_conf == tconf:
+                    targets.append(bridge.targets[pos])
+                else:
+                    target = get_target(tconf)
+                    if target is not None:
+                        replaced[bridge.targets[pos]] = target
+                    targets.append(target)
+            bridge.reconfigure(change["new"], targets, replaced=replaced)
+            logger.info("UPDATED: {} added {}, changed {} and removed {} targets.".format(
+                bridge, len(change["added"]), len(replaced), len(change["removed"])))
+
+    def share_source(self, bridge):
+        """Adds *bridge* to the :class:`livebridge.multiplex.SharedSource` of its source key."""
+        shared = self.sources.get(bridge.source_key)
+        if shared is None:
+            shared = self.sources[bridge.source_key] = SharedSource(bridge.source_key)
+        shared.add(bridge)
+        return shared
+
+    def _schedule_source(self, shared):
+        # poll shared source at the shortest interval of its bridges
+        scheduler = get_poll_scheduler()
+        bridge, settings = shared.poll_settings()
+        if bridge is None:
+            scheduler.remove(shared)
+            shared.scheduled = None
+        elif bridge is not shared.scheduled or shared not in scheduler.entries:
+            interval, adaptive, overrun = settings
+            scheduler.add(shared, interval, self.poll, adaptive=adaptive, overrun=overrun)
+            shared.scheduled = bridge
+        return scheduler.entries.get(shared)
 
     def append_bridge(self, config_data):
         bridge = LiveBridge(config_data)
+        self.share_source(bridge)
         for tconf in config_data.get("targets", []):
             target_client = get_target(tconf)
             bridge.add_target(target_client)
@@ -155,13 +293,19 @@ class Controller(object):
         elif bridge.source.mode == "polling":
             # custom source polling intervall set in control file?
             poll_interval = config_data["poll_interval"] if config_data.get("poll_interval") else self.poll_interval
-            self.bridges[bridge] = self.run_poller(bridge=bridge, interval=poll_interval)
+            adaptive = AdaptiveInterval.from_config(config_data, poll_interval)
+            self.bridges[bridge] = self.run_poller(bridge=bridge, interval=poll_interval, adaptive=adaptive,
+                                                   overrun=config_data.get("poll_overrun"))
         return bridge
 
     async def remove_bridge(self, bridge):
+        shared = self.sources.get(bridge.source_key)
+        in_use = shared.remove(bridge) if shared else False
+        if shared and not in_use:
+            del self.sources[bridge.source_key]
         try:
-            # special treatment for bridges with stop method
-            if hasattr(bridge.source, "stop"):
+            # special treatment for bridges with stop method, unless other bridges use the source
+            if hasattr(bridge.source, "stop") and not in_use:
                 await bridge.source.stop()
         except Exception as exc:
             logger.error("Error when stopping stream: {}".format(exc))
@@ -169,25 +313,60 @@ class Controller(object):
 
         logger.info("ENDING: {}".format(bridge))
         del self.bridges[bridge]
+        if self._stopped and not self.bridges:
+            self._stopped.set()
 
     async def run_stream(self, *, bridge):
-        await bridge.listen_ws()
-
-        while True and self.shutdown is not True:
-            # wait for shutdown
-            await self.sleep(4)
+        shared = self.share_source(bridge)
+        if shared.listener is None:
+            # one stream for all bridges of the source
+            shared.listener = await bridge.listen_ws(callback=shared.new_posts)
+        else:
+            await bridge.replay()
 
+        await self.wait_shutdown()
         await self.remove_bridge(bridge)
 
-    async def run_poller(self, *, bridge, interval=180):
-        # initialize liveblogs to watch
-        while True and self.shutdown is not True:
-            # logger.debug("Checked new posts for {} on {}".format(bridge.source_id, bridge.endpoint))
-            await bridge.check_posts()
-            await self.sleep(interval)
+    async def run_poller(self, *, bridge, interval=180, adaptive=None, overrun=None):
+        # polls are run by the process-wide poll scheduler, once for all bridges of a source
+        shared = self.share_source(bridge)
+        shared.polls[bridge] = (interval, adaptive, overrun)
+        entry = self._schedule_source(shared)
+        try:
+            # the scheduler entry runs the polls, the bridge only waits for its end
+            await self.wait_shutdown()
+        finally:
+            shared.polls.pop(bridge, None)
+            self._schedule_source(shared)
 
+        if entry.task:
+            # let running poll finish
+            await asyncio.wait([entry.task])
         await self.remove_bridge(bridge)
 
+    def wake(self, key):
+        """Polls bridges right away, see :func:`livebridge.polling.PollScheduler.wake`. *key* is \
+           either the hash or the source id of a bridge or the key of its source, bridges sharing \
+           a source are polled together.
+
+        :returns: number of polls woken up"""
+        scheduler = get_poll_scheduler()
+        entries = [b for b in list(scheduler.entries)
+                   if key in [b.hash, str(getattr(b, "source_id", None))] + list(getattr(b, "hashes", []))]
+        for entry in entries:
+            scheduler.wake(entry)
+        return len(entries)
+
+    async def poll(self, bridge):
+        # logger.debug("Checked new posts for {} on {}".format(bridge.source_id, bridge.endpoint))
+        if bridge.saturated is True:
+            # backpressure, skip poll until delivery queues drained
+            logger.warning("Skipping poll of {}, delivery queue is saturated.".format(bridge))
+            metrics.incr("poll_skipped", reason="backpressure", bridge=bridge.hash)
+            return None
+        await bridge.check_posts()
+        return bridge.last_poll_count
+
     async def sleep(self, seconds):
         if self.shutdown is True:
             # if shutdown is requested, don't fall asleep again
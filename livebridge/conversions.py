@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import logging
+from livebridge.components import get_hash
+from livebridge.config import CONVERSION_CACHE_TTL
+from livebridge.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SharedConversion(object):
+    """Conversion of a source post for a target type, shared by all targets of that type.
+
+    :param key: tuple of source type, target type and hash of the post data
+    :param converter: converter running the conversion"""
+
+    def __init__(self, key, converter):
+        self.key = key
+        self.converter = converter
+        self.task = None
+        self.refs = 0
+        self.expiry = None
+
+    def __repr__(self):
+        return "<SharedConversion {} refs={}>".format(self.key, self.refs)
+
+    @property
+    def result(self):
+        """:class:`livebridge.base.ConversionResult` of the finished conversion."""
+        return self.task.result()
+
+    @property
+    def converted(self):
+        return self.task.done() and not self.task.cancelled() and not self.task.exception()
+
+
+class ConversionCache(object):
+    """Converts every source post once per target type.
+
+    Conversions are keyed by source type, target type and hash of the post data. Concurrent
+    requests for the same key wait for a single conversion. Every consumer holds a reference
+    until :func:`release`, images of a conversion are removed *ttl* seconds after the last
+    consumer released it, so targets of the same type delivering a post shortly after another
+    reuse the conversion and its images.
+
+    :param ttl: seconds an unused conversion is kept, **0** removes it at once"""
+
+    def __init__(self, *, ttl=CONVERSION_CACHE_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.loop = asyncio.get_event_loop()
+
+    def __repr__(self):
+        return "<ConversionCache [{}]>".format(len(self.entries))
+
+    async def acquire(self, converter, post, target_type):
+        """Converts *post* with *converter* or waits for the conversion running already.
+
+        :returns: :class:`SharedConversion`, which has to be released by :func:`release`."""
+        key = (post.source, target_type, get_hash(post.data))
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = SharedConversion(key, converter)
+            entry.task = asyncio.ensure_future(converter.convert(post.data))
+            metrics.incr("conversion_cache_total", result="miss")
+        else:
+            metrics.incr("conversion_cache_total", result="hit")
+        entry.refs += 1
+        if entry.expiry:
+            entry.expiry.cancel()
+            entry.expiry = None
+        try:
+            # other consumers keep waiting, when this one gets cancelled
+            await asyncio.shield(entry.task)
+        except BaseException:
+            # also cancelled consumers, CancelledError is no Exception since Python 3.8
+            entry.task.add_done_callback(lambda task: self._unref(entry))
+            raise
+        return entry
+
+    async def release(self, entry):
+        """Releases the reference of a consumer, which is done with the images of *entry*."""
+        if entry.refs == 1 and self.ttl <= 0:
+            entry.refs = 0
+            await self._remove(entry)
+        else:
+            self._unref(entry)
+
+    def _unref(self, entry):
+        entry.refs -= 1
+        if entry.task.cancelled() or entry.task.exception():
+            # failed conversions get retried
+            self._drop(entry)
+        elif entry.refs <= 0:
+            entry.expiry = self.loop.call_later(max(0, self.ttl), self._expire, entry)
+
+    def _expire(self, entry):
+        entry.expiry = None
+        if entry.refs <= 0:
+            asyncio.ensure_future(self._remove(entry))
+
+    def _drop(self, entry):
+        if self.entries.get(entry.key) is entry:
+            del self.entries[entry.key]
+
+    async def _remove(self, entry):
+        self._drop(entry)
+        if entry.converted:
+            await entry.converter.remove_images(entry.result.images)
+
+    async def clear(self):
+        """Removes all unused conversions and their images."""
+        for entry in list(self.entries.values()):
+            if entry.refs <= 0:
+                if entry.expiry:
+                    entry.expiry.cancel()
+                await self._remove(entry)
+
+    def collect(self):
+        yield ("conversions_cached", {}, len(self.entries))
+
+
+_cache = None
+
+
+def get_conversion_cache():
+    """Returns the process-wide :class:`ConversionCache`."""
+    global _cache
+    if _cache is None or _cache.loop is not asyncio.get_event_loop():
+        if _cache is not None:
+            metrics.remove_collector(_cache.collect)
+        _cache = ConversionCache()
+        metrics.add_collector(_cache.collect)
+    return _cache
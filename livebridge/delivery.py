@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import logging
+from collections import deque, OrderedDict
+from livebridge.config import DELIVERY_WORKERS
+from livebridge.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryLane(object):
+    """Ordered delivery lane for a single target of a bridge.
+
+    Items are handed one after another to *process* by the workers of the
+    :class:`DeliveryScheduler`. While an item of a post is in flight or waiting for a retry,
+    later items of the same post are held back, so that create, update and delete of a post
+    reach the target in the order they were received.
+
+    Newer versions of a post replace older ones, which are still queued, held back or waiting
+    for a retry. Only the newest version is delivered, its action decides whether the post
+    gets created, updated or deleted at the target.
+
+    :param bridge: bridge the lane belongs to
+    :type :class:`livebridge.bridge.LiveBridge`
+    :param target: target the lane delivers to
+    :type :class:`livebridge.base.BaseTarget`
+    :param process: coroutine function, called with the lane and the item to deliver.
+    :param scheduler: scheduler running the lane, defaults to the process-wide scheduler.
+    :param process_batch: coroutine function, called with the lane and a list of up to \
+        *batch_size* items of different posts. Used instead of *process*, when given.
+    :param batch_size: max. number of items handed to *process_batch* at once."""
+
+    def __init__(self, bridge, target, process, *, scheduler=None, process_batch=None, batch_size=1):
+        self.bridge = bridge
+        self.target = target
+        self.process = process
+        self.process_batch = process_batch
+        self.batch_size = batch_size if process_batch else 1
+        self.scheduler = scheduler or get_scheduler()
+        self.items = deque()
+        self.pending = {}
+        self.heads = {}
+        self.current = []
+        self.coalesced = 0
+        self.active = False
+        self.ready = False
+        self.stopped = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.scheduler.add_lane(self)
+
+    def __repr__(self):
+        return "<DeliveryLane {} [{}]>".format(self.target, len(self))
+
+    def __len__(self):
+        """Number of posts with items queued, in flight or waiting for retry."""
+        return sum(len(items) + 1 for items in self.pending.values())
+
+    def put(self, item):
+        """Adds new item to the lane, holds it back when the post is already busy.
+
+        :returns: list of items replaced by *item*"""
+        post_id = item["post"].id
+        if post_id not in self.pending:
+            self.pending[post_id] = []
+            self.heads[post_id] = item
+            self._enqueue(item)
+            return []
+        superseded = self.pending[post_id]
+        head = self.heads[post_id]
+        if any(head is item for item in self.current):
+            # in flight, deliver newest version afterwards
+            self.pending[post_id] = [item]
+        else:
+            # queued or waiting for retry, replace in place to keep its position
+            self.pending[post_id] = []
+            superseded.append(dict(head))
+            head.clear()
+            head.update(item)
+        self.coalesced += len(superseded)
+        return superseded
+
+    def is_busy(self, post_id):
+        """True, while an item of the post is queued, in flight or waiting for a retry."""
+        return post_id in self.pending
+
+    def retry(self, item):
+        """Re-enqueues an item, which failed before. The post is still busy."""
+        self._enqueue(item)
+
+    def done(self, item):
+        """Marks item as finished and releases the next held back item of the same post."""
+        post_id = item["post"].id
+        waiting = self.pending.get(post_id)
+        if waiting:
+            self.heads[post_id] = waiting.pop(0)
+            self._enqueue(self.heads[post_id])
+        else:
+            self.pending.pop(post_id, None)
+            self.heads.pop(post_id, None)
+
+    def stop(self):
+        self.stopped = True
+        self.items.clear()
+        self._idle.set()
+        self.scheduler.remove_lane(self)
+
+    async def join(self):
+        """Waits until all queued items of the lane were processed."""
+        await self._idle.wait()
+
+    def _enqueue(self, item):
+        if self.stopped:
+            logger.warning("Lane stopped, dropping {post.id} for {target.target_id}".format(**item))
+            return
+        self.items.append(item)
+        self._idle.clear()
+        self.scheduler.schedule(self)
+
+    def _next(self):
+        """Returns list of next items to deliver, up to *batch_size*."""
+        self.current = [self.items.popleft() for _ in range(min(self.batch_size, len(self.items)))]
+        self.active = True
+        return self.current
+
+    def _finished(self):
+        self.active = False
+        self.current = []
+        if self.items:
+            self.scheduler.schedule(self)
+        else:
+            self._idle.set()
+
+
+class DeliveryScheduler(object):
+    """Process-wide pool of delivery workers.
+
+    Bridges submit their items into :class:`DeliveryLane` objects, lanes with queued items
+    are served by a fixed number of workers. Bridges are served round-robin, so a bridge
+    with a large backlog does not starve the others. A lane is handled by only one worker
+    at a time, which keeps the order of items per target.
+
+    :param workers: number of concurrent deliveries."""
+
+    def __init__(self, workers=DELIVERY_WORKERS):
+        self.workers = workers
+        self.lanes = {}
+        self.ready = OrderedDict()
+        self.busy = 0
+        self.tasks = []
+        self.loop = asyncio.get_event_loop()
+        self._ready_count = asyncio.Semaphore(0)
+
+    def __repr__(self):
+        return "<DeliveryScheduler workers={} busy={} queued={}>".format(self.workers, self.busy, self.queued)
+
+    @property
+    def queued(self):
+        return sum(len(lane.items) for lanes in self.lanes.values() for lane in lanes)
+
+    def add_lane(self, lane):
+        self.lanes.setdefault(lane.bridge, []).append(lane)
+
+    def remove_lane(self, lane):
+        lanes = self.lanes.get(lane.bridge, [])
+        if lane in lanes:
+            lanes.remove(lane)
+        if not lanes:
+            self.lanes.pop(lane.bridge, None)
+
+    def schedule(self, lane):
+        """Marks *lane* as ready to get served by a worker."""
+        if lane.ready or lane.active or lane.stopped:
+            return
+        lane.ready = True
+        self.ready.setdefault(lane.bridge, deque()).append(lane)
+        self._ready_count.release()
+        self._start()
+
+    def _start(self):
+        if self.tasks:
+            return
+        logger.info("Starting {} delivery workers.".format(self.workers))
+        self.tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        metrics.add_collector(self.collect)
+
+    def _next_lane(self):
+        # round-robin over bridges
+        bridge, lanes = next(iter(self.ready.items()))
+        lane = lanes.popleft()
+        if lanes:
+            self.ready.move_to_end(bridge)
+        else:
+            del self.ready[bridge]
+        lane.ready = False
+        return lane
+
+    async def _work(self):
+        while True:
+            await self._ready_count.acquire()
+            lane = self._next_lane()
+            if lane.stopped or not lane.items:
+                continue
+            items = lane._next()
+            self.busy += 1
+            try:
+                if lane.process_batch:
+                    await lane.process_batch(lane, items)
+                else:
+                    await lane.process(lane, items[0])
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error("DELIVERY FAILED: {}".format(exc))
+                logger.exception(exc)
+            finally:
+                self.busy -= 1
+                lane._finished()
+
+    def stats(self):
+        """Returns queue depth per bridge."""
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "queued": self.queued,
+            "bridges": {bridge: sum(len(lane) for lane in lanes) for bridge, lanes in self.lanes.items()},
+        }
+
+    def collect(self):
+        yield ("delivery_workers", {}, self.workers)
+        yield ("delivery_workers_busy", {}, self.busy)
+        yield ("delivery_queued", {}, self.queued)
+        for bridge, lanes in self.lanes.items():
+            labels = {"bridge": getattr(bridge, "hash", str(bridge)), "label": getattr(bridge, "label", "-")}
+            yield ("delivery_queue_depth", labels, sum(len(lane) for lane in lanes))
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        metrics.remove_collector(self.collect)
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """Returns the process-wide :class:`DeliveryScheduler`."""
+    global _scheduler
+    if _scheduler is None or _scheduler.loop is not asyncio.get_event_loop():
+        _scheduler = DeliveryScheduler()
+    return _scheduler
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+import aiohttp
+from livebridge.config import IMAGE_DOWNLOAD_CONCURRENCY, IMAGE_DOWNLOAD_TIMEOUT, IMAGE_MAX_SIZE
+from livebridge.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(IOError):
+    """Raised when a download fails, exceeds the max. size or times out."""
+
+
+class Download(object):
+    """Result of :func:`Downloader.download`.
+
+    :param status: HTTP status of the response
+    :param headers: headers of the response
+    :param path: path of the downloaded file, None without body
+    :param digest: SHA-256 hex digest of the body
+    :param size: size of the body in bytes"""
+
+    def __init__(self, status, headers, path=None, digest=None, size=0):
+        self.status = status
+        self.headers = headers
+        self.path = path
+        self.digest = digest
+        self.size = size
+
+
+class Downloader(object):
+    """Downloads files with one pooled HTTP session shared by the process.
+
+    At most *concurrency* downloads run at once, bodies are streamed to disk in chunks with
+    the file I/O running in the default executor, so large images don't block the event loop.
+    Downloads taking longer than *timeout* seconds or exceeding *max_size* bytes fail with
+    a :class:`DownloadError`.
+
+    :param concurrency: max. number of concurrent downloads
+    :param timeout: max. duration of a download in seconds
+    :param max_size: max. size of a download in bytes"""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, *, concurrency=IMAGE_DOWNLOAD_CONCURRENCY, timeout=IMAGE_DOWNLOAD_TIMEOUT,
+                 max_size=IMAGE_MAX_SIZE * 1024 * 1024):
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.max_size = max_size
+        self.loop = asyncio.get_event_loop()
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = None
+
+    def __repr__(self):
+        return "<Downloader concurrency={}>".format(self.concurrency)
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def download(self, url, directory, *, headers=None):
+        """Downloads *url* into a new file in *directory*.
+
+        :param url: url of the file
+        :param directory: directory of the downloaded file
+        :param headers: request headers, for conditional requests for example
+        :returns: :class:`Download`, the caller takes care of the file"""
+        async with self.semaphore:
+            try:
+                return await asyncio.wait_for(self._download(url, directory, headers or {}), self.timeout)
+            except asyncio.TimeoutError:
+                metrics.incr("image_downloads_total", result="timeout")
+                raise DownloadError("Downloading {} timed out after {} seconds.".format(url, self.timeout))
+
+    async def _download(self, url, directory, headers):
+        async with self._get_session().get(url, headers=headers) as resp:
+            if resp.status != 200:
+                metrics.incr("image_downloads_total", result=str(resp.status))
+                return Download(resp.status, resp.headers)
+            if (resp.content_length or 0) > self.max_size:
+                metrics.incr("image_downloads_total", result="too_large")
+                raise DownloadError("{} exceeds max. size with {} bytes.".format(url, resp.content_length))
+            await self.loop.run_in_executor(None, lambda: os.makedirs(directory, exist_ok=True))
+            path = os.path.join(directory, "{}.part".format(uuid.uuid4()))
+            file = await self.loop.run_in_executor(None, open, path, "wb")
+            digest, size = hashlib.sha256(), 0
+            try:
+                async for chunk in resp.content.iter_chunked(self.chunk_size):
+                    size += len(chunk)
+                    if size > self.max_size:
+                        metrics.incr("image_downloads_total", result="too_large")
+                        raise DownloadError("{} exceeds max. size of {} bytes.".format(url, self.max_size))
+                    digest.update(chunk)
+                    await self.loop.run_in_executor(None, file.write, chunk)
+            except BaseException:
+                await self.loop.run_in_executor(None, file.close)
+                await self.loop.run_in_executor(None, os.remove, path)
+                raise
+            await self.loop.run_in_executor(None, file.close)
+            metrics.incr("image_downloads_total", result="200")
+            metrics.incr("image_download_bytes_total", size)
+            return Download(resp.status, resp.headers, path, digest.hexdigest(), size)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+_downloader = None
+
+
+def get_downloader():
+    """Returns the process-wide :class:`Downloader`."""
+    global _downloader
+    if _downloader is None or _downloader.loop is not asyncio.get_event_loop():
+        _downloader = Downloader()
+    return _downloader
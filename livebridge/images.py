@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import functools
+import logging
+import os
+import shutil
+import time
+from livebridge.config import IMAGE_CACHE_PATH, IMAGE_CACHE_SIZE, IMAGE_CACHE_TTL, IMAGE_CACHE_MAX_AGE
+from livebridge.downloads import get_downloader
+from livebridge.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+        logger.info("Removed image {}".format(path))
+    except FileNotFoundError:
+        pass
+
+
+class CachedImage(object):
+    """Image file of the :class:`ImageCache`, named by the hash of its content."""
+
+    def __init__(self, digest, path, size):
+        self.digest = digest
+        self.path = path
+        self.size = size
+        self.refs = 0
+        self.used = time.time()
+
+    def __repr__(self):
+        return "<CachedImage {} refs={}>".format(self.path, self.refs)
+
+
+class CachedUrl(object):
+    """Validators of an image url, used for conditional requests."""
+
+    def __init__(self, digest, etag=None, last_modified=None):
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+        self.validated = time.time()
+
+
+class ImageCache(object):
+    """Cache of downloaded images, shared by all converters of the process.
+
+    Images are stored once per content under the hash of their content, so converters get the
+    same path for the same image. Downloads are streamed to disk by the shared
+    :class:`livebridge.downloads.Downloader`. Urls validated within *max_age* seconds are used without a
+    request, older ones are revalidated by **ETag** and **Last-Modified**. Every
+    :func:`get` holds a reference on the file until :func:`release`, unused files are removed
+    *ttl* seconds after their last use or when the cache exceeds *max_size* bytes. Files are
+    removed in the default executor, expired files are evicted periodically also without traffic.
+
+    :param path: directory of the cache, a subdirectory per process is used
+    :param max_size: max. size of all files in bytes
+    :param ttl: seconds an unused file is kept
+    :param max_age: seconds an image is used without revalidation"""
+
+    def __init__(self, path=IMAGE_CACHE_PATH, *, max_size=IMAGE_CACHE_SIZE * 1024 * 1024,
+                 ttl=IMAGE_CACHE_TTL, max_age=IMAGE_CACHE_MAX_AGE):
+        # forked workers must not remove files of each other
+        self.path = os.path.join(path, str(os.getpid()))
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_age = max_age
+        self.files = {}
+        self.paths = {}
+        self.urls = {}
+        self.size = 0
+        self.locks = {}
+        self.waiting = {}
+        self.removing = {}
+        self.evict_interval = max(1, min(self.ttl, 60))
+        self.evict_timer = None
+        self.loop = asyncio.get_event_loop()
+        # left over by a former process with the same pid
+        self.cleaning = self.loop.run_in_executor(None, shutil.rmtree, self.path, True)
+
+    def __repr__(self):
+        return "<ImageCache {} [{}]>".format(self.path, len(self.files))
+
+    async def get(self, url, *, ext=""):
+        """Returns path of the image at *url*, downloads or revalidates it if needed.
+
+        :param url: url of the image
+        :param ext: file extension, used when the image gets stored
+        :returns: path of the image file, has to be released by :func:`release`"""
+        # concurrent requests of an url wait for a single download
+        lock = self.locks.setdefault(url, asyncio.Lock())
+        self.waiting[url] = self.waiting.get(url, 0) + 1
+        try:
+            async with lock:
+                image = await self._load(url, ext)
+                image.refs += 1
+                image.used = time.time()
+        finally:
+            self.waiting[url] -= 1
+            if not self.waiting[url]:
+                del self.waiting[url]
+                del self.locks[url]
+        self._evict()
+        if self.evict_timer is None:
+            self._schedule_evict()
+        return image.path
+
+    async def _load(self, url, ext):
+        entry = self.urls.get(url)
+        image = self.files.get(entry.digest) if entry else None
+        if image and time.time() - entry.validated < self.max_age:
+            metrics.incr("image_cache_total", result="hit")
+            return image
+        headers = {}
+        if image and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if image and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        await self.cleaning
+        try:
+            download = await self._fetch(url, headers)
+        except Exception as exc:
+            if not image:
+                raise
+            logger.warning("Revalidating image {} failed, using cached file: {}".format(url, exc))
+            return image
+        if download.status == 304 and image:
+            entry.validated = time.time()
+            metrics.incr("image_cache_total", result="revalidated")
+            return image
+        if download.status != 200:
+            raise IOError("Downloading image {} failed with status {}.".format(url, download.status))
+        image = await self._store(download, ext)
+        self.urls[url] = CachedUrl(image.digest, download.headers.get("ETag"), download.headers.get("Last-Modified"))
+        metrics.incr("image_cache_total", result="miss")
+        return image
+
+    async def _fetch(self, url, headers):
+        return await get_downloader().download(url, self.path, headers=headers)
+
+    async def _store(self, download, ext):
+        image = self.files.get(download.digest)
+        if image:
+            # same content under another url
+            await self.loop.run_in_executor(None, os.remove, download.path)
+            return image
+        path = os.path.join(self.path, download.digest + ext)
+        if path in self.removing:
+            # evicted file of the same content
+            await self.removing[path]
+        await self.loop.run_in_executor(None, os.replace, download.path, path)
+        image = self.files[download.digest] = self.paths[path] = CachedImage(download.digest, path, download.size)
+        self.size += image.size
+        logger.info("Stored image {}".format(path))
+        return image
+
+    def release(self, path):
+        """Releases a reference on the image file *path*.
+
+        :returns: False, if *path* isn't a file of the cache."""
+        image = self.paths.get(path)
+        if image is None:
+            return False
+        image.refs = max(0, image.refs - 1)
+        image.used = time.time()
+        self._evict()
+        return True
+
+    def _schedule_evict(self):
+        self.evict_timer = self.loop.call_later(self.evict_interval, self._evict_expired)
+
+    def _evict_expired(self):
+        self.evict_timer = None
+        self._evict()
+        if self.files:
+            self._schedule_evict()
+
+    def _evict(self):
+        now = time.time()
+        for image in sorted((i for i in self.files.values() if i.refs <= 0), key=lambda i: i.used):
+            if self.size > self.max_size or now - image.used > self.ttl:
+                self._remove(image)
+
+    def _remove(self, image):
+        future = self.removing[image.path] = self.loop.run_in_executor(None, _remove_file, image.path)
+        future.add_done_callback(functools.partial(self._removed, image.path))
+        del self.files[image.digest]
+        del self.paths[image.path]
+        self.size -= image.size
+        for url in [url for url, entry in self.urls.items() if entry.digest == image.digest]:
+            del self.urls[url]
+
+    def _removed(self, path, future):
+        if self.removing.get(path) is future:
+            del self.removing[path]
+
+    async def clear(self):
+        """Removes all files of the cache."""
+        if self.evict_timer:
+            self.evict_timer.cancel()
+            self.evict_timer = None
+        for image in list(self.files.values()):
+            self._remove(image)
+        await self.wait_removed()
+        await self.loop.run_in_executor(None, shutil.rmtree, self.path, True)
+
+    async def wait_removed(self):
+        """Waits until pending removals of files are done."""
+        await asyncio.gather(self.cleaning, *list(self.removing.values()))
+
+    def collect(self):
+        yield ("image_cache_files", {}, len(self.files))
+        yield ("image_cache_bytes", {}, self.size)
+
+
+_cache = None
+
+
+def get_image_cache():
+    """Returns the process-wide :class:`ImageCache`."""
+    global _cache
+    if _cache is None or _cache.loop is not asyncio.get_event_loop():
+        if _cache is not None:
+            metrics.remove_collector(_cache.collect)
+        _cache = ImageCache()
+        metrics.add_collector(_cache.collect)
+    return _cache
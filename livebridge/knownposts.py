@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import logging
+import math
+from collections import OrderedDict
+from livebridge.config import KNOWN_POSTS_CACHE_SIZE, KNOWN_POSTS_BLOOM, KNOWN_POSTS_BLOOM_ERROR
+from livebridge.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter(object):
+    """Bloom filter for *capacity* keys with a false positive rate of *error_rate*.
+
+    Keys, which were not added, are reported as missing with a probability of 1 - *error_rate*,
+    added keys are always found."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(1, capacity)
+        self.bits = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / self.capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # double hashing, see Kirsch and Mitzenmacher
+        digest = hashlib.md5(str(key).encode("utf-8")).digest()
+        first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        return [(first + x * second) % self.bits for x in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.array[pos // 8] |= 1 << (pos % 8)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.array[pos // 8] & (1 << (pos % 8)) for pos in self._positions(key))
+
+
+class KnownPosts(object):
+    """Cache of post ids of a source, which are known by the storage.
+
+    Up to *size* ids are kept, least recently used ones are dropped first. With *bloom*, all
+    ids of the source are loaded into a :class:`BloomFilter` by :func:`warm`, ids missing in
+    the filter are unknown without asking the storage.
+
+    :param source_id: id of the source
+    :param size: max. number of cached ids
+    :param bloom: use Bloom filter for unknown ids"""
+
+    def __init__(self, source_id, *, size=KNOWN_POSTS_CACHE_SIZE, bloom=KNOWN_POSTS_BLOOM):
+        self.source_id = source_id
+        self.size = size
+        self.use_bloom = bloom
+        self.ids = OrderedDict()
+        self.bloom = None
+        self.warmed = False
+
+    def __repr__(self):
+        return "<KnownPosts {} [{}]>".format(self.source_id, len(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    async def warm(self, db_client):
+        """Loads known ids of the source from *db_client*, when the storage supports it."""
+        self.warmed = True
+        try:
+            post_ids = await db_client.get_source_post_ids(self.source_id)
+        except NotImplementedError:
+            return False
+        except Exception as exc:
+            logger.error("Warming known posts of {} failed: {}".format(self.source_id, exc))
+            return False
+        if post_ids is None:
+            # an empty filter would report all posts as unknown
+            return False
+        if self.use_bloom:
+            self.bloom = BloomFilter(max(10000, 2 * (len(post_ids) + len(self.ids))), KNOWN_POSTS_BLOOM_ERROR)
+            for post_id in self.ids:
+                self.bloom.add(post_id)
+        self.add(post_ids[-self.size:] if self.bloom is None else post_ids)
+        logger.info("Loaded {} known posts of {}.".format(len(post_ids), self.source_id))
+        return True
+
+    def lookup(self, post_ids):
+        """Splits *post_ids* into known and unknown ids and ids, which have to be looked up \
+           in the storage.
+
+        :returns: tuple of set of known ids, set of unknown ids and list of ids to look up"""
+        known, unknown, missing = set(), set(), []
+        for post_id in post_ids:
+            if post_id in self.ids:
+                self.ids.move_to_end(post_id)
+                known.add(post_id)
+            elif self.bloom is not None and post_id not in self.bloom:
+                unknown.add(post_id)
+            else:
+                missing.append(post_id)
+        for result, ids in [("hit", known), ("bloom", unknown), ("miss", missing)]:
+            if ids:
+                metrics.incr("known_posts_cache_total", len(ids), result=result)
+        return known, unknown, missing
+
+    def add(self, post_ids):
+        """Adds *post_ids*, which are known by the storage now."""
+        for post_id in post_ids:
+            if self.bloom is not None and post_id not in self.bloom:
+                self.bloom.add(post_id)
+                if self.bloom.count > self.bloom.capacity:
+                    # too full for reliable answers, ask the storage again
+                    logger.info("Bloom filter of known posts of {} is full.".format(self.source_id))
+                    self.bloom = None
+            self.ids[post_id] = True
+            self.ids.move_to_end(post_id)
+        while len(self.ids) > self.size:
+            self.ids.popitem(last=False)
+
+    def discard(self, post_id):
+        """Drops *post_id*, the storage gets asked again on the next lookup."""
+        self.ids.pop(post_id, None)
+
+
+_caches = {}
+
+
+def get_known_posts(source_id):
+    """Returns the process-wide :class:`KnownPosts` of *source_id*, None if disabled \
+       by **LB_KNOWN_POSTS_CACHE_SIZE**."""
+    if not KNOWN_POSTS_CACHE_SIZE:
+        return None
+    cache = _caches.get(source_id)
+    if cache is None:
+        cache = _caches[source_id] = KnownPosts(source_id)
+        metrics.add_collector(collect)
+    return cache
+
+
+def remember_posts(source_id, post_ids):
+    """Adds *post_ids*, which got stored for *source_id*, to the cache of the source, if cached."""
+    cache = _caches.get(source_id)
+    if cache is not None:
+        cache.add(post_ids)
+
+
+def forget_post(post_id):
+    """Drops *post_id* from the caches of all sources, when it got deleted in the storage."""
+    for cache in _caches.values():
+        cache.discard(post_id)
+
+
+def clear_known_posts():
+    _caches.clear()
+
+
+def collect():
+    yield ("known_posts_cached", {}, sum(len(cache) for cache in _caches.values()))
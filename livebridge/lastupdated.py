@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import time
+from livebridge.config import LAST_UPDATED_CACHE, LAST_UPDATED_TTL
+from livebridge.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MODES = ("local", "shared", "off")
+
+
+def _latest(one, two):
+    if one is None:
+        return two
+    if two is None:
+        return one
+    try:
+        return max(one, two)
+    except TypeError:
+        # naive and aware datetimes, trust the newer write
+        return two
+
+
+class LastUpdatedIndex(object):
+    """Process-local index of the latest updated-timestamp of every source.
+
+    Entries are loaded by :func:`load` when bridges get started and advanced by every post
+    written by the targets, so polling sources don't read the timestamp from the storage.
+
+    With *mode* **local**, entries are valid until the process ends, which is correct as long
+    as only this process writes posts of its sources. With **shared**, entries are read from
+    the storage again after *ttl* seconds, for posts written by other instances.
+
+    :param mode: **local** or **shared**
+    :param ttl: max. age of entries in seconds in mode **shared**"""
+
+    def __init__(self, *, mode=LAST_UPDATED_CACHE, ttl=LAST_UPDATED_TTL):
+        self.mode = mode
+        self.ttl = ttl
+        self.entries = {}
+
+    def __repr__(self):
+        return "<LastUpdatedIndex {} [{}]>".format(self.mode, len(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def fresh(self, source_id):
+        """Returns True, when the entry of *source_id* can be used without asking the storage."""
+        entry = self.entries.get(str(source_id))
+        if entry is None:
+            return False
+        return self.mode != "shared" or time.time() - entry[1] < self.ttl
+
+    def get(self, source_id):
+        entry = self.entries.get(str(source_id))
+        return entry[0] if entry else None
+
+    def set(self, source_id, updated):
+        """Sets the timestamp of *source_id* as read from the storage."""
+        entry = self.entries.get(str(source_id))
+        self.entries[str(source_id)] = (_latest(entry[0] if entry else None, updated), time.time())
+
+    def advance(self, source_id, updated):
+        """Advances the timestamp of *source_id* after a post got written. Sources without \
+           entry are ignored, the storage may know newer posts."""
+        entry = self.entries.get(str(source_id))
+        if entry is not None:
+            self.entries[str(source_id)] = (_latest(entry[0], updated), entry[1])
+
+    async def load(self, db_client, source_ids):
+        """Loads timestamps of *source_ids* with one request from *db_client*."""
+        source_ids = list(set(source_ids))
+        if not source_ids:
+            return False
+        try:
+            timestamps = await db_client.get_last_updated_sources(source_ids)
+        except Exception as exc:
+            logger.error("Loading last updated timestamps failed: {}".format(exc))
+            return False
+        if timestamps is None:
+            return False
+        timestamps = {str(key): value for key, value in timestamps.items()}
+        for source_id in source_ids:
+            self.set(source_id, timestamps.get(str(source_id)))
+        logger.info("Loaded last updated timestamps of {} sources.".format(len(source_ids)))
+        return True
+
+
+_index = None
+
+
+def get_last_updated_index():
+    """Returns the process-wide :class:`LastUpdatedIndex`, None if disabled by \
+       **LB_LAST_UPDATED_CACHE**."""
+    global _index
+    if LAST_UPDATED_CACHE == "off":
+        return None
+    if _index is None:
+        if LAST_UPDATED_CACHE not in MODES:
+            logger.warning("Unknown LB_LAST_UPDATED_CACHE {}, using local.".format(LAST_UPDATED_CACHE))
+        _index = LastUpdatedIndex(mode="shared" if LAST_UPDATED_CACHE == "shared" else "local")
+        metrics.add_collector(collect)
+    return _index
+
+
+def advance_last_updated(source_id, updated):
+    """Advances the timestamp of *source_id* in the index, if the index is used."""
+    if _index is not None:
+        _index.advance(source_id, updated)
+
+
+def clear_last_updated():
+    global _index
+    _index = None
+
+
+def collect():
+    yield ("last_updated_cached", {}, len(_index) if _index is not None else 0)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Token bucket allowing *rate* requests per second with bursts up to *burst* requests.
+
+    Waiting callers reserve their token in advance, so they are served in the order they arrived."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, self.rate))
+        self.loop = asyncio.get_event_loop()
+        self.tokens = self.burst
+        self.updated = self.loop.time()
+
+    def _refill(self):
+        now = self.loop.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        self._refill()
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class Limiter(object):
+    """Limits concurrent requests and request rate of a target.
+
+    :param concurrency: max. number of requests in flight
+    :param rate: max. number of requests per second
+    :param burst: number of requests, which can be sent at once without waiting, defaults to *rate*."""
+
+    def __init__(self, *, concurrency=None, rate=None, burst=None):
+        self.settings = (concurrency, rate, burst)
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.loop = asyncio.get_event_loop()
+
+    def __repr__(self):
+        return "<Limiter concurrency={} rate={}>".format(
+            self.concurrency, self.bucket.rate if self.bucket else None)
+
+    @classmethod
+    def from_config(cls, conf):
+        """Returns limiter for keys **concurrency**, **rate_limit** and **rate_burst** \
+           of *conf*, None if no limit is set."""
+        if not conf.get("concurrency") and not conf.get("rate_limit"):
+            return None
+        return cls(concurrency=conf.get("concurrency"), rate=conf.get("rate_limit"), burst=conf.get("rate_burst"))
+
+    async def acquire(self):
+        if self.semaphore:
+            await self.semaphore.acquire()
+        try:
+            if self.bucket:
+                await self.bucket.acquire()
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        if self.semaphore:
+            self.semaphore.release()
+
+
+LIMIT_KEYS = ("concurrency", "rate_limit", "rate_burst")
+
+_limiters = {}
+_type_limits = {}
+_type_limiters = {}
+
+
+def _settings(conf):
+    return tuple(conf.get(key) for key in LIMIT_KEYS)
+
+
+def get_limiter(key, conf):
+    """Returns limiter for the limits of target entry *conf*, shared by all targets with the \
+       same *key*, so bridges delivering to the same target entry share one limit. None if \
+       *conf* sets no limit."""
+    limiter = _limiters.get(key)
+    if limiter is None or limiter.settings != _settings(conf) or limiter.loop is not asyncio.get_event_loop():
+        limiter = Limiter.from_config(conf)
+        if limiter is None:
+            _limiters.pop(key, None)
+            return None
+        _limiters[key] = limiter
+    return limiter
+
+
+def set_type_limits(limits):
+    """Sets limits per target type from the control data, override the class attributes.
+
+    :param limits: dict of target type and dict with keys **concurrency**, **rate_limit** \
+                   and **rate_burst**"""
+    _type_limits.clear()
+    _type_limits.update(limits or {})
+
+
+def get_type_limiter(target_cls):
+    """Returns limiter shared by all targets of *target_cls*, as declared by its class \
+       attributes **concurrency**, **rate_limit** and **rate_burst** or by the **limits** \
+       of the control data. None if not limited."""
+    conf = {key: getattr(target_cls, key, None) for key in LIMIT_KEYS}
+    conf.update({k: v for k, v in _type_limits.get(getattr(target_cls, "type", None), {}).items() if k in LIMIT_KEYS})
+    settings = _settings(conf)
+    entry = _type_limiters.get(target_cls)
+    if entry is None or entry[0] != settings or (entry[1] and entry[1].loop is not asyncio.get_event_loop()):
+        entry = _type_limiters[target_cls] = (settings, Limiter.from_config(conf))
+        if entry[1]:
+            logger.info("Limiting target type {}: {}".format(target_cls.type, entry[1]))
+    return entry[1]
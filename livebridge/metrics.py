@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics(object):
+    """Process-wide registry of counters, gauges and histograms.
+
+    Values are kept in memory and can be retrieved with :func:`snapshot`, for example
+    through the web API. Every value is identified by a name and optional labels."""
+
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []
+
+    def _key(self, name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def incr(self, name, value=1, **labels):
+        """Increments counter *name* by *value*."""
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Sets gauge *name* to *value*."""
+        self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Adds *value* to histogram *name*."""
+        key = self._key(name, labels)
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = {"count": 0, "sum": 0, "buckets": [0] * len(self.BUCKETS)}
+        hist["count"] += 1
+        hist["sum"] += value
+        for x, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                hist["buckets"][x] += 1
+
+    def add_collector(self, collector):
+        """Adds callable, which returns a list of *(name, labels, value)* gauges on every snapshot."""
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def remove_collector(self, collector):
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def get(self, name, **labels):
+        """Returns current value of counter or gauge *name*."""
+        key = self._key(name, labels)
+        return self.counters.get(key, self.gauges.get(key))
+
+    def _dump(self, values):
+        data = {}
+        for (name, labels), value in sorted(values.items(), key=lambda v: (v[0][0], v[0][1])):
+            data.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return data
+
+    def snapshot(self):
+        """Returns all values as JSON serializable dictionary."""
+        gauges = dict(self.gauges)
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges[self._key(name, labels)] = value
+            except Exception as exc:
+                logger.error("Metrics collector {} failed: {}".format(collector, exc))
+        histograms = {}
+        for key, hist in self.histograms.items():
+            buckets = {str(bound): count for bound, count in zip(self.BUCKETS, hist["buckets"])}
+            buckets["+Inf"] = hist["count"]
+            histograms[key] = {"count": hist["count"], "sum": hist["sum"], "buckets": buckets}
+        return {
+            "counters": self._dump(self.counters),
+            "gauges": self._dump(gauges),
+            "histograms": self._dump(histograms),
+        }
+
+    def clear(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+
+metrics = Metrics()
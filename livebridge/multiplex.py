@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SharedSource(object):
+    """Source shared by all bridges with the same type, endpoint and source_id.
+
+    The source client of the first bridge is used by all bridges of the group, it is polled
+    once at the shortest interval of the bridges, or listened to once for streaming sources.
+    New posts are handed to every bridge of the group, which delivers them to its own targets.
+
+    :param key: source key of the bridges, see :func:`livebridge.components.get_source_key`"""
+
+    def __init__(self, key):
+        self.key = key
+        self.source = None
+        self.bridges = []
+        self.polls = {}
+        self.scheduled = None
+        self.listener = None
+        self.last_poll_count = None
+
+    def __repr__(self):
+        return "<SharedSource {} bridges={}>".format(self.key, len(self.bridges))
+
+    @property
+    def hash(self):
+        return self.key
+
+    @property
+    def hashes(self):
+        """Hashes of the bridges in the group."""
+        return [bridge.hash for bridge in self.bridges]
+
+    @property
+    def label(self):
+        return ", ".join(str(bridge.label) for bridge in self.bridges) or None
+
+    @property
+    def source_id(self):
+        return self.bridges[0].source_id if self.bridges else None
+
+    @property
+    def saturated(self):
+        """True, when a bridge of the group is saturated. A shared poll feeds all bridges, \
+           so it waits for the slowest."""
+        return any(bridge.saturated is True for bridge in self.bridges)
+
+    def add(self, bridge):
+        """Adds *bridge* to the group, the bridge uses the source of the group from now on."""
+        if bridge in self.bridges:
+            return
+        if self.source is None:
+            self.source = bridge.source
+        else:
+            bridge.api_client = self.source
+            logger.info("{} shares source with {} other bridges.".format(bridge, len(self.bridges)))
+        self.bridges.append(bridge)
+
+    def remove(self, bridge):
+        """Removes *bridge* from the group.
+
+        :returns: True, if other bridges still use the source."""
+        if bridge in self.bridges:
+            self.bridges.remove(bridge)
+        self.polls.pop(bridge, None)
+        return bool(self.bridges)
+
+    def poll_settings(self):
+        """Returns bridge with the shortest poll interval and its *(interval, adaptive, overrun)*, \
+           None if no bridge of the group is polled."""
+        if not self.polls:
+            return None, None
+        bridge = min(self.polls, key=lambda b: self.polls[b][0])
+        return bridge, self.polls[bridge]
+
+    async def check_posts(self):
+        """Polls the source once for all bridges of the group."""
+        bridges = [bridge for bridge in self.bridges if bridge.draining is not True]
+        self.last_poll_count = None
+        if not bridges:
+            return True
+        await bridges[0].check_posts(bridges=bridges)
+        self.last_poll_count = bridges[0].last_poll_count
+        return True
+
+    async def new_posts(self, posts):
+        """Hands *posts* from the stream to all bridges of the group."""
+        await asyncio.gather(*[bridge.new_posts(posts) for bridge in list(self.bridges)])
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from livebridge import config
+from livebridge.components import get_db_client, POST_MAP
+from livebridge.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BaseOutbox(object):
+    """Persistent store for pending deliveries and dead letters.
+
+    Every item handed to a delivery lane is written to the outbox first and removed again, \
+    when it was delivered. Items which failed :data:`MAX_RETRIES` times are kept as dead \
+    letters. Pending items of a bridge get replayed, when the bridge starts again.
+
+    Records are dictionaries with the keys **id**, **bridge**, **target**, **source**, \
+    **post_id**, **data** (JSON string of the source post), **count**, **dead** and **created**."""
+
+    def __init__(self):
+        # ids of records handled by bridges of this process
+        self.active = set()
+
+    async def save(self, record):
+        """Inserts or replaces *record*."""
+        raise NotImplementedError()
+
+    async def delete(self, record):
+        """Deletes *record*."""
+        raise NotImplementedError()
+
+    async def get_items(self, bridge):
+        """Returns all records of *bridge*, oldest first."""
+        raise NotImplementedError()
+
+    async def close(self):
+        pass
+
+    def record(self, bridge, target, item):
+        """Returns new outbox record for delivery *item*.
+
+        :param bridge: key of the bridge, see :func:`livebridge.bridge.LiveBridge.outbox_key`
+        :param target: key of the target inside of the bridge
+        :param item: delivery item"""
+        post = item["post"]
+        record_id = uuid.uuid4().hex
+        self.active.add(record_id)
+        return {
+            "id": record_id,
+            "bridge": bridge,
+            "target": target,
+            "source": post.source,
+            "post_id": str(post.id),
+            "data": json.dumps(post.data, default=str),
+            "count": item["count"],
+            "dead": False,
+            "created": time.time(),
+        }
+
+    def restore(self, record):
+        """Returns post of *record*, None if the post type is unknown."""
+        post_cls = POST_MAP.get(record["source"])
+        if not post_cls:
+            logger.error("[OUTBOX] No post type found for {}.".format(record["source"]))
+            return None
+        return post_cls(json.loads(record["data"]))
+
+    async def put(self, record):
+        try:
+            await self.save(record)
+            return True
+        except Exception as exc:
+            logger.error("[OUTBOX] Error when saving {post_id} for {target}: {exc}".format(exc=exc, **record))
+        return False
+
+    def claim(self, record):
+        """Marks *record* as handled by this process, returns False if it is already."""
+        if record["id"] in self.active:
+            return False
+        self.active.add(record["id"])
+        return True
+
+    def release(self, records):
+        """Releases *records*, which are not handled anymore, but still pending."""
+        for record in records:
+            self.active.discard(record["id"])
+
+    async def remove(self, record):
+        self.active.discard(record["id"])
+        try:
+            await self.delete(record)
+            return True
+        except Exception as exc:
+            logger.error("[OUTBOX] Error when deleting {post_id} for {target}: {exc}".format(exc=exc, **record))
+        return False
+
+    async def bury(self, record):
+        """Keeps *record* as dead letter."""
+        record["dead"] = True
+        self.active.discard(record["id"])
+        metrics.incr("outbox_dead_letters", bridge=record["bridge"])
+        return await self.put(record)
+
+    async def pending(self, bridge):
+        """Returns records of *bridge*, which are not dead letters."""
+        try:
+            return [r for r in await self.get_items(bridge) if not r["dead"]]
+        except Exception as exc:
+            logger.error("[OUTBOX] Error when loading items of {}: {}".format(bridge, exc))
+        return []
+
+    async def dead_letters(self, bridge):
+        try:
+            return [r for r in await self.get_items(bridge) if r["dead"]]
+        except Exception as exc:
+            logger.error("[OUTBOX] Error when loading dead letters of {}: {}".format(bridge, exc))
+        return []
+
+
+class LocalOutbox(BaseOutbox):
+    """Outbox in a local SQLite file, queries run in a separate thread.
+
+    :param path: path of the SQLite database file."""
+
+    def __init__(self, path):
+        super(LocalOutbox, self).__init__()
+        self.path = path
+        self.conn = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def _connect(self):
+        if self.conn is None:
+            logger.info("[OUTBOX] Opening {}".format(self.path))
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox (id TEXT PRIMARY KEY, bridge TEXT, target TEXT, source TEXT, "
+                "post_id TEXT, data TEXT, count INTEGER, dead INTEGER, created REAL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_bridge ON outbox (bridge, created)")
+        return self.conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    def _save(self, record):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO outbox (id, bridge, target, source, post_id, data, count, dead, created) "
+                "VALUES (:id, :bridge, :target, :source, :post_id, :data, :count, :dead, :created)",
+                dict(record, dead=int(record["dead"])))
+
+    def _delete(self, record):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM outbox WHERE id = ?", (record["id"],))
+
+    def _get_items(self, bridge):
+        rows = self._connect().execute(
+            "SELECT * FROM outbox WHERE bridge = ? ORDER BY created, rowid", (bridge,)).fetchall()
+        return [dict(row, dead=bool(row["dead"])) for row in rows]
+
+    async def save(self, record):
+        await self._run(self._save, record)
+
+    async def delete(self, record):
+        await self._run(self._delete, record)
+
+    async def get_items(self, bridge):
+        return await self._run(self._get_items, bridge)
+
+    async def close(self):
+        if self.conn is not None:
+            await self._run(self.conn.close)
+            self.conn = None
+
+
+class StorageOutbox(BaseOutbox):
+    """Outbox in the configured storage, see :class:`livebridge.storages.base.BaseStorage`."""
+
+    def __init__(self, db=None):
+        super(StorageOutbox, self).__init__()
+        self.db = db or get_db_client()
+
+    async def save(self, record):
+        if not await self.db.save_outbox_item(**record):
+            raise Exception("Storage rejected outbox item.")
+
+    async def delete(self, record):
+        if not await self.db.delete_outbox_item(record["bridge"], record["id"]):
+            raise Exception("Storage failed deleting outbox item.")
+
+    async def get_items(self, bridge):
+        return sorted(await self.db.get_outbox_items(bridge), key=lambda r: r["created"])
+
+
+_outbox = None
+
+
+def get_outbox():
+    """Returns the process-wide outbox as configured by **LB_OUTBOX**, None if disabled."""
+    global _outbox
+    if _outbox is None:
+        if config.OUTBOX == "local":
+            _outbox = LocalOutbox(config.OUTBOX_PATH)
+        elif config.OUTBOX == "storage":
+            _outbox = StorageOutbox()
+        elif config.OUTBOX:
+            logger.error("[OUTBOX] Unknown outbox {}, has to be 'local' or 'storage'.".format(config.OUTBOX))
+    return _outbox
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+from collections import deque
+from livebridge.config import POLL_CONCURRENCY, POLL_JITTER, POLL_OVERRUN
+from livebridge.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveInterval(object):
+    """Poll interval adapting to the activity of a source.
+
+    Polls returning new posts reset the interval to *minimum*, while the source stays quiet
+    the interval grows by *factor* with every poll up to *maximum*.
+
+    :param minimum: shortest interval in seconds
+    :param maximum: longest interval in seconds
+    :param factor: backoff multiplier for polls without new posts"""
+
+    def __init__(self, minimum, maximum, *, factor=2):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.factor = factor
+        self.interval = minimum
+
+    def __repr__(self):
+        return "<AdaptiveInterval {}s [{}-{}]>".format(self.interval, self.minimum, self.maximum)
+
+    @classmethod
+    def from_config(cls, conf, default):
+        """Returns adaptive interval for keys **poll_min_interval**, **poll_max_interval** and \
+           **poll_backoff** of *conf*, None if neither bound is set.
+
+        :param default: poll interval used for a missing bound"""
+        if not conf.get("poll_min_interval") and not conf.get("poll_max_interval"):
+            return None
+        minimum = conf.get("poll_min_interval") or default
+        maximum = conf.get("poll_max_interval") or minimum * 10
+        return cls(minimum, maximum, factor=conf.get("poll_backoff") or 2)
+
+    def update(self, new_posts):
+        """Returns next interval after a poll, which found *new_posts* posts."""
+        if new_posts:
+            self.interval = self.minimum
+        else:
+            self.interval = min(self.maximum, self.interval * self.factor)
+        return self.interval
+
+    def reset(self):
+        self.interval = self.minimum
+        return self.interval
+
+
+class PollEntry(object):
+    """Polling of a single bridge."""
+
+    def __init__(self, bridge, interval, callback, adaptive=None, overrun=POLL_OVERRUN):
+        self.bridge = bridge
+        self.interval = adaptive.interval if adaptive else interval
+        self.callback = callback
+        self.adaptive = adaptive
+        self.overrun = overrun
+        self.due = None
+        self.seq = None
+        self.task = None
+        self.cancelled = False
+
+    def __repr__(self):
+        return "<PollEntry {} every {}s>".format(self.bridge, self.interval)
+
+    @property
+    def running(self):
+        return self.task is not None
+
+    @property
+    def source_type(self):
+        return getattr(getattr(self.bridge, "source", None), "type", "-")
+
+
+class PollScheduler(object):
+    """Process-wide scheduler for polling bridges.
+
+    Due polls are kept in a heap, a single timer of the event loop fires for the next due poll.
+    First polls of bridges are spread with random jitter over a fraction *jitter* of their
+    interval, afterwards every bridge keeps its own steady interval. At most *concurrency* polls
+    run at once, due polls beyond wait in order of their due time. A bridge is never polled
+    again, before its running poll has finished.
+
+    A poll taking longer than the interval is an overrun, handled by the policy of the bridge:
+    **remaining** polls again right away, **skip** drops the missed polls and waits for the
+    next due time of the steady interval.
+
+    :param concurrency: max. number of polls running at once, 0 means unlimited
+    :param jitter: fraction of the interval, over which first polls get spread"""
+
+    def __init__(self, *, concurrency=POLL_CONCURRENCY, jitter=POLL_JITTER):
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.loop = asyncio.get_event_loop()
+        self.heap = []
+        self.entries = {}
+        self.waiting = deque()
+        self.running = 0
+        self.timer = None
+        self.timer_due = None
+        self._seq = itertools.count()
+
+    def __repr__(self):
+        return "<PollScheduler bridges={} running={} waiting={}>".format(
+            len(self.entries), self.running, len(self.waiting))
+
+    def add(self, bridge, interval, callback, *, adaptive=None, overrun=None):
+        """Polls *bridge* every *interval* seconds by awaiting *callback* with the bridge.
+
+        With an :class:`AdaptiveInterval` *adaptive*, the interval follows the number of new posts \
+        returned by *callback*. A result of None leaves the interval unchanged. *overrun* is \
+        the overrun policy, defaults to **LB_POLL_OVERRUN**.
+
+        :returns: :class:`PollEntry`"""
+        self.remove(bridge)
+        if overrun not in [None, "remaining", "skip"]:
+            logger.error("Unknown poll overrun policy {} of {}, using {}.".format(overrun, bridge, POLL_OVERRUN))
+            overrun = None
+        entry = self.entries[bridge] = PollEntry(bridge, interval, callback, adaptive, overrun or POLL_OVERRUN)
+        self._push(entry, self.loop.time() + random.uniform(0, entry.interval * self.jitter))
+        metrics.add_collector(self.collect)
+        return entry
+
+    def remove(self, bridge):
+        """Stops polling *bridge*, a running poll is not interrupted.
+
+        :returns: removed :class:`PollEntry` or None"""
+        entry = self.entries.pop(bridge, None)
+        if entry is not None:
+            entry.cancelled = True
+            self._arm()
+        return entry
+
+    def wake(self, bridge):
+        """Polls *bridge* right away, for example when a stream or webhook signals activity \
+        of the source. Resets an adaptive interval to its minimum.
+
+        :returns: False if *bridge* is not polled"""
+        entry = self.entries.get(bridge)
+        if entry is None:
+            return False
+        if entry.adaptive:
+            entry.interval = entry.adaptive.reset()
+        if not entry.running:
+            self._push(entry, self.loop.time())
+        logger.debug("Woke up polling of {}.".format(bridge))
+        return True
+
+    def _push(self, entry, due):
+        # a former heap node of the entry gets stale
+        entry.due = due
+        entry.seq = next(self._seq)
+        heapq.heappush(self.heap, (due, entry.seq, entry))
+        self._arm()
+
+    def _stale(self, node):
+        return node[2].cancelled or node[1] != node[2].seq
+
+    def _arm(self):
+        while self.heap and self._stale(self.heap[0]):
+            heapq.heappop(self.heap)
+        due = self.heap[0][0] if self.heap else None
+        if self.timer and due == self.timer_due:
+            return
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        self.timer_due = due
+        if due is not None:
+            self.timer = self.loop.call_at(due, self._fire)
+
+    def _fire(self):
+        self.timer = None
+        now = self.loop.time()
+        while self.heap and self.heap[0][0] <= now:
+            node = heapq.heappop(self.heap)
+            if not self._stale(node) and node[2] not in self.waiting:
+                node[2].seq = None
+                self.waiting.append(node[2])
+        self._start_waiting()
+        self._arm()
+
+    def _start_waiting(self):
+        while self.waiting and (not self.concurrency or self.running < self.concurrency):
+            entry = self.waiting.popleft()
+            if not entry.cancelled:
+                self._start(entry)
+
+    def _start(self, entry):
+        lag = max(0, self.loop.time() - entry.due)
+        metrics.observe("poll_lag_seconds", lag)
+        if lag > entry.interval:
+            logger.warning("Poll of {} is {:.1f} seconds late.".format(entry.bridge, lag))
+        self.running += 1
+        entry.task = asyncio.ensure_future(self._run(entry))
+
+    async def _run(self, entry):
+        started = self.loop.time()
+        try:
+            new_posts = await entry.callback(entry.bridge)
+            if entry.adaptive and new_posts is not None:
+                interval = entry.adaptive.update(new_posts)
+                if interval != entry.interval:
+                    logger.debug("Poll interval of {} is {} seconds.".format(entry.bridge, interval))
+                entry.interval = interval
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.error("Poll of {} failed: {}".format(entry.bridge, exc))
+            logger.exception(exc)
+        finally:
+            self.running -= 1
+            entry.task = None
+            self._finished(entry, started)
+            self._start_waiting()
+
+    def _finished(self, entry, started):
+        now = self.loop.time()
+        metrics.observe("poll_duration_seconds", now - started, source=entry.source_type)
+        due = entry.due + entry.interval
+        if due < now:
+            overrun = now - started - entry.interval
+            if overrun > 0:
+                logger.warning("Poll of {} took {:.1f} seconds longer than its interval.".format(
+                    entry.bridge, overrun))
+                metrics.observe("poll_overrun_seconds", overrun, source=entry.source_type)
+            if entry.overrun == "skip":
+                missed = int((now - due) // entry.interval) + 1
+                metrics.incr("poll_skipped", missed, reason="overrun", bridge=getattr(entry.bridge, "hash", "-"))
+                due += missed * entry.interval
+        if not entry.cancelled:
+            # keep the interval steady, but don't catch up on missed polls
+            self._push(entry, max(due, now))
+
+    def info(self):
+        """Returns info about all polled bridges."""
+        now = self.loop.time()
+        data = []
+        for entry in self.entries.values():
+            data.append({
+                "bridge": getattr(entry.bridge, "hash", str(entry.bridge)),
+                "label": getattr(entry.bridge, "label", None),
+                "bridges": list(getattr(entry.bridge, "hashes", [])),
+                "interval": entry.interval,
+                "adaptive": {"min": entry.adaptive.minimum, "max": entry.adaptive.maximum} if entry.adaptive else None,
+                "running": entry.running,
+                "due_in": round(max(0, entry.due - now), 1) if not entry.running else None,
+            })
+        return sorted(data, key=lambda d: d["bridge"])
+
+    def collect(self):
+        yield ("poll_bridges", {}, len(self.entries))
+        yield ("poll_running", {}, self.running)
+        yield ("poll_waiting", {}, len(self.waiting))
+
+    def stop(self):
+        for bridge in list(self.entries):
+            self.remove(bridge)
+        self.waiting.clear()
+        metrics.remove_collector(self.collect)
+
+
+_scheduler = None
+
+
+def get_poll_scheduler():
+    """Returns the process-wide :class:`PollScheduler`."""
+    global _scheduler
+    if _scheduler is None or _scheduler.loop is not asyncio.get_event_loop():
+        if _scheduler is not None:
+            metrics.remove_collector(_scheduler.collect)
+        _scheduler = PollScheduler()
+    return _scheduler
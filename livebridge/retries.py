@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+from livebridge.config import RETRY_MULTIPLIER, RETRY_MAX_DELAY
+from livebridge.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RetryEntry(object):
+    """Pending retry of a single delivery item."""
+
+    def __init__(self, due, item, callback, bridge):
+        self.due = due
+        self.item = item
+        self.callback = callback
+        self.bridge = bridge
+        self.cancelled = False
+
+    def __repr__(self):
+        return "<RetryEntry {post.id} {target.target_id} [{count}]>".format(**self.item)
+
+    @property
+    def target(self):
+        return self.item["target"]
+
+
+class RetryScheduler(object):
+    """Process-wide scheduler for retries of failed deliveries.
+
+    Pending retries are kept in a heap ordered by their due time, a single timer of the
+    event loop fires for the next due retry. Delays grow exponentially with the number of
+    the retry and are randomized with full jitter, capped at *max_delay*.
+
+    :param base: delay in seconds for the first retry
+    :param max_delay: upper bound for the delay in seconds"""
+
+    def __init__(self, *, base=RETRY_MULTIPLIER, max_delay=RETRY_MAX_DELAY):
+        self.base = base
+        self.max_delay = max_delay
+        self.loop = asyncio.get_event_loop()
+        self.heap = []
+        self.bridges = {}
+        self.timer = None
+        self.timer_due = None
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.bridges.values())
+
+    def backoff(self, count):
+        """Returns delay in seconds for retry number *count*."""
+        return random.uniform(0, min(self.max_delay, self.base * 2 ** max(count - 1, 0)))
+
+    def schedule(self, item, callback, *, bridge=None, delay=None):
+        """Calls *callback* with *item* after *delay* seconds, defaults to :func:`backoff`.
+
+        :returns: :class:`RetryEntry`"""
+        delay = self.backoff(item["count"]) if delay is None else delay
+        entry = RetryEntry(self.loop.time() + delay, item, callback, bridge)
+        heapq.heappush(self.heap, (entry.due, next(self._seq), entry))
+        self.bridges.setdefault(bridge, set()).add(entry)
+        logger.debug("Retry of {} in {:.1f} seconds.".format(entry, delay))
+        self._arm()
+        return entry
+
+    def pending(self, *, bridge=None, target=None):
+        """Returns pending retries, optionally filtered by bridge and/or target."""
+        if bridge is not None:
+            entries = list(self.bridges.get(bridge, []))
+        else:
+            entries = [e for entries in self.bridges.values() for e in entries]
+        if target is not None:
+            entries = [e for e in entries if e.target is target]
+        return sorted(entries, key=lambda e: e.due)
+
+    def cancel(self, *, bridge=None, target=None):
+        """Cancels pending retries of a bridge and/or target.
+
+        :returns: number of cancelled retries"""
+        entries = self.pending(bridge=bridge, target=target)
+        for entry in entries:
+            self._discard(entry)
+        if len(self.heap) > 2 * len(self) + 32:
+            # drop cancelled entries
+            self.heap = [e for e in self.heap if not e[2].cancelled]
+            heapq.heapify(self.heap)
+        self._arm()
+        return len(entries)
+
+    def _discard(self, entry):
+        entry.cancelled = True
+        entries = self.bridges.get(entry.bridge)
+        if entries is not None:
+            entries.discard(entry)
+            if not entries:
+                del self.bridges[entry.bridge]
+
+    def _arm(self):
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+        due = self.heap[0][0] if self.heap else None
+        if self.timer and due == self.timer_due:
+            return
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        self.timer_due = due
+        if due is not None:
+            self.timer = self.loop.call_at(due, self._fire)
+
+    def _fire(self):
+        self.timer = None
+        now = self.loop.time()
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)[2]
+            if entry.cancelled:
+                continue
+            self._discard(entry)
+            try:
+                entry.callback(entry.item)
+            except Exception as exc:
+                logger.error("Retry of {} failed: {}".format(entry, exc))
+                logger.exception(exc)
+        self._arm()
+
+    def collect(self):
+        for bridge, entries in self.bridges.items():
+            labels = {"bridge": getattr(bridge, "hash", str(bridge)), "label": getattr(bridge, "label", "-")}
+            yield ("retries_pending", labels, len(entries))
+
+    def stop(self):
+        self.cancel()
+        metrics.remove_collector(self.collect)
+
+
+_scheduler = None
+
+
+def get_retry_scheduler():
+    """Returns the process-wide :class:`RetryScheduler`."""
+    global _scheduler
+    if _scheduler is None or _scheduler.loop is not asyncio.get_event_loop():
+        if _scheduler is not None:
+            metrics.remove_collector(_scheduler.collect)
+        _scheduler = RetryScheduler()
+        metrics.add_collector(_scheduler.collect)
+    return _scheduler
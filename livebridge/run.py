@@ -64,7 +64,19 @@ def main(**kwargs):
     loop.run_until_complete(db_connector.setup())
 
     # controller manages the tasks / data
-    controller = Controller(config=config, control_file=args.control)
+    if config.CLUSTER and config.WORKERS > 1:
+        from livebridge.cluster import ClusterSupervisor
+        controller = ClusterSupervisor(config=config, control_file=args.control, workers=config.WORKERS)
+    elif config.CLUSTER:
+        # bridges are shared with other nodes of the cluster
+        from livebridge.cluster import ClusterController
+        controller = ClusterController(config=config, control_file=args.control)
+    elif config.WORKERS > 1:
+        # bridges run in forked worker processes
+        from livebridge.supervisor import Supervisor
+        controller = Supervisor(config=config, control_file=args.control, workers=config.WORKERS)
+    else:
+        controller = Controller(config=config, control_file=args.control)
     asyncio.ensure_future(controller.run())
 
     # start http api
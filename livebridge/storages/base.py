@@ -13,6 +13,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 
 
 class BaseStorage(object):
@@ -27,8 +28,19 @@ class BaseStorage(object):
     * :func:`update_post` - updates single post in storage.
     * :func:`delete_post` - deletes single post in storage.
     * :func:`get_last_updated` - returns latest updated-timestamp or source from storage.
+
+    Storing the outbox of pending deliveries (see :mod:`livebridge.outbox`) is optional and needs \
+    :func:`save_outbox_item`, :func:`get_outbox_items` and :func:`delete_outbox_item`.
+
+    Cluster mode (see :mod:`livebridge.cluster`) needs leases stored with conditional writes by \
+    :func:`acquire_lease`, :func:`release_lease` and :func:`get_leases`.
+
+    Sources look up known posts in chunks of at most **known_posts_chunk_size** ids per call \
+    of :func:`get_known_posts`, None looks up all ids at once.
     """
 
+    known_posts_chunk_size = None
+
     @property
     async def db(self):
         """Property holds underlying database client."""
@@ -47,6 +59,17 @@ class BaseStorage(object):
         """Insert single post into storage."""
         raise NotImplementedError()
 
+    async def insert_posts(self, posts):
+        """Inserts multiple posts into storage, backends may override it with a bulk write.
+
+        :param posts: list of dictionaries with the arguments of :func:`insert_post`
+        :type list:
+        :returns: - boolean"""
+        results = []
+        for post in posts:
+            results.append(await self.insert_post(**post))
+        return all(results)
+
     async def get_post(self, target_id, post_id):
         """Returns single post from storage.
 
@@ -56,10 +79,36 @@ class BaseStorage(object):
         :type string:"""
         raise NotImplementedError()
 
+    async def get_posts(self, target_id, post_ids):
+        """Returns multiple posts from storage, backends may override it with a bulk read.
+
+        :param target_id: id of the target
+        :type string:
+        :param post_ids: list of post ids
+        :type list:
+        :returns: - dictionary of post id and post for the known posts, None if the query failed."""
+        results = {}
+        for post_id in post_ids:
+            post = await self.get_post(target_id, post_id)
+            if post:
+                results[post_id] = post
+        return results
+
     async def update_post(self, **kwargs):
         """Updates single post in storage."""
         raise NotImplementedError()
 
+    async def update_posts(self, posts):
+        """Updates multiple posts in storage, backends may override it with a bulk write.
+
+        :param posts: list of dictionaries with the arguments of :func:`update_post`
+        :type list:
+        :returns: - boolean"""
+        results = []
+        for post in posts:
+            results.append(await self.update_post(**post))
+        return all(results)
+
     async def delete_post(self, target_id, post_id):
         """Deletes single post from storage.
 
@@ -76,6 +125,16 @@ class BaseStorage(object):
         :type string:"""
         raise NotImplementedError()
 
+    async def get_last_updated_sources(self, source_ids):
+        """Returns latest updated-timestamps of multiple sources, used to load the index of \
+        :class:`livebridge.lastupdated.LastUpdatedIndex`. Backends may override it with a single query.
+
+        :param source_ids: list of source ids
+        :type list:
+        :returns: - dictionary of source id and timestamp, None if the query failed."""
+        results = await asyncio.gather(*[self.get_last_updated(source_id) for source_id in source_ids])
+        return dict(zip(source_ids, results))
+
     async def get_known_posts(self, source_id, post_ids):
         """Return a list of known post_id of a source for a given list of post ids.
 
@@ -86,6 +145,15 @@ class BaseStorage(object):
         :returns: - list of dictionaries."""
         raise NotImplementedError()
 
+    async def get_source_post_ids(self, source_id):
+        """Returns all known post ids of a source, used to warm the cache of known posts. \
+        Optional, see :class:`livebridge.knownposts.KnownPosts`.
+
+        :param source_id: id of the source
+        :type string:
+        :returns: - list of post ids, None if the query failed."""
+        raise NotImplementedError()
+
     async def get_control(self):
         """Method for retrieving of control data form storage.
 
@@ -99,3 +167,55 @@ class BaseStorage(object):
         :type dict:
         :returns: - boolean"""
         raise NotImplementedError()
+
+    async def save_outbox_item(self, **kwargs):
+        """Inserts or replaces item of the delivery outbox.
+
+        :returns: - boolean"""
+        raise NotImplementedError()
+
+    async def get_outbox_items(self, bridge):
+        """Returns all outbox items of a bridge.
+
+        :param bridge: key of the bridge
+        :type string:
+        :returns: - list of dictionaries."""
+        raise NotImplementedError()
+
+    async def delete_outbox_item(self, bridge, item_id):
+        """Deletes single item from the delivery outbox.
+
+        :param bridge: key of the bridge
+        :type string:
+        :param item_id: id of the outbox item
+        :type string:
+        :returns: - boolean"""
+        raise NotImplementedError()
+
+    async def acquire_lease(self, name, owner, expires, now):
+        """Acquires or renews lease *name* for *owner* in a single conditional write. Succeeds only, \
+        when the lease doesn't exist, is already held by *owner* or has expired before *now*.
+
+        :param name: name of the lease
+        :type string:
+        :param owner: id of the cluster node
+        :type string:
+        :param expires: unix timestamp when the lease expires
+        :type float:
+        :param now: current unix timestamp
+        :type float:
+        :returns: - boolean"""
+        raise NotImplementedError()
+
+    async def release_lease(self, name, owner):
+        """Deletes lease *name*, if held by *owner*.
+
+        :returns: - boolean"""
+        raise NotImplementedError()
+
+    async def get_leases(self, prefix=None):
+        """Returns all leases or leases with names starting with *prefix*, like **node:**. \
+        Storages read only these leases by their key and don't scan all leases.
+
+        :returns: - list of dictionaries with keys **name**, **owner** and **expires**."""
+        raise NotImplementedError()
@@ -42,9 +42,15 @@ class DummyStorage(BaseStorage):
     async def get_known_posts(self, source_id, post_ids):
         return []
 
+    async def get_source_post_ids(self, source_id):
+        return []
+
     async def get_post(self, target_id, post_id):
         return None
 
+    async def get_posts(self, target_id, post_ids):
+        return {}
+
     async def insert_post(self, **kwargs):
         return True
 
@@ -56,3 +62,21 @@ class DummyStorage(BaseStorage):
 
     async def get_control(self, updated=None):
         return False
+
+    async def save_outbox_item(self, **kwargs):
+        return True
+
+    async def get_outbox_items(self, bridge):
+        return []
+
+    async def delete_outbox_item(self, bridge, item_id):
+        return True
+
+    async def acquire_lease(self, name, owner, expires, now):
+        return True
+
+    async def release_lease(self, name, owner):
+        return True
+
+    async def get_leases(self, prefix=None):
+        return []
@@ -19,7 +19,7 @@ import json
 from datetime import datetime
 from dateutil.parser import parse as parse_date
 import aiobotocore
-from botocore.exceptions import BotoCoreError
+from botocore.exceptions import BotoCoreError, ClientError
 from livebridge.storages.base import BaseStorage
 
 logger = logging.getLogger(__name__)
@@ -30,6 +30,9 @@ class DynamoClient(BaseStorage):
     # date format for datetime values in DynamoDB
     date_fmt = "%Y-%m-%dT%H:%M:%S+00:00"
 
+    # keeps the filter expression of the known posts query below the size limit of DynamoDB
+    known_posts_chunk_size = 100
+
     _instance = None
 
     def __new__(cls, *args, **kwargs):
@@ -80,6 +83,36 @@ class DynamoClient(BaseStorage):
             ],
             "ProvisionedThroughput": {"ReadCapacityUnits": 3, "WriteCapacityUnits": 3},
         }
+        self.outbox_table_name = kwargs.get("outbox_table_name")
+        self.outbox_table_schema = {
+            "TableName": self.outbox_table_name,
+            "KeySchema": [
+                {"AttributeName": "bridge", "KeyType": "HASH"},
+                {"AttributeName": "id", "KeyType": "RANGE"},
+            ],
+            "AttributeDefinitions": [
+                {"AttributeName": "bridge", "AttributeType": "S"},
+                {"AttributeName": "id", "AttributeType": "S"},
+            ],
+            "ProvisionedThroughput": {"ReadCapacityUnits": 3, "WriteCapacityUnits": 3},
+        }
+        self.lease_table_name = kwargs.get("lease_table_name")
+        # leases are partitioned by the kind of their name, like node or source
+        self.lease_table_schema = {
+            "TableName": self.lease_table_name,
+            "KeySchema": [
+                {"AttributeName": "kind", "KeyType": "HASH"},
+                {"AttributeName": "name", "KeyType": "RANGE"},
+            ],
+            "AttributeDefinitions": [
+                {"AttributeName": "kind", "AttributeType": "S"},
+                {"AttributeName": "name", "AttributeType": "S"},
+            ],
+            "ProvisionedThroughput": {
+                "ReadCapacityUnits": kwargs.get("lease_read_capacity") or 5,
+                "WriteCapacityUnits": kwargs.get("lease_write_capacity") or 25,
+            },
+        }
 
     async def shutdown(self):
         if hasattr(self, "db_client") and self.db_client:
@@ -123,6 +156,20 @@ class DynamoClient(BaseStorage):
                 if resp.get("ResponseMetadata", {}).get("HTTPStatusCode") == 200:
                     logger.info("DynamoDB control table [{}] successfully created!".format(self.control_table_name))
                     created = True
+            # create outbox table if not already created.
+            if self.outbox_table_name and self.outbox_table_name not in response["TableNames"]:
+                logger.info("Creating DynamoDB outbox table [{}]".format(self.outbox_table_name))
+                resp = await client.create_table(**self.outbox_table_schema)
+                if resp.get("ResponseMetadata", {}).get("HTTPStatusCode") == 200:
+                    logger.info("DynamoDB outbox table [{}] successfully created!".format(self.outbox_table_name))
+                    created = True
+            # create lease table if not already created.
+            if self.lease_table_name and self.lease_table_name not in response["TableNames"]:
+                logger.info("Creating DynamoDB lease table [{}]".format(self.lease_table_name))
+                resp = await client.create_table(**self.lease_table_schema)
+                if resp.get("ResponseMetadata", {}).get("HTTPStatusCode") == 200:
+                    logger.info("DynamoDB lease table [{}] successfully created!".format(self.lease_table_name))
+                    created = True
             return created
         except Exception as exc:
             logger.error("[DB] Error when setting up DynamoDB.")
@@ -145,22 +192,26 @@ class DynamoClient(BaseStorage):
             logger.error(exc)
         return []
 
+    def _item(self, **kwargs):
+        item = {
+            "target_id": {"S": kwargs.get("target_id")},
+            "post_id": {"S": str(kwargs.get("post_id"))},
+            "source_id": {"S": kwargs.get("source_id")},
+            "text": {"S": kwargs.get("text") or " "},
+            "sticky": {"N": str(int(kwargs.get("sticky", False)))},
+            "created": {"S": datetime.strftime(kwargs.get("created"), self.date_fmt)},
+            "updated": {"S": datetime.strftime(kwargs.get("updated"), self.date_fmt)},
+        }
+        # add doc at target if present
+        if kwargs.get("target_doc"):
+            item["target_doc"] = {"S": json.dumps(kwargs["target_doc"])}
+        return item
+
     async def insert_post(self, **kwargs):
         params = {
             "TableName": self.table_name,
-            "Item": {
-                "target_id": {"S": kwargs.get("target_id")},
-                "post_id": {"S": str(kwargs.get("post_id"))},
-                "source_id": {"S": kwargs.get("source_id")},
-                "text": {"S": kwargs.get("text") or " "},
-                "sticky": {"N": str(int(kwargs.get("sticky", False)))},
-                "created": {"S": datetime.strftime(kwargs.get("created"), self.date_fmt)},
-                "updated": {"S": datetime.strftime(kwargs.get("updated"), self.date_fmt)},
-            }
+            "Item": self._item(**kwargs),
         }
-        # add doc at target if present
-        if kwargs.get("target_doc"):
-            params["Item"]["target_doc"] = {"S": json.dumps(kwargs["target_doc"])}
         db = await self.db
         try:
             response = await db.put_item(**params)
@@ -172,6 +223,33 @@ class DynamoClient(BaseStorage):
             logger.error(exc)
         return False
 
+    async def insert_posts(self, posts):
+        requests = [{"PutRequest": {"Item": self._item(**post)}} for post in posts]
+        try:
+            db = await self.db
+            # BatchWriteItem accepts max. 25 items per request
+            for x in range(0, len(requests), 25):
+                pending = {self.table_name: requests[x:x + 25]}
+                for _ in range(5):
+                    response = await db.batch_write_item(RequestItems=pending)
+                    pending = response.get("UnprocessedItems")
+                    if not pending:
+                        break
+                    await asyncio.sleep(0.1)
+                if pending:
+                    logger.error("[DB] {} posts were not saved.".format(len(pending[self.table_name])))
+                    return False
+            logger.info("[DB] {} posts were saved!".format(len(posts)))
+            return True
+        except Exception as exc:
+            logger.error("[DB] Error when saving {} posts".format(len(posts)))
+            logger.error(exc)
+        return False
+
+    async def update_posts(self, posts):
+        # put requests replace existing items with the same key
+        return await self.insert_posts(posts)
+
     async def get_last_updated(self, source_id):
         params = {
             "TableName": self.table_name,
@@ -226,6 +304,30 @@ class DynamoClient(BaseStorage):
             logger.exception(exc)
         return results
 
+    async def get_source_post_ids(self, source_id):
+        results = set()
+        params = {
+            "TableName": self.table_name,
+            "IndexName": "source_id-updated-index",
+            "KeyConditionExpression": "source_id = :value",
+            "ExpressionAttributeValues": {":value": {"S": str(source_id)}},
+            "ProjectionExpression": "post_id",
+        }
+        try:
+            db = await self.db
+            while True:
+                response = await db.query(**params)
+                for item in response.get("Items", []):
+                    results.add(item["post_id"]["S"])
+                if not response.get("LastEvaluatedKey"):
+                    break
+                params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        except Exception as exc:
+            logger.error("[DB] Error when querying for posts of {}".format(source_id))
+            logger.exception(exc)
+            return None
+        return list(results)
+
     async def get_post(self, target_id, post_id):
         params = {
             "TableName": self.table_name,
@@ -242,20 +344,52 @@ class DynamoClient(BaseStorage):
             response = await db.query(**params)
             if response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 200:
                 db_post = response["Items"][0] if response["Count"] >= 1 else None
-                if db_post:
-                    db_post["sticky"] = db_post.get("sticky", {}).get("N")
-                    db_post["updated"] = db_post.get("updated", {}).get("S")
-                    db_post["source_id"] = db_post.get("source_id", {}).get("S")
-                    db_post["post_id"] = db_post.get("post_id", {}).get("S")
-                    db_post["target_id"] = db_post.get("target_id", {}).get("S")
-                    db_post["target_doc"] = json.loads(db_post["target_doc"]["S"]) \
-                        if db_post.get("target_doc", {}).get("S") else {}
-                return db_post
+                return self._post(db_post) if db_post else db_post
         except BotoCoreError as exc:
             logger.error("[DB] Error when querying for a post [{}] on {}".format(post_id, target_id))
             logger.error(exc)
         return None
 
+    def _post(self, db_post):
+        db_post["sticky"] = db_post.get("sticky", {}).get("N")
+        db_post["updated"] = db_post.get("updated", {}).get("S")
+        db_post["source_id"] = db_post.get("source_id", {}).get("S")
+        db_post["post_id"] = db_post.get("post_id", {}).get("S")
+        db_post["target_id"] = db_post.get("target_id", {}).get("S")
+        db_post["target_doc"] = json.loads(db_post["target_doc"]["S"]) \
+            if db_post.get("target_doc", {}).get("S") else {}
+        return db_post
+
+    async def get_posts(self, target_id, post_ids):
+        # BatchGetItem rejects duplicate keys
+        keys = [{"target_id": {"S": str(target_id)}, "post_id": {"S": str(post_id)}} for post_id in set(post_ids)]
+        results = {}
+        try:
+            db = await self.db
+            # BatchGetItem accepts max. 100 keys per request
+            for x in range(0, len(keys), 100):
+                pending = {self.table_name: {
+                    "Keys": keys[x:x + 100],
+                    "ProjectionExpression": "target_id, source_id, updated, post_id, target_doc, sticky",
+                }}
+                for _ in range(5):
+                    response = await db.batch_get_item(RequestItems=pending)
+                    for db_post in response.get("Responses", {}).get(self.table_name, []):
+                        db_post = self._post(db_post)
+                        results[db_post["post_id"]] = db_post
+                    pending = response.get("UnprocessedKeys")
+                    if not pending:
+                        break
+                    await asyncio.sleep(0.1)
+                if pending:
+                    logger.error("[DB] {} posts were not read.".format(len(pending[self.table_name]["Keys"])))
+                    return None
+            return results
+        except Exception as exc:
+            logger.error("[DB] Error when querying for {} posts on {}".format(len(keys), target_id))
+            logger.error(exc)
+        return None
+
     async def update_post(self, **kwargs):
         try:
             target_id = kwargs.get("target_id")
@@ -331,3 +465,157 @@ class DynamoClient(BaseStorage):
             logger.error("[DB] Error when saving control_data on {}".format(self.control_table_name))
             logger.error(exc)
         return False
+
+    async def save_outbox_item(self, **kwargs):
+        params = {
+            "TableName": self.outbox_table_name,
+            "Item": {
+                "id": {"S": kwargs["id"]},
+                "bridge": {"S": kwargs["bridge"]},
+                "target": {"S": str(kwargs["target"])},
+                "source": {"S": kwargs["source"]},
+                "post_id": {"S": str(kwargs["post_id"])},
+                "data": {"S": kwargs["data"]},
+                "count": {"N": str(kwargs["count"])},
+                "dead": {"BOOL": bool(kwargs["dead"])},
+                "created": {"N": repr(kwargs["created"])},
+            }
+        }
+        try:
+            db = await self.db
+            response = await db.put_item(**params)
+            if response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 200:
+                return True
+        except Exception as exc:
+            logger.error("[DB] Error when saving outbox item {}".format(kwargs.get("id")))
+            logger.error(exc)
+        return False
+
+    async def get_outbox_items(self, bridge):
+        results = []
+        params = {
+            "TableName": self.outbox_table_name,
+            "KeyConditionExpression": "bridge = :value",
+            "ExpressionAttributeValues": {":value": {"S": str(bridge)}},
+        }
+        try:
+            db = await self.db
+            while True:
+                response = await db.query(**params)
+                for item in response.get("Items", []):
+                    results.append({
+                        "id": item["id"]["S"],
+                        "bridge": item["bridge"]["S"],
+                        "target": item["target"]["S"],
+                        "source": item["source"]["S"],
+                        "post_id": item["post_id"]["S"],
+                        "data": item["data"]["S"],
+                        "count": int(item["count"]["N"]),
+                        "dead": item["dead"]["BOOL"],
+                        "created": float(item["created"]["N"]),
+                    })
+                if not response.get("LastEvaluatedKey"):
+                    break
+                params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        except Exception as exc:
+            logger.error("[DB] Error when querying outbox items of {}".format(bridge))
+            logger.error(exc)
+        return sorted(results, key=lambda r: r["created"])
+
+    async def delete_outbox_item(self, bridge, item_id):
+        params = {
+            "TableName": self.outbox_table_name,
+            "Key": {
+                "bridge": {"S": str(bridge)},
+                "id": {"S": str(item_id)},
+            },
+        }
+        try:
+            db = await self.db
+            response = await db.delete_item(**params)
+            if response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 200:
+                return True
+        except Exception as exc:
+            logger.error("[DB] Error when deleting outbox item {}".format(item_id))
+            logger.error(exc)
+        return False
+
+    def _lease_kind(self, name):
+        return name.split(":", 1)[0]
+
+    async def acquire_lease(self, name, owner, expires, now):
+        params = {
+            "TableName": self.lease_table_name,
+            "Item": {
+                "kind": {"S": self._lease_kind(name)},
+                "name": {"S": name},
+                "owner": {"S": owner},
+                "expires": {"N": repr(expires)},
+            },
+            "ConditionExpression": "attribute_not_exists(#name) OR #owner = :owner OR #expires < :now",
+            "ExpressionAttributeNames": {"#name": "name", "#owner": "owner", "#expires": "expires"},
+            "ExpressionAttributeValues": {":owner": {"S": owner}, ":now": {"N": repr(now)}},
+        }
+        try:
+            db = await self.db
+            response = await db.put_item(**params)
+            if response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 200:
+                return True
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                logger.error("[DB] Error when acquiring lease {}".format(name))
+                logger.error(exc)
+        except Exception as exc:
+            logger.error("[DB] Error when acquiring lease {}".format(name))
+            logger.error(exc)
+        return False
+
+    async def release_lease(self, name, owner):
+        params = {
+            "TableName": self.lease_table_name,
+            "Key": {"kind": {"S": self._lease_kind(name)}, "name": {"S": name}},
+            "ConditionExpression": "#owner = :owner",
+            "ExpressionAttributeNames": {"#owner": "owner"},
+            "ExpressionAttributeValues": {":owner": {"S": owner}},
+        }
+        try:
+            db = await self.db
+            await db.delete_item(**params)
+            return True
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                # held by another owner
+                return True
+            logger.error("[DB] Error when releasing lease {}".format(name))
+            logger.error(exc)
+        except Exception as exc:
+            logger.error("[DB] Error when releasing lease {}".format(name))
+            logger.error(exc)
+        return False
+
+    async def get_leases(self, prefix=None):
+        results = []
+        params = {"TableName": self.lease_table_name, "ConsistentRead": True}
+        if prefix:
+            # reads only the partition of the kind of *prefix*
+            params["KeyConditionExpression"] = "#kind = :kind AND begins_with(#name, :prefix)"
+            params["ExpressionAttributeNames"] = {"#kind": "kind", "#name": "name"}
+            params["ExpressionAttributeValues"] = {
+                ":kind": {"S": self._lease_kind(prefix)}, ":prefix": {"S": prefix}}
+        try:
+            db = await self.db
+            while True:
+                response = await (db.query(**params) if prefix else db.scan(**params))
+                for item in response.get("Items", []):
+                    results.append({
+                        "name": item["name"]["S"],
+                        "owner": item["owner"]["S"],
+                        "expires": float(item["expires"]["N"]),
+                    })
+                if not response.get("LastEvaluatedKey"):
+                    break
+                params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        except Exception as exc:
+            logger.error("[DB] Error when querying leases")
+            logger.error(exc)
+        return results
@@ -15,8 +15,10 @@
 # limitations under the License.
 import dsnparse
 import logging
+import re
 from datetime import datetime
-from pymongo import DESCENDING
+from pymongo import DESCENDING, ReplaceOne
+from pymongo.errors import DuplicateKeyError
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson.objectid import ObjectId
 from livebridge.storages.base import BaseStorage
@@ -29,6 +31,8 @@ class MongoStorage(BaseStorage):
 
     _instance = None
 
+    known_posts_chunk_size = 1000
+
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
             cls._instance = super(MongoStorage, cls).__new__(cls)
@@ -39,6 +43,8 @@ class MongoStorage(BaseStorage):
         self.dsn = kwargs.get("dsn", None)
         self.table_name = kwargs.get("table_name")
         self.control_table_name = kwargs.get("control_table_name")
+        self.outbox_table_name = kwargs.get("outbox_table_name")
+        self.lease_table_name = kwargs.get("lease_table_name")
 
         # get db name
         info = dsnparse.parse(self.dsn)
@@ -72,6 +78,17 @@ class MongoStorage(BaseStorage):
                 logger.info("Creating MongoDB control data collection [{}]".format(self.control_table_name))
                 await db.create_collection(self.control_table_name)
                 created = True
+            # create outbox collection if not already created.
+            if self.outbox_table_name and self.outbox_table_name not in collections:
+                logger.info("Creating MongoDB outbox collection [{}]".format(self.outbox_table_name))
+                await db.create_collection(self.outbox_table_name)
+                await db[self.outbox_table_name].create_index([("bridge", DESCENDING), ("created", DESCENDING)])
+                created = True
+            # create lease collection if not already created.
+            if self.lease_table_name and self.lease_table_name not in collections:
+                logger.info("Creating MongoDB lease collection [{}]".format(self.lease_table_name))
+                await db.create_collection(self.lease_table_name)
+                created = True
             return created
         except Exception as exc:
             logger.error("[DB] Error when setting up MongoDB collections: {}".format(exc))
@@ -90,6 +107,22 @@ class MongoStorage(BaseStorage):
             logger.exception(exc)
         return None
 
+    async def get_last_updated_sources(self, source_ids):
+        try:
+            coll = (await self.db)[self.table_name]
+            cursor = coll.aggregate([
+                {"$match": {"source_id": {"$in": source_ids}}},
+                {"$group": {"_id": "$source_id", "updated": {"$max": "$updated"}}},
+            ])
+            results = {}
+            async for doc in cursor:
+                results[doc["_id"]] = doc.get("updated")
+            return results
+        except Exception as exc:
+            logger.error("[DB] Error when querying for last updated items on {}".format(source_ids))
+            logger.exception(exc)
+        return None
+
     async def get_known_posts(self, source_id, post_ids):
         results = []
         try:
@@ -103,6 +136,20 @@ class MongoStorage(BaseStorage):
             logger.exception(exc)
         return results
 
+    async def get_source_post_ids(self, source_id):
+        try:
+            coll = (await self.db)[self.table_name]
+            # ids as returned by get_known_posts
+            cursor = coll.find({"source_id": source_id}, {"_id": 1})
+            results = []
+            async for doc in cursor:
+                results.append(str(doc["_id"]))
+            return results
+        except Exception as exc:
+            logger.error("[DB] Error when querying for posts of {}".format(source_id))
+            logger.exception(exc)
+        return None
+
     async def get_post(self, target_id, post_id):
         try:
             coll = (await self.db)[self.table_name]
@@ -115,20 +162,23 @@ class MongoStorage(BaseStorage):
             logger.error(exc)
         return None
 
+    async def get_posts(self, target_id, post_ids):
+        results = {}
+        try:
+            coll = (await self.db)[self.table_name]
+            cursor = coll.find({"target_id": target_id, "post_id": {"$in": list(set(post_ids))}})
+            async for doc in cursor:
+                doc["_id"] = str(doc["_id"])
+                results[doc["post_id"]] = doc
+            return results
+        except Exception as exc:
+            logger.error("[DB] Error when querying for {} posts on {}".format(len(post_ids), target_id))
+            logger.error(exc)
+        return None
+
     async def insert_post(self, **kwargs):
         try:
-            target_id = kwargs.get("target_id")
-            doc = {
-                "target_id": target_id,
-                "post_id": str(kwargs.get("post_id")),
-                "source_id": kwargs.get("source_id"),
-                "text": kwargs.get("text") or " ",
-                "sticky": str(int(kwargs.get("sticky", False))),
-                "created": kwargs.get("created"),
-                "updated": kwargs.get("updated"),
-                "target_id": target_id,
-                "target_doc": kwargs.get("target_doc", "")
-            }
+            doc = self._doc(**kwargs)
             coll = (await self.db)[self.table_name]
             await coll.insert_one(doc)
             logger.info("[DB] Post {} {} was saved!".format(kwargs["source_id"], kwargs["post_id"]))
@@ -138,20 +188,45 @@ class MongoStorage(BaseStorage):
             logger.error(exc)
         return False
 
+    def _doc(self, **kwargs):
+        return {
+            "target_id": kwargs.get("target_id"),
+            "post_id": str(kwargs.get("post_id")),
+            "source_id": kwargs.get("source_id"),
+            "text": kwargs.get("text") or " ",
+            "sticky": str(int(kwargs.get("sticky", 0))),
+            "created": kwargs.get("created"),
+            "updated": kwargs.get("updated"),
+            "target_doc": kwargs.get("target_doc", "")
+        }
+
+    async def insert_posts(self, posts):
+        try:
+            coll = (await self.db)[self.table_name]
+            await coll.insert_many([self._doc(**post) for post in posts], ordered=False)
+            logger.info("[DB] {} posts were saved!".format(len(posts)))
+            return True
+        except Exception as exc:
+            logger.error("[DB] Error when saving {} posts".format(len(posts)))
+            logger.error(exc)
+        return False
+
+    async def update_posts(self, posts):
+        try:
+            coll = (await self.db)[self.table_name]
+            requests = [ReplaceOne({"target_id": post.get("target_id"), "post_id": post.get("post_id")},
+                                   self._doc(**post)) for post in posts]
+            await coll.bulk_write(requests, ordered=False)
+            logger.info("[DB] {} posts were updated!".format(len(posts)))
+            return True
+        except Exception as exc:
+            logger.error("[DB] Error when updating {} posts".format(len(posts)))
+            logger.error(exc)
+        return False
+
     async def update_post(self, **kwargs):
         try:
-            target_id = kwargs.get("target_id")
-            doc = {
-                "target_id": target_id,
-                "post_id": str(kwargs.get("post_id")),
-                "source_id": kwargs.get("source_id"),
-                "text": kwargs.get("text") or " ",
-                "sticky": str(int(kwargs.get("sticky", 0))),
-                "created": kwargs.get("created"),
-                "updated": kwargs.get("updated"),
-                "target_id": target_id,
-                "target_doc": kwargs.get("target_doc", "")
-            }
+            doc = self._doc(**kwargs)
             coll = (await self.db)[self.table_name]
             await coll.replace_one({"target_id": kwargs.get("target_id"), "post_id": kwargs.get("post_id")}, doc)
             logger.info("[DB] Post {} {} was updated!".format(kwargs.get("post_id"), kwargs.get("target_id")))
@@ -202,3 +277,75 @@ class MongoStorage(BaseStorage):
             logger.error("[DB] Error when saving control data on {}".format(self.control_table_name))
             logger.error(exc)
         return False
+
+    async def save_outbox_item(self, **kwargs):
+        try:
+            doc = dict(kwargs, _id=kwargs["id"])
+            coll = (await self.db)[self.outbox_table_name]
+            await coll.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+            return True
+        except Exception as exc:
+            logger.error("[DB] Error when saving outbox item {}".format(kwargs.get("id")))
+            logger.error(exc)
+        return False
+
+    async def get_outbox_items(self, bridge):
+        results = []
+        try:
+            coll = (await self.db)[self.outbox_table_name]
+            cursor = coll.find({"bridge": bridge}).sort("created", 1)
+            async for doc in cursor:
+                doc.pop("_id", None)
+                results.append(doc)
+        except Exception as exc:
+            logger.error("[DB] Error when querying outbox items of {}".format(bridge))
+            logger.error(exc)
+        return results
+
+    async def delete_outbox_item(self, bridge, item_id):
+        try:
+            coll = (await self.db)[self.outbox_table_name]
+            await coll.delete_one({"_id": item_id})
+            return True
+        except Exception as exc:
+            logger.error("[DB] Error when deleting outbox item {}".format(item_id))
+            logger.error(exc)
+        return False
+
+    async def acquire_lease(self, name, owner, expires, now):
+        try:
+            coll = (await self.db)[self.lease_table_name]
+            # upsert fails with duplicate key, when the lease is held by another owner
+            await coll.update_one(
+                {"_id": name, "$or": [{"owner": owner}, {"expires": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires": expires}}, upsert=True)
+            return True
+        except DuplicateKeyError:
+            pass
+        except Exception as exc:
+            logger.error("[DB] Error when acquiring lease {}".format(name))
+            logger.error(exc)
+        return False
+
+    async def release_lease(self, name, owner):
+        try:
+            coll = (await self.db)[self.lease_table_name]
+            await coll.delete_one({"_id": name, "owner": owner})
+            return True
+        except Exception as exc:
+            logger.error("[DB] Error when releasing lease {}".format(name))
+            logger.error(exc)
+        return False
+
+    async def get_leases(self, prefix=None):
+        results = []
+        try:
+            coll = (await self.db)[self.lease_table_name]
+            # anchored regex uses the index of _id
+            query = {"_id": {"$regex": "^" + re.escape(prefix)}} if prefix else {}
+            async for doc in coll.find(query):
+                results.append({"name": doc["_id"], "owner": doc["owner"], "expires": doc["expires"]})
+        except Exception as exc:
+            logger.error("[DB] Error when querying leases")
+            logger.error(exc)
+        return results
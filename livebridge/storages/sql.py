@@ -18,9 +18,10 @@ import logging
 from datetime import datetime
 from sqlalchemy_aio import ASYNCIO_STRATEGY
 from sqlalchemy import create_engine, MetaData, Table, Column,\
-    Integer, String, Text, Boolean, DateTime
+    Integer, String, Text, Boolean, DateTime, Float
 from sqlalchemy.schema import CreateTable
-from sqlalchemy.sql import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import select, bindparam, and_, or_, func
 from livebridge.storages.base import BaseStorage
 
 
@@ -34,6 +35,9 @@ class SQLStorage(BaseStorage):
 
     _instance = None
 
+    # stays below the limit of 999 bound parameters of SQLite
+    known_posts_chunk_size = 500
+
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
             cls._instance = super(SQLStorage, cls).__new__(cls)
@@ -44,6 +48,8 @@ class SQLStorage(BaseStorage):
         self.dsn = kwargs.get("dsn", None)
         self.table_name = kwargs.get("table_name")
         self.control_table_name = kwargs.get("control_table_name")
+        self.outbox_table_name = kwargs.get("outbox_table_name")
+        self.lease_table_name = kwargs.get("lease_table_name")
 
     @property
     async def db(self):
@@ -72,6 +78,24 @@ class SQLStorage(BaseStorage):
                      Column("data", Text()),
                      Column("updated", DateTime()))
 
+    def _get_outbox_table(self):
+        return Table(self.outbox_table_name, MetaData(),
+                     Column("id", String(32), primary_key=True),
+                     Column("bridge", String(32), index=True),
+                     Column("target", String(150)),
+                     Column("source", String(150)),
+                     Column("post_id", String(150)),
+                     Column("data", Text()),
+                     Column("count", Integer()),
+                     Column("dead", Boolean()),
+                     Column("created", Float()))
+
+    def _get_lease_table(self):
+        return Table(self.lease_table_name, MetaData(),
+                     Column("name", String(150), primary_key=True),
+                     Column("owner", String(150)),
+                     Column("expires", Float()))
+
     async def setup(self):
         """Setting up SQL table, if it not exists."""
         try:
@@ -97,6 +121,16 @@ class SQLStorage(BaseStorage):
                 items = self._get_control_table()
                 await engine.execute(CreateTable(items))
                 created = True
+            # create outbox table if not already created.
+            if self.outbox_table_name and not await engine.has_table(self.outbox_table_name):
+                logger.info("Creating SQL outbox table [{}]".format(self.outbox_table_name))
+                await engine.execute(CreateTable(self._get_outbox_table()))
+                created = True
+            # create lease table if not already created.
+            if self.lease_table_name and not await engine.has_table(self.lease_table_name):
+                logger.info("Creating SQL lease table [{}]".format(self.lease_table_name))
+                await engine.execute(CreateTable(self._get_lease_table()))
+                created = True
             return created
         except Exception as exc:
             logger.error("[DB] Error when setting up SQL table: {}".format(exc))
@@ -120,6 +154,19 @@ class SQLStorage(BaseStorage):
             logger.exception(exc)
         return None
 
+    async def get_last_updated_sources(self, source_ids):
+        try:
+            db = await self.db
+            table = self._get_table()
+            sql = select(columns=[table.c.source_id, func.max(table.c.updated)]).where(
+                table.c.source_id.in_(source_ids)).group_by(table.c.source_id)
+            db_res = await db.execute(sql)
+            return {row[0]: row[1] for row in await db_res.fetchall()}
+        except Exception as exc:
+            logger.error("[DB] Error when querying for last updated items on {}".format(source_ids))
+            logger.exception(exc)
+        return None
+
     async def get_known_posts(self, source_id, post_ids):
         results = []
         try:
@@ -135,6 +182,18 @@ class SQLStorage(BaseStorage):
             logger.exception(exc)
         return results
 
+    async def get_source_post_ids(self, source_id):
+        try:
+            db = await self.db
+            table = self._get_table()
+            sql = select(columns=[table.c.post_id]).where(table.c.source_id == source_id).distinct()
+            db_res = await db.execute(sql)
+            return [row[0] for row in await db_res.fetchall()]
+        except Exception as exc:
+            logger.error("[DB] Error when querying for posts of {}".format(source_id))
+            logger.exception(exc)
+        return None
+
     async def get_post(self, target_id, post_id):
         try:
             db = await self.db
@@ -151,20 +210,31 @@ class SQLStorage(BaseStorage):
             logger.error(exc)
         return None
 
+    async def get_posts(self, target_id, post_ids):
+        results = {}
+        try:
+            db = await self.db
+            table = self._get_table()
+            post_ids = list(set(post_ids))
+            for x in range(0, len(post_ids), self.known_posts_chunk_size):
+                sql = table.select().where(table.c.target_id == target_id).where(
+                    table.c.post_id.in_(post_ids[x:x + self.known_posts_chunk_size]))
+                result = await db.execute(sql)
+                for item in await result.fetchall():
+                    item = dict(item)
+                    item["target_doc"] = json.loads(item["target_doc"]) if item.get("target_doc") != "" else {}
+                    results[item["post_id"]] = item
+            return results
+        except Exception as exc:
+            logger.error("[DB] Error when querying for {} posts on {}".format(len(post_ids), target_id))
+            logger.error(exc)
+        return None
+
     async def insert_post(self, **kwargs):
         try:
             db = await self.db
             table = self._get_table()
-            sql = table.insert().values(
-                target_id=kwargs.get("target_id"),
-                post_id=kwargs.get("post_id"),
-                source_id=kwargs.get("source_id"),
-                text=kwargs.get("text"),
-                sticky=int(kwargs.get("sticky", "0")),
-                created=kwargs.get("created"),
-                updated=kwargs.get("updated"),
-                target_doc=json.dumps(kwargs.get("target_doc")) if kwargs.get("target_doc") else ""
-            )
+            sql = table.insert().values(**self._values(**kwargs))
             await db.execute(sql)
             logger.info("[DB] Post {} {} was saved!".format(kwargs["source_id"], kwargs["post_id"]))
             return True
@@ -173,6 +243,49 @@ class SQLStorage(BaseStorage):
             logger.error(exc)
         return False
 
+    def _values(self, **kwargs):
+        return {
+            "target_id": kwargs.get("target_id"),
+            "post_id": kwargs.get("post_id"),
+            "source_id": kwargs.get("source_id"),
+            "text": kwargs.get("text"),
+            "sticky": int(kwargs.get("sticky", "0")),
+            "created": kwargs.get("created"),
+            "updated": kwargs.get("updated"),
+            "target_doc": json.dumps(kwargs.get("target_doc")) if kwargs.get("target_doc") else ""
+        }
+
+    async def insert_posts(self, posts):
+        try:
+            db = await self.db
+            table = self._get_table()
+            await db.execute(table.insert(), [self._values(**post) for post in posts])
+            logger.info("[DB] {} posts were saved!".format(len(posts)))
+            return True
+        except Exception as exc:
+            logger.error("[DB] Error when saving {} posts".format(len(posts)))
+            logger.error(exc)
+        return False
+
+    async def update_posts(self, posts):
+        try:
+            db = await self.db
+            table = self._get_table()
+            sql = table.update().where(
+                table.c.target_id == bindparam("b_target_id")
+            ).where(
+                table.c.post_id == bindparam("b_post_id")
+            )
+            params = [dict(self._values(**post), b_target_id=post.get("target_id"), b_post_id=post.get("post_id"))
+                      for post in posts]
+            await db.execute(sql, params)
+            logger.info("[DB] {} posts were updated!".format(len(posts)))
+            return True
+        except Exception as exc:
+            logger.error("[DB] Error when updating {} posts".format(len(posts)))
+            logger.error(exc)
+        return False
+
     async def update_post(self, **kwargs):
         try:
             db = await self.db
@@ -181,16 +294,7 @@ class SQLStorage(BaseStorage):
                 table.c.target_id == kwargs.get("target_id")
             ).where(
                 table.c.post_id == kwargs.get("post_id")
-            ).values(
-                target_id=kwargs.get("target_id"),
-                post_id=kwargs.get("post_id"),
-                source_id=kwargs.get("source_id"),
-                text=kwargs.get("text"),
-                sticky=int(kwargs.get("sticky", "0")),
-                created=kwargs.get("created"),
-                updated=kwargs.get("updated"),
-                target_doc=json.dumps(kwargs.get("target_doc")) if kwargs.get("target_doc") else ""
-            )
+            ).values(**self._values(**kwargs))
             await db.execute(sql)
             logger.info("[DB] Post {} {} was updated!".format(kwargs.get("post_id"), kwargs.get("target_id")))
             return True
@@ -258,3 +362,95 @@ class SQLStorage(BaseStorage):
             logger.error("[DB] Error when saving control data on {}".format(self.control_table_name))
             logger.error(exc)
         return False
+
+    async def save_outbox_item(self, **kwargs):
+        try:
+            db = await self.db
+            table = self._get_outbox_table()
+            values = {c.name: kwargs.get(c.name) for c in table.columns}
+            conn = await db.connect()
+            try:
+                trans = await conn.begin()
+                await conn.execute(table.delete().where(table.c.id == kwargs["id"]))
+                await conn.execute(table.insert().values(**values))
+                await trans.commit()
+            finally:
+                await conn.close()
+            return True
+        except Exception as exc:
+            logger.error("[DB] Error when saving outbox item {}".format(kwargs.get("id")))
+            logger.error(exc)
+        return False
+
+    async def get_outbox_items(self, bridge):
+        results = []
+        try:
+            db = await self.db
+            table = self._get_outbox_table()
+            sql = table.select().where(table.c.bridge == bridge).order_by(table.c.created)
+            db_res = await db.execute(sql)
+            for row in await db_res.fetchall():
+                item = dict(row)
+                item["dead"] = bool(item["dead"])
+                results.append(item)
+        except Exception as exc:
+            logger.error("[DB] Error when querying outbox items of {}".format(bridge))
+            logger.error(exc)
+        return results
+
+    async def delete_outbox_item(self, bridge, item_id):
+        try:
+            db = await self.db
+            table = self._get_outbox_table()
+            await db.execute(table.delete().where(table.c.id == item_id))
+            return True
+        except Exception as exc:
+            logger.error("[DB] Error when deleting outbox item {}".format(item_id))
+            logger.error(exc)
+        return False
+
+    async def acquire_lease(self, name, owner, expires, now):
+        try:
+            db = await self.db
+            table = self._get_lease_table()
+            sql = table.update().where(and_(
+                table.c.name == name, or_(table.c.owner == owner, table.c.expires < now))).values(
+                    owner=owner, expires=expires)
+            res = await db.execute(sql)
+            if res.rowcount:
+                return True
+            # lease doesn't exist yet, primary key prevents concurrent inserts
+            await db.execute(table.insert().values(name=name, owner=owner, expires=expires))
+            return True
+        except IntegrityError:
+            pass
+        except Exception as exc:
+            logger.error("[DB] Error when acquiring lease {}".format(name))
+            logger.error(exc)
+        return False
+
+    async def release_lease(self, name, owner):
+        try:
+            db = await self.db
+            table = self._get_lease_table()
+            await db.execute(table.delete().where(and_(table.c.name == name, table.c.owner == owner)))
+            return True
+        except Exception as exc:
+            logger.error("[DB] Error when releasing lease {}".format(name))
+            logger.error(exc)
+        return False
+
+    async def get_leases(self, prefix=None):
+        results = []
+        try:
+            db = await self.db
+            table = self._get_lease_table()
+            sql = table.select()
+            if prefix:
+                sql = sql.where(table.c.name.startswith(prefix))
+            db_res = await db.execute(sql)
+            results = [dict(row) for row in await db_res.fetchall()]
+        except Exception as exc:
+            logger.error("[DB] Error when querying leases")
+            logger.error(exc)
+        return results
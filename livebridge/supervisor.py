@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import logging
+import multiprocessing
+import signal
+from livebridge import config, LiveBridge
+from livebridge.components import get_db_client, get_hash, get_source_key, reset_db_clients
+from livebridge.controller import Controller
+from livebridge.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Worker(object):
+    """Runs the bridges assigned by the :class:`Supervisor` in a forked process.
+
+    :param index: number of the worker
+    :param conn: connection to the supervisor, see :func:`multiprocessing.Pipe`"""
+
+    def __init__(self, index, conn):
+        self.index = index
+        self.conn = conn
+        self.loop = None
+        self.controller = None
+
+    def __repr__(self):
+        return "<Worker {}>".format(self.index)
+
+    def run(self):
+        # drop state inherited from the supervisor process
+        signal.set_wakeup_fd(-1)
+        for signame in ("SIGINT", "SIGTERM"):
+            signal.signal(getattr(signal, signame), signal.SIG_DFL)
+        reset_db_clients()
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.controller = Controller(config=config, control_file=None)
+        self.loop.add_reader(self.conn.fileno(), self.receive)
+        for signame in ("SIGINT", "SIGTERM"):
+            self.loop.add_signal_handler(getattr(signal, signame), self.loop.stop)
+        logger.info("Started worker {}.".format(self.index))
+
+        lb = LiveBridge(loop=self.loop, controller=self.controller)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.remove_reader(self.conn.fileno())
+            lb.shutdown()
+            self.loop.run_until_complete(get_db_client().shutdown())
+            self.loop.close()
+            logger.info("Stopped worker {}.".format(self.index))
+
+    def receive(self):
+        try:
+            while self.conn.poll():
+                command, data = self.conn.recv()
+                self.handle(command, data)
+        except (EOFError, OSError):
+            logger.error("Worker {} lost connection to supervisor.".format(self.index))
+            self.loop.stop()
+
+    def handle(self, command, data):
+        if command == "add":
+            logger.info("Worker {} adds {} bridges.".format(self.index, len(data)))
+            asyncio.ensure_future(self._apply(self.controller.add_bridges(data)))
+        elif command == "remove":
+            logger.info("Worker {} removes {} bridges.".format(self.index, len(data)))
+            asyncio.ensure_future(self._apply(self.controller.remove_bridges(data)))
+        elif command == "update":
+            logger.info("Worker {} updates {} bridges.".format(self.index, len(data)))
+            asyncio.ensure_future(self._apply(self.controller.update_bridges(data)))
+        elif command == "limits":
+            self.controller.set_limits(data)
+        elif command == "wake":
+            self.controller.wake(data)
+        elif command == "stop":
+            self.loop.stop()
+        else:
+            logger.error("Worker {} got unknown command {}.".format(self.index, command))
+
+    async def _apply(self, change):
+        try:
+            await change
+        except Exception as exc:
+            logger.error("Worker {} failed changing bridges.".format(self.index))
+            logger.exception(exc)
+
+
+def run_worker(index, conn):
+    Worker(index, conn).run()
+
+
+class Supervisor(Controller):
+    """Controller forking *workers* processes, which run the bridges.
+
+    Only the supervisor reads and watches the control data. Every bridge is assigned to one
+    worker by the key of its source, changes of the control data are sent as diffs
+    of added, removed and updated bridges to the workers. Updated bridges stay on their worker.
+    Crashed workers get restarted with their bridges.
+
+    :param workers: number of worker processes"""
+
+    runs_bridges = False
+
+    def __init__(self, config, control_file, *, workers):
+        super(Supervisor, self).__init__(config, control_file)
+        self.workers = workers
+        self.processes = {}
+        self.assigned = {index: {} for index in range(workers)}
+        self.limits = {}
+        self.monitor_interval = 5
+        self.monitor_timer = None
+        # workers drain their bridges and wait for running polls
+        self.stop_timeout = 2 * self.drain_timeout + 10
+
+    def worker_of(self, bridge_config):
+        """Returns index of the worker running the bridge of *bridge_config*. Bridges with the \
+           same source run on the same worker, where they share the source."""
+        return int(get_source_key(bridge_config), 16) % self.workers
+
+    def start_worker(self, index):
+        ctx = multiprocessing.get_context("fork")
+        conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=run_worker, args=(index, child_conn),
+                              name="livebridge-worker-{}".format(index), daemon=True)
+        process.start()
+        child_conn.close()
+        self.processes[index] = (process, conn)
+        logger.info("Forked worker {} with pid {}.".format(index, process.pid))
+        if self.limits:
+            self.send(index, "limits", self.limits)
+        if self.assigned[index]:
+            self.send(index, "add", list(self.assigned[index].values()))
+
+    def start_workers(self):
+        for index in range(self.workers):
+            if index not in self.processes:
+                self.start_worker(index)
+        metrics.add_collector(self.collect)
+        self._watch_workers()
+
+    def _watch_workers(self):
+        self.monitor_timer = asyncio.get_event_loop().call_later(self.monitor_interval, self.check_workers)
+
+    def check_workers(self):
+        """Restarts crashed workers."""
+        if self.shutdown is True:
+            return
+        for index, (process, conn) in list(self.processes.items()):
+            if not process.is_alive():
+                logger.error("Worker {} exited with code {}, restarting.".format(index, process.exitcode))
+                metrics.incr("workers_restarted_total", worker=index)
+                conn.close()
+                self.start_worker(index)
+        self._watch_workers()
+
+    def send(self, index, command, data):
+        try:
+            self.processes[index][1].send((command, data))
+            return True
+        except (OSError, KeyError) as exc:
+            # worker gets its bridges again when restarted
+            logger.error("Sending {} to worker {} failed: {}".format(command, index, exc))
+        return False
+
+    def _by_worker(self, bridge_configs, *, key=None):
+        assignment = {}
+        for item in bridge_configs:
+            bridge_config = item[key] if key else item
+            bridge_hash = get_hash(bridge_config)
+            # bridges updated in place may run on another worker than their hash says
+            index = next((i for i, assigned in self.assigned.items() if bridge_hash in assigned),
+                         self.worker_of(bridge_config))
+            assignment.setdefault(index, []).append(item)
+        return assignment
+
+    async def run(self):
+        if not self.processes:
+            self.start_workers()
+        return await super(Supervisor, self).run()
+
+    def set_limits(self, limits):
+        # targets are created by the workers
+        if limits != self.limits:
+            self.limits = limits
+            for index in self.processes:
+                self.send(index, "limits", limits)
+
+    def wake(self, key):
+        # forwarded to the workers running the bridges of key
+        woken = 0
+        for index, assigned in self.assigned.items():
+            matching = [c for h, c in assigned.items()
+                        if key in [h, str(c.get("source_id")), get_source_key(c)]]
+            if matching and self.send(index, "wake", key):
+                woken += len(matching)
+        return woken
+
+    async def add_bridges(self, bridge_configs):
+        for index, configs in self._by_worker(bridge_configs).items():
+            for bridge_config in configs:
+                self.assigned[index][get_hash(bridge_config)] = bridge_config
+            self.send(index, "add", configs)
+
+    async def remove_bridges(self, bridge_configs):
+        for index, configs in self._by_worker(bridge_configs).items():
+            for bridge_config in configs:
+                self.assigned[index].pop(get_hash(bridge_config), None)
+            self.send(index, "remove", configs)
+
+    async def update_bridges(self, changes):
+        # updated bridges stay on their worker
+        for index, worker_changes in self._by_worker(changes, key="old").items():
+            for change in worker_changes:
+                self.assigned[index].pop(get_hash(change["old"]), None)
+                self.assigned[index][get_hash(change["new"])] = change["new"]
+            self.send(index, "update", worker_changes)
+
+    async def stop_bridges(self):
+        for index in self.processes:
+            self.send(index, "stop", None)
+
+    async def clean_shutdown(self):
+        logger.info("Stopping workers.")
+        self.shutdown = True
+        if self.monitor_timer:
+            self.monitor_timer.cancel()
+        if self.watch_timer:
+            self.watch_timer.cancel()
+        await self.close_control_data()
+        await self.stop_bridges()
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.stop_timeout
+        for process, conn in self.processes.values():
+            await loop.run_in_executor(None, process.join, max(0, deadline - loop.time()))
+        for index, (process, conn) in self.processes.items():
+            if process.is_alive():
+                logger.warning("Terminating worker {}.".format(index))
+                process.terminate()
+                await loop.run_in_executor(None, process.join, 1)
+            conn.close()
+        metrics.remove_collector(self.collect)
+
+    def collect(self):
+        yield ("workers_alive", {}, sum(1 for p, c in self.processes.values() if p.is_alive()))
+        for index, bridges in self.assigned.items():
+            yield ("worker_bridges", {"worker": index}, len(bridges))
@@ -14,23 +14,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import hashlib
+import hmac
 import json
 import logging
 import uuid
 import os.path
 from aiohttp import web
+from livebridge.breaker import get_breakers
+from livebridge.metrics import metrics
+from livebridge.polling import get_poll_scheduler
 
 logger = logging.getLogger(__name__)
 
 _tokens = []
 
+# routes checking their authorization themselves
+_public_routes = ["polls_wake"]
+
+
+def _get_token(request):
+    return request.cookies.get("lb-db") or request.headers.get("X-Auth-Token")
+
+
 @web.middleware
 async def auth_middleware(request, handler):
     try:
         # check auth header
-        if request.path not in ["/", "/api/v1/session"] and not request.path.startswith("/dashboard"):
-            token = request.cookies.get("lb-db") or request.headers.get("X-Auth-Token")
-            if token not in _tokens:
+        if request.path not in ["/", "/api/v1/session"] and not request.path.startswith("/dashboard") \
+                and request.match_info.route.name not in _public_routes:
+            if _get_token(request) not in _tokens:
                 return web.json_response({"error": "Invalid token."}, status=401)
         # return response
         response = await handler(request)
@@ -69,6 +81,10 @@ class WebApi(object):
         self.app.router.add_static("/dashboard", self.static_path, show_index=True)
         self.app.router.add_get("/api/v1/controldata", self.control_get)
         self.app.router.add_put("/api/v1/controldata", self.control_put)
+        self.app.router.add_get("/api/v1/metrics", self.metrics_get)
+        self.app.router.add_get("/api/v1/breakers", self.breakers_get)
+        self.app.router.add_get("/api/v1/polls", self.polls_get)
+        self.app.router.add_post("/api/v1/polls/{key}/wake", self.polls_wake, name="polls_wake")
         self.app.router.add_post("/api/v1/session", self.login, expect_handler=web.Request.json)
         self.handler = self.app._make_handler()
         f = self.loop.create_server(self.handler, self.config["host"], self.config["port"])
@@ -134,6 +150,42 @@ class WebApi(object):
             logger.exception(exc)
             return web.json_response({"error": "Internal Server Error"}, status=500)
 
+    async def metrics_get(self, request):
+        return web.json_response(metrics.snapshot())
+
+    def _in_workers(self):
+        # state of the bridges is kept by the worker processes
+        return not getattr(self.app["controller"], "runs_bridges", True)
+
+    async def breakers_get(self, request):
+        if self._in_workers():
+            return web.json_response({"error": "Not available with worker processes."}, status=501)
+        return web.json_response({"breakers": get_breakers()})
+
+    async def polls_get(self, request):
+        if self._in_workers():
+            return web.json_response({"error": "Not available with worker processes."}, status=501)
+        return web.json_response({"polls": get_poll_scheduler().info()})
+
+    def _check_signature(self, request, body):
+        # webhooks sign the body with the shared secret, the session token is accepted too
+        if _get_token(request) in _tokens:
+            return True
+        secret = self.config.get("hook_secret")
+        signature = request.headers.get("X-Livebridge-Signature", "")
+        if not secret or not signature.startswith("sha256="):
+            return False
+        expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature[len("sha256="):], expected)
+
+    async def polls_wake(self, request):
+        if not self._check_signature(request, await request.read()):
+            return web.json_response({"error": "Invalid token."}, status=401)
+        woken = self.app["controller"].wake(request.match_info["key"])
+        if not woken:
+            return web.json_response({"error": "No polled bridge found."}, status=404)
+        return web.json_response({"woken": woken})
+
     def shutdown(self):
         logger.debug("Shutting down web API!")
         if self.srv:
@@ -13,9 +13,13 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asynctest
+import hashlib
 import os
 import json
+import uuid
 from livebridge.components import get_db_client
+from livebridge.downloads import Download
 
 
 def load_file(name):
@@ -39,3 +43,16 @@ def get_dynamo_client(access_key, secret_key, region, endpoint_url, table_name="
             region=region,
             endpoint_url=endpoint_url,
             table_name=table_name)
+
+
+def fetch(directory, status, headers, body=b""):
+    """Mock of :func:`ImageCache._fetch`, which writes *body* to *directory* like the downloader."""
+    async def _fetch(url, request_headers):
+        if status != 200:
+            return Download(status, headers)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "{}.part".format(uuid.uuid4()))
+        with open(path, "wb") as file:
+            file.write(body)
+        return Download(status, headers, path, hashlib.sha256(body).hexdigest(), len(body))
+    return asynctest.CoroutineMock(side_effect=_fetch)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import asynctest
+from unittest.mock import MagicMock
+from livebridge.breaker import CircuitBreaker, get_breaker, get_breakers, CLOSED, OPEN, HALF_OPEN
+from livebridge.metrics import metrics
+
+
+class CircuitBreakerTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker("test:foo", threshold=3, cooldown=0.1)
+
+    def tearDown(self):
+        self.breaker._cancel_timer()
+        metrics.clear()
+
+    def _lane(self, stopped=False):
+        return MagicMock(stopped=stopped)
+
+    async def test_open(self):
+        assert self.breaker.allow() is True
+        self.breaker.failure()
+        self.breaker.failure()
+        assert self.breaker.state == CLOSED
+        self.breaker.success()
+        assert self.breaker.failures == 0
+        for _ in range(3):
+            self.breaker.failure()
+        assert self.breaker.state == OPEN
+        assert self.breaker.allow() is False
+        assert metrics.get("breaker_opened_total", key="test:foo") == 1
+        assert metrics.get("breaker_state", key="test:foo") == 1
+        assert repr(self.breaker) == "<CircuitBreaker test:foo open>"
+
+    async def test_probe(self):
+        lane = self._lane()
+        for _ in range(3):
+            self.breaker.failure()
+        self.breaker.park(lane, "one")
+        self.breaker.park(lane, "two")
+        await asyncio.sleep(0.15)
+        # one item got re-enqueued as probe
+        assert lane.retry.call_args_list == [asynctest.call("one")]
+        assert self.breaker.parked == [(lane, "two")]
+        assert self.breaker.allow() is True
+        assert self.breaker.state == HALF_OPEN
+        # only a single probe
+        assert self.breaker.allow() is False
+        self.breaker.success()
+        assert self.breaker.state == CLOSED
+        assert lane.retry.call_args_list == [asynctest.call("one"), asynctest.call("two")]
+        assert self.breaker.parked == []
+
+    async def test_probe_failing(self):
+        for _ in range(3):
+            self.breaker.failure()
+        await asyncio.sleep(0.15)
+        assert self.breaker.allow() is True
+        self.breaker.failure()
+        assert self.breaker.state == OPEN
+        assert self.breaker.allow() is False
+        assert self.breaker.info()["retry_in"] > 0
+
+    async def test_probe_lost(self):
+        lane, other = self._lane(), self._lane()
+        for _ in range(3):
+            self.breaker.failure()
+        self.breaker.park(lane, "one")
+        self.breaker.park(other, "two")
+        self.breaker.park(other, "three")
+        await asyncio.sleep(0.15)
+        assert lane.retry.call_args_list == [asynctest.call("one")]
+        # lane got stopped before delivering the probe
+        lane.stopped = True
+        assert self.breaker.timer is not None
+        await asyncio.sleep(0.1)
+        assert other.retry.call_args_list == [asynctest.call("two")]
+        # probe got lost while delivering
+        assert self.breaker.allow() is True
+        assert self.breaker.probing is True
+        await asyncio.sleep(0.1)
+        assert self.breaker.probing is False
+        assert other.retry.call_args_list == [asynctest.call("two"), asynctest.call("three")]
+        assert self.breaker.allow() is True
+        self.breaker.success()
+        assert self.breaker.state == CLOSED
+        assert self.breaker.timer is None
+
+    async def test_stopped_lanes(self):
+        stopped, lane = self._lane(stopped=True), self._lane()
+        self.breaker.park(stopped, "one")
+        self.breaker.park(lane, "two")
+        self.breaker._probe()
+        assert stopped.retry.call_count == 0
+        assert lane.retry.call_count == 1
+        self.breaker.park(stopped, "three")
+        self.breaker.park(lane, "four")
+        assert self.breaker.discard(lane) == ["four"]
+        self.breaker.drain()
+        assert stopped.retry.call_count == 0
+        assert self.breaker.parked == []
+
+    async def test_info(self):
+        self.breaker.park(self._lane(), "one")
+        assert self.breaker.info() == {"key": "test:foo", "state": "closed", "failures": 0,
+                                       "parked": 1, "retry_in": None}
+
+    async def test_get_breaker(self):
+        breaker = get_breaker("test:bar")
+        assert isinstance(breaker, CircuitBreaker)
+        assert get_breaker("test:bar") is breaker
+        assert breaker.info() in get_breakers()
@@ -15,9 +15,24 @@
 # limitations under the License.
 import asyncio
 import asynctest
-from livebridge.base import BaseTarget, InvalidTargetResource
+from livebridge.base import BasePost, BaseTarget, InvalidTargetResource
+from livebridge.breaker import CircuitBreaker
 from livebridge.bridge import LiveBridge
 from livebridge.components import get_hash
+from livebridge.delivery import DeliveryLane
+from livebridge.metrics import metrics
+from livebridge.retries import get_retry_scheduler
+
+
+class MockPost(BasePost):
+
+    def __init__(self, post_id):
+        super(MockPost, self).__init__({})
+        self.post_id = post_id
+
+    @property
+    def id(self):
+        return self.post_id
 
 
 class LiveBridgeTest(asynctest.TestCase):
@@ -41,8 +56,8 @@ class LiveBridgeTest(asynctest.TestCase):
         assert self.bridge.endpoint == self.endpoint
         assert self.bridge.label == self.label
         assert self.bridge.hash == get_hash(self.bridge_config)
-        assert self.bridge.retry_multiplier == 5
         assert self.bridge.max_retries == 10
+        assert self.bridge.retries is get_retry_scheduler()
 
     async def test_client_init(self):
         assert repr(self.bridge).startswith("<LiveBridge [Testlabel] https://example.com/api 12345 MD5:") == True
@@ -52,132 +67,511 @@ class LiveBridgeTest(asynctest.TestCase):
         self.bridge.add_target(self.sc)
         assert len(self.bridge.targets) == 1
 
-    async def test_put_to_queue(self):
-        with asynctest.patch("asyncio.ensure_future") as mocked_ensure:
-            mocked_ensure.return_value = "test"
-            self.bridge._queue_consumer = asynctest.CoroutineMock(return_value="test")
-            self.bridge.queue = asynctest.MagicMock()
-            self.bridge.queue.put = asynctest.CoroutineMock(return_value=None)
-            await self.bridge._put_to_queue({"foo": "baz"})
-            assert self.bridge._queue_consumer.call_count == 1
-            assert self.bridge.queue.put.call_count == 1
-            assert self.bridge.queue_task == "test"
-
-            await self.bridge._put_to_queue({"foo": "baz"})
-            assert self.bridge._queue_consumer.call_count == 1
-            assert self.bridge.queue.put.call_count == 2
-            assert self.bridge.queue_task == "test"
+    async def test_remove_target(self):
+        keep, gone = asynctest.MagicMock(target_id="keep"), asynctest.MagicMock(target_id="gone")
+        self.bridge.add_target(keep)
+        self.bridge.add_target(gone)
+        self.bridge.outbox = asynctest.MagicMock()
+        self.bridge.outbox.remove = asynctest.CoroutineMock(return_value=True)
+        lane, other = asynctest.MagicMock(), asynctest.MagicMock()
+        lane.items = [{"outbox": {"id": "1"}}]
+        lane.pending = {"one": [{"outbox": {"id": "2"}}]}
+        self.bridge.lanes = {gone: lane, keep: other}
+        item = {"target": gone, "post": asynctest.MagicMock(id="two"), "count": 1, "outbox": {"id": "3"}}
+        self.bridge.retries.schedule(item, lane.retry, bridge=self.bridge, delay=10)
+        self.bridge.retries.schedule(dict(item, target=keep), other.retry, bridge=self.bridge, delay=10)
+
+        assert self.bridge.remove_target(gone) == 3
+        await asyncio.sleep(0)
+        assert self.bridge.targets == [keep]
+        assert self.bridge.lanes == {keep: other}
+        assert lane.stop.call_count == 1
+        assert other.stop.call_count == 0
+        assert [e.target for e in self.bridge.retries.pending(bridge=self.bridge)] == [keep]
+        assert self.bridge.outbox.remove.call_count == 3
+        self.bridge.retries.cancel(bridge=self.bridge)
+
+    async def test_finish_item_of_removed_target(self):
+        target = asynctest.MagicMock(target_id="gone")
+        lane = asynctest.MagicMock(stopped=True)
+        self.bridge.outbox = asynctest.MagicMock()
+        self.bridge.outbox.remove = asynctest.CoroutineMock(return_value=True)
+        item = {"target": target, "post": asynctest.MagicMock(id="one"), "count": 0, "outbox": {"id": "1"}}
+        await self.bridge._finish_lane_item(lane, item, Exception("failed"))
+        assert self.bridge.outbox.remove.call_count == 1
+        assert self.bridge.retries.pending(bridge=self.bridge) == []
+        assert lane.done.call_count == 0
+
+    async def test_reconfigure(self):
+        keep, gone, new = [asynctest.MagicMock(target_id=x) for x in ["keep", "gone", "new"]]
+        self.bridge.add_target(gone)
+        self.bridge.add_target(keep)
+        outbox_key = self.bridge.outbox_key
+        config = dict(self.bridge_config, targets=[{"id": "new"}, {"id": "keep"}])
+        self.bridge.reconfigure(config, [new, keep])
+        assert self.bridge.targets == [new, keep]
+        assert self.bridge.config == config
+        assert self.bridge.hash == get_hash(config)
+        assert self.bridge.outbox_key == outbox_key
+        assert self.bridge._target_key(keep) == get_hash({"id": "keep"})
+
+    async def test_replace_target(self):
+        old, new, keep = [asynctest.MagicMock(target_id=x) for x in ["old", "new", "keep"]]
+        self.bridge.add_target(old)
+        self.bridge.add_target(keep)
+        self.bridge.outbox = asynctest.MagicMock()
+        self.bridge.outbox.put = asynctest.CoroutineMock(return_value=True)
+        self.bridge.outbox.remove = asynctest.CoroutineMock(return_value=True)
+        lane = self.bridge.lanes[old] = DeliveryLane(
+            self.bridge, old, asynctest.CoroutineMock(), scheduler=asynctest.MagicMock())
+        queued = {"post": MockPost("one"), "target": old, "count": 0, "outbox": {"id": "1", "target": "x"}}
+        lane.put(queued)
+        retry = {"post": MockPost("two"), "target": old, "count": 1, "outbox": {"id": "2", "target": "x"}}
+        self.bridge.retries.schedule(retry, lane.retry, bridge=self.bridge, delay=10)
+        lane.breaker = CircuitBreaker("old")
+        parked = {"post": MockPost("three"), "target": old, "count": 1, "outbox": {"id": "3", "target": "x"}}
+        lane.breaker.park(lane, parked)
+        config = dict(self.bridge_config, targets=[{"id": "old", "auth": "new"}, {"id": "keep"}])
+        self.bridge.reconfigure(config, [new, keep], replaced={old: new})
+        await asyncio.sleep(0)
+        assert self.bridge.targets == [new, keep]
+        # deliveries and outbox records go to the new client
+        assert self.bridge.lanes == {new: lane}
+        assert lane.target is new
+        assert queued["target"] is new
+        assert [e.target for e in self.bridge.retries.pending(bridge=self.bridge)] == [new]
+        assert queued["outbox"]["target"] == self.bridge._target_key(new) == get_hash({"id": "old", "auth": "new"})
+        assert retry["outbox"]["target"] == self.bridge._target_key(new)
+        # parked items are checked by the breaker of the new service
+        assert lane.breaker.key == self.bridge._breaker_key(new)
+        assert parked["target"] is new
+        assert parked in lane.items
+        assert self.bridge.outbox.put.call_count == 3
+        assert self.bridge.outbox.remove.call_count == 0
+        self.bridge.retries.cancel(bridge=self.bridge)
+
+    async def test_put_to_lane(self):
+        target = asynctest.MagicMock()
+        post = asynctest.MagicMock(id="one")
+        self.bridge._process_lane_item = asynctest.CoroutineMock(return_value=None)
+        assert self.bridge.pipelined is True
+        await self.bridge._put_to_queue({"post": post, "target": target, "count": 0})
+        assert len(self.bridge.lanes) == 1
+        assert self.bridge.lanes[target].target == target
+        await self.bridge.lanes[target].join()
+        assert self.bridge._process_lane_item.call_count == 1
+        self.bridge.stop()
+
+    async def test_drain(self):
+        async def deliver(post):
+            await asyncio.sleep(0.05)
+            return True
+
+        target = asynctest.MagicMock(target_id="t")
+        target.handle_post = deliver
+        self.bridge.add_target(target)
+        self.bridge.outbox = None
+        for post_id in ["one", "two"]:
+            await self.bridge._put_to_queue({"post": asynctest.MagicMock(id=post_id), "target": target, "count": 0})
+        assert self.bridge.idle is False
+        assert await self.bridge.drain(1) is True
+        assert self.bridge.idle is True
+        assert self.bridge.lanes[target].stopped is True
+        assert metrics.histograms[("bridge_drain_seconds", ())]["count"] == 1
+        # no intake while draining
+        self.bridge.api_client.poll = asynctest.CoroutineMock()
+        assert await self.bridge.check_posts() is True
+        assert self.bridge.api_client.poll.call_count == 0
+        self.bridge._put_to_queue = asynctest.CoroutineMock()
+        await self.bridge.new_posts([asynctest.MagicMock(id="three")])
+        assert self.bridge._put_to_queue.call_count == 0
+        metrics.clear()
+
+    async def test_drain_timeout(self):
+        target = asynctest.MagicMock(target_id="t")
+        self.bridge.add_target(target)
+        self.bridge.outbox = asynctest.MagicMock()
+        self.bridge.outbox.put = asynctest.CoroutineMock()
+        self.bridge.outbox.record = lambda bridge, target, item: {"id": item["post"].id}
+        item = {"post": asynctest.MagicMock(id="one"), "target": target, "count": 1}
+        await self.bridge._put_to_queue(item)
+        self.bridge.lanes[target].items.clear()
+        # waiting for a retry after the deadline
+        self.bridge.retries.schedule(item, self.bridge.lanes[target].retry, bridge=self.bridge, delay=10)
+        assert await self.bridge.drain(0.05) is False
+        assert self.bridge.retries.pending(bridge=self.bridge) == []
+        # kept in outbox for the successor
+        self.bridge.outbox.release.assert_called_once_with([{"id": "one"}])
+        assert metrics.get("bridge_drain_left_total", bridge=self.bridge.hash) == 1
+        metrics.clear()
+
+    async def test_process_lane_item(self):
+        item = {"target": asynctest.MagicMock(), "post": asynctest.MagicMock(id="one"), "count": 0}
+        item["target"].handle_post = asynctest.CoroutineMock(return_value=True)
+        lane = asynctest.MagicMock()
+        await self.bridge._process_lane_item(lane, item)
+        assert item["target"].handle_post.call_args == asynctest.call(item["post"])
+        assert lane.done.call_args == asynctest.call(item)
+
+        # invalid target, no retry
+        item["target"].handle_post = asynctest.CoroutineMock(side_effect=InvalidTargetResource("Test"))
+        lane = asynctest.MagicMock()
+        await self.bridge._process_lane_item(lane, item)
+        assert item["count"] == 0
+        assert lane.done.call_count == 1
+
+    async def test_process_lane_item_retry(self):
+        item = {"target": asynctest.MagicMock(), "post": asynctest.MagicMock(id="one"), "count": 0}
+        item["target"].handle_post = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        lane = asynctest.MagicMock()
+        self.bridge.retries = asynctest.MagicMock()
+        await self.bridge._process_lane_item(lane, item)
+        assert item["count"] == 1
+        assert lane.done.call_count == 0
+        assert self.bridge.retries.schedule.call_args == asynctest.call(item, lane.retry, bridge=self.bridge)
+
+        # max retries reached
+        item["count"] = 10
+        lane = asynctest.MagicMock()
+        await self.bridge._process_lane_item(lane, item)
+        assert self.bridge.retries.schedule.call_count == 1
+        assert lane.done.call_count == 1
+
+    async def test_new_posts_pipelined(self):
+        slow, fast = asynctest.MagicMock(target_id="slow"), asynctest.MagicMock(target_id="fast")
+        delivered = []
+
+        async def slow_handle(post):
+            await asyncio.sleep(0.2)
+            delivered.append(("slow", post.id))
+
+        async def fast_handle(post):
+            delivered.append(("fast", post.id))
+
+        slow.handle_post = slow_handle
+        fast.handle_post = fast_handle
+        self.bridge.add_target(slow)
+        self.bridge.add_target(fast)
+        posts = [asynctest.MagicMock(id=str(x)) for x in range(3)]
+        for post in posts:
+            post.view.return_value = post
+        await self.bridge.new_posts(posts)
+        # new_posts does not wait for the slow target
+        await asyncio.sleep(0.1)
+        assert delivered == [("fast", "0"), ("fast", "1"), ("fast", "2")]
+        await self.bridge.lanes[slow].join()
+        assert [d[1] for d in delivered if d[0] == "slow"] == ["0", "1", "2"]
+        self.bridge.stop()
+
+    async def test_new_posts_sequential(self):
+        target = asynctest.MagicMock(target_id="target")
+        delivered = []
+
+        async def handle(post):
+            await asyncio.sleep(0.1)
+            delivered.append(post.id)
+
+        target.handle_post = handle
+        self.bridge.add_target(target)
+        self.bridge.pipelined = False
+        posts = [asynctest.MagicMock(id=str(x)) for x in range(3)]
+        for post in posts:
+            post.view.return_value = post
+        await self.bridge.new_posts(posts)
+        assert delivered == ["0", "1", "2"]
+        self.bridge.stop()
+
+    async def test_prefetch(self):
+        target, failing = asynctest.MagicMock(target_id="target"), asynctest.MagicMock(target_id="failing")
+        target.prefetch_posts = asynctest.CoroutineMock(return_value={"0": {"target_doc": {"id": 0}}})
+        failing.prefetch_posts = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        self.bridge.add_target(target)
+        self.bridge.add_target(failing)
+        self.bridge._get_lane(target).pending["2"] = []
+        res = await self.bridge._prefetch([MockPost("0"), MockPost("1"), MockPost("2")])
+        assert res == {target: {"0": {"target_doc": {"id": 0}}, "1": None}, failing: None}
+        # posts busy in the lane are left out
+        target.prefetch_posts.assert_called_once_with(["0", "1"])
+        self.bridge.stop()
+
+    async def test_new_posts_prefetched(self):
+        target = asynctest.MagicMock(target_id="target")
+        target.prefetch_posts = asynctest.CoroutineMock(return_value={"0": {"target_doc": {"id": 0}}})
+        self.bridge.add_target(target)
+        self.bridge._put_to_queue = asynctest.CoroutineMock()
+        await self.bridge.new_posts([MockPost("0"), MockPost("1"), MockPost("0")])
+        posts = [call[0][0]["post"] for call in self.bridge._put_to_queue.call_args_list]
+        assert target.prefetch_posts.call_count == 1
+        assert posts[0].prefetched is True
+        assert posts[0].get_existing() == {"target_doc": {"id": 0}}
+        assert posts[1].prefetched is True
+        assert posts[1].get_existing() is None
+        # repeated post gets read again, the first version may change it
+        assert posts[2].prefetched is False
+        self.bridge.stop()
+
+    async def test_saturated(self):
+        target = asynctest.MagicMock(target_id="target")
+        lane = self.bridge._get_lane(target)
+        assert self.bridge.saturated is False
+        lane.pending = {"one": [], "two": [], "three": []}
+        assert self.bridge.saturated is False
+        self.bridge.queue_size = 3
+        assert self.bridge.saturated is True
+        self.bridge.queue_size = 4
+        assert self.bridge.saturated is False
+        self.bridge.stop()
+
+    async def test_backpressure(self):
+        release = asyncio.Event()
+        target = asynctest.MagicMock(target_id="target")
+
+        async def handle(post):
+            await release.wait()
+
+        target.handle_post = handle
+        self.bridge.add_target(target)
+        self.bridge.queue_size = 4
+        self.bridge.api_client.mode = "streaming"
+        self.bridge.api_client.pause = asynctest.CoroutineMock(return_value=None)
+        self.bridge.api_client.resume = asynctest.CoroutineMock(return_value=None)
+        posts = [asynctest.MagicMock(id=str(x)) for x in range(6)]
+        for post in posts:
+            post.view.return_value = post
+        intake = asyncio.ensure_future(self.bridge.new_posts(posts))
+        await asyncio.sleep(0.1)
+        # intake blocked at high-water mark
+        assert intake.done() is False
+        assert self.bridge.paused is True
+        assert len(self.bridge.lanes[target]) == 4
+        assert self.bridge.api_client.pause.call_count == 1
+        assert metrics.get("delivery_backpressure", bridge=self.bridge.hash, label=self.label) == 1
+        assert metrics.get("delivery_backpressure_total", bridge=self.bridge.hash) == 1
+
+        # targets catches up
+        release.set()
+        await intake
+        await self.bridge.lanes[target].join()
+        assert self.bridge.paused is False
+        assert self.bridge.api_client.resume.call_count == 1
+        assert metrics.get("delivery_backpressure", bridge=self.bridge.hash, label=self.label) == 0
+        self.bridge.stop()
+        metrics.clear()
+
+    async def test_backpressure_polling(self):
+        release = asyncio.Event()
+        target = asynctest.MagicMock(target_id="target")
+
+        async def handle(post):
+            await release.wait()
+
+        target.handle_post = handle
+        self.bridge.add_target(target)
+        self.bridge.queue_size = 4
+        posts = [asynctest.MagicMock(id=str(x)) for x in range(6)]
+        for post in posts:
+            post.view.return_value = post
+        self.bridge.api_client.poll = asynctest.CoroutineMock(return_value=posts)
+        # a poll doesn't wait for capacity while holding its poll slot
+        await asyncio.wait_for(self.bridge.check_posts(), 1)
+        assert self.bridge.paused is True
+        assert len(self.bridge.lanes[target]) == 6
+        # next poll is skipped until the queue drained
+        await self.bridge.check_posts()
+        assert self.bridge.api_client.poll.call_count == 1
+        assert self.bridge.last_poll_count is None
+        assert metrics.get("poll_skipped", reason="backpressure", bridge=self.bridge.hash) == 1
+        release.set()
+        await self.bridge.lanes[target].join()
+        assert self.bridge.paused is False
+        await self.bridge.check_posts()
+        assert self.bridge.api_client.poll.call_count == 2
+        self.bridge.stop()
+        metrics.clear()
+
+    async def test_signal_source_failing(self):
+        self.bridge.api_client.pause = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        await self.bridge._signal_source(True)
+        assert self.bridge.api_client.pause.call_count == 1
+
+    async def test_get_lane_batch(self):
+        target = asynctest.MagicMock(batch_size=5)
+        lane = self.bridge._get_lane(target)
+        assert lane.batch_size == 5
+        assert lane.process_batch == self.bridge._process_lane_batch
+        lane = self.bridge._get_lane(asynctest.MagicMock())
+        assert lane.batch_size == 1
+        self.bridge.stop()
+
+    async def test_process_lane_batch(self):
+        target = asynctest.MagicMock(target_id="target")
+        items = [{"target": target, "post": asynctest.MagicMock(id=post_id), "count": 0}
+                 for post_id in ["one", "two", "three"]]
+        target.handle_posts = asynctest.CoroutineMock(return_value=[None, Exception("Test"), None])
+        self.bridge.retries = asynctest.MagicMock()
+        lane = asynctest.MagicMock(target=target)
+        await self.bridge._process_lane_batch(lane, items)
+        assert target.handle_posts.call_args == asynctest.call([i["post"] for i in items])
+        assert lane.done.call_args_list == [asynctest.call(items[0]), asynctest.call(items[2])]
+        assert self.bridge.retries.schedule.call_args == asynctest.call(items[1], lane.retry, bridge=self.bridge)
+
+        # failing batch
+        target.handle_posts = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        await self.bridge._process_lane_batch(lane, items)
+        assert self.bridge.retries.schedule.call_count == 4
+
+    async def test_breaker(self):
+        target = asynctest.MagicMock(target_id="target", breaker_key="test:foo")
+        lane = self.bridge._get_lane(target)
+        assert lane.breaker.key == "test:foo"
+        assert self.bridge._breaker_key(asynctest.MagicMock(type="bar", target_id="baz")) == "bar:baz"
+        lane.breaker = CircuitBreaker("test:foo", threshold=2, cooldown=10)
+        self.bridge.retries = asynctest.MagicMock()
+        target.handle_post = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        items = [{"target": target, "post": asynctest.MagicMock(id=post_id), "count": 0}
+                 for post_id in ["one", "two", "three"]]
+        await self.bridge._process_lane_item(lane, items[0])
+        assert self.bridge.retries.schedule.call_count == 1
+        # opens breaker, item gets parked without using up retries
+        await self.bridge._process_lane_item(lane, items[1])
+        assert lane.breaker.state == "open"
+        assert self.bridge.retries.schedule.call_count == 1
+        assert items[1]["count"] == 0
+        # no more deliveries
+        await self.bridge._process_lane_item(lane, items[2])
+        assert target.handle_post.call_count == 2
+        assert [item for parked_lane, item in lane.breaker.parked] == [items[1], items[2]]
+        # stopping bridge discards parked items
+        self.bridge.outbox = asynctest.MagicMock()
+        items[2]["outbox"] = {"id": "foo"}
+        self.bridge.stop()
+        assert lane.breaker.parked == []
+        assert self.bridge.outbox.release.call_args == asynctest.call([{"id": "foo"}])
+        lane.breaker._cancel_timer()
+
+    async def test_breaker_batch(self):
+        target = asynctest.MagicMock(target_id="target")
+        lane = asynctest.MagicMock(target=target)
+        lane.breaker = CircuitBreaker("test:foo", threshold=1, cooldown=10)
+        target.handle_posts = asynctest.CoroutineMock(return_value=[Exception("Test"), InvalidTargetResource()])
+        items = [{"target": target, "post": asynctest.MagicMock(id=post_id), "count": 0} for post_id in ["one", "two"]]
+        await self.bridge._process_lane_batch(lane, items)
+        assert lane.breaker.state == "closed"
+        target.handle_posts = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        await self.bridge._process_lane_batch(lane, items)
+        assert lane.breaker.state == "open"
+        assert len(lane.breaker.parked) == 2
+        await self.bridge._process_lane_batch(lane, items)
+        assert target.handle_posts.call_count == 1
+        assert len(lane.breaker.parked) == 4
+        lane.breaker._cancel_timer()
+
+    async def test_outbox(self):
+        self.bridge.outbox = asynctest.MagicMock()
+        self.bridge.outbox.record.return_value = {"id": "foo"}
+        self.bridge.outbox.put = asynctest.CoroutineMock(return_value=True)
+        self.bridge.outbox.remove = asynctest.CoroutineMock(return_value=True)
+        self.bridge.outbox.bury = asynctest.CoroutineMock(return_value=True)
+        self.bridge.config["targets"] = [{"type": "foo"}]
+        target = asynctest.MagicMock()
+        target.handle_post = asynctest.CoroutineMock(return_value=True)
+        self.bridge.add_target(target)
+        assert self.bridge._target_key(target) == get_hash({"type": "foo"})
+        assert self.bridge.outbox_key == get_hash(["liveblog", self.endpoint, self.source_id])
+
+        # item is persisted before enqueued
+        item = {"post": asynctest.MagicMock(id="one"), "target": target, "count": 0}
+        lane = self.bridge._get_lane(target)
+        lane.put = asynctest.MagicMock()
+        await self.bridge._put_to_queue(item)
+        assert self.bridge.outbox.record.call_args == asynctest.call(
+            self.bridge.outbox_key, get_hash({"type": "foo"}), item)
+        assert self.bridge.outbox.put.call_args == asynctest.call({"id": "foo"})
+        assert item["outbox"] == {"id": "foo"}
+        assert lane.put.call_count == 1
+
+        # removed when delivered
+        await self.bridge._process_lane_item(asynctest.MagicMock(), item)
+        assert self.bridge.outbox.remove.call_args == asynctest.call({"id": "foo"})
+
+        # count updated on retry
+        self.bridge.retries = asynctest.MagicMock()
+        target.handle_post.side_effect = Exception("Test")
+        await self.bridge._process_lane_item(asynctest.MagicMock(), item)
+        assert item["outbox"]["count"] == 1
+        assert self.bridge.outbox.put.call_count == 2
+
+        # dead letter after max retries
+        item["count"] = self.bridge.max_retries
+        await self.bridge._process_lane_item(asynctest.MagicMock(), item)
+        assert self.bridge.outbox.bury.call_args == asynctest.call(item["outbox"])
+        assert self.bridge.outbox.remove.call_count == 1
+        self.bridge.stop()
+
+    async def test_put_to_queue_coalesced(self):
+        target = asynctest.MagicMock(target_id="target")
+        self.bridge.outbox = asynctest.MagicMock()
+        self.bridge.outbox.remove = asynctest.CoroutineMock(return_value=True)
+        lane = self.bridge._get_lane(target)
+        lane.put = asynctest.MagicMock(return_value=[{"outbox": {"id": "old"}}, {}])
+        item = {"post": asynctest.MagicMock(id="one", is_deleted=True), "target": target, "count": 0,
+                "outbox": {"id": "new"}}
+        await self.bridge._put_to_queue(item)
+        assert self.bridge.outbox.remove.call_args == asynctest.call({"id": "old"})
+        assert metrics.get("delivery_coalesced_total", bridge=self.bridge.hash, kind="delete") == 2
+        metrics.clear()
+        self.bridge.stop()
+
+    async def test_replay(self):
+        self.bridge.config["targets"] = [{"type": "foo"}, {"type": "bar"}]
+        target = asynctest.MagicMock()
+        self.bridge.add_target(target)
+        self.bridge.outbox = asynctest.MagicMock()
+        records = [
+            {"id": "1", "target": get_hash({"type": "foo"}), "count": 2},
+            {"id": "2", "target": get_hash({"type": "baz"}), "count": 0},
+            {"id": "3", "target": get_hash({"type": "foo"}), "count": 0},
+        ]
+        self.bridge.outbox.pending = asynctest.CoroutineMock(return_value=records)
+        self.bridge.outbox.claim.side_effect = lambda r: r["id"] != "3"
+        post = asynctest.MagicMock(id="one")
+        self.bridge.outbox.restore.return_value = post
+        self.bridge._put_to_queue = asynctest.CoroutineMock()
+        assert await self.bridge.replay() == 1
+        assert self.bridge.outbox.pending.call_args == asynctest.call(self.bridge.outbox_key)
+        assert self.bridge._put_to_queue.call_args == asynctest.call(
+            {"post": post, "target": target, "count": 2, "outbox": records[0]})
+        # only once
+        assert await self.bridge.replay() == 0
+
+        # called before polling
+        self.bridge.replay = asynctest.CoroutineMock(return_value=0)
+        self.bridge.api_client.poll = asynctest.CoroutineMock(return_value=[])
+        await self.bridge.check_posts()
+        assert self.bridge.replay.call_count == 1
+
+    async def test_replay_disabled(self):
+        assert self.bridge.outbox is None
+        assert await self.bridge.replay() == 0
+
+    async def test_stop_release_outbox(self):
+        self.bridge.outbox = asynctest.MagicMock()
+        lane = asynctest.MagicMock()
+        lane.items = [{"outbox": {"id": "1"}}, {}]
+        lane.pending = {"one": [{"outbox": {"id": "2"}}], "two": []}
+        self.bridge.lanes["target"] = lane
+        assert self.bridge.stop() is True
+        assert self.bridge.outbox.release.call_args == asynctest.call([{"id": "1"}, {"id": "2"}])
 
     async def test_stop(self):
-        self.bridge.queue_task = asynctest.MagicMock()
-        self.bridge.queue_task.cancel = asynctest.CoroutineMock(return_value=None)
-        sleep_task = asynctest.MagicMock()
-        self.bridge.sleep_tasks.append(sleep_task)
+        lane = asynctest.MagicMock()
+        self.bridge.lanes["target"] = lane
+        item = {"target": asynctest.MagicMock(target_id="t"), "post": asynctest.MagicMock(id="one"), "count": 1}
+        self.bridge.retries.schedule(item, lane.retry, bridge=self.bridge, delay=10)
+        assert len(self.bridge.retries.pending(bridge=self.bridge)) == 1
         assert self.bridge.stop() is True
-        assert self.bridge.queue_task.cancel.call_count == 1
-
-    async def test_sleep_cancel(self):
-        self.loop.call_later(3, self.bridge.stop)
-        await self.bridge._sleep(10)
-
-    async def test_action_done_exception(self):
-        item_in = {
-            "target": asynctest.MagicMock(),
-            "post": asynctest.MagicMock(),
-            "count": 0
-        }
-        self.bridge.queue.task_done = asynctest.CoroutineMock(return_value=True)
-        future = asynctest.MagicMock(asyncio.Future)
-        future.exception = asynctest.Mock(return_value=None)
-        await self.bridge._action_done(future, item_in)
-        assert self.bridge.queue.task_done.call_count == 1
-        assert future.exception.call_count == 1
-
-    async def test_action_done_exception_invalid_target(self):
-        item_in = {
-            "target": asynctest.MagicMock(),
-            "post": asynctest.MagicMock(),
-            "count": 0
-        }
-        self.bridge.queue.task_done = asynctest.CoroutineMock(return_value=True)
-        future = asynctest.MagicMock(asyncio.Future)
-        future.exception = asynctest.Mock(return_value=InvalidTargetResource("Test"))
-        await self.bridge._action_done(future, item_in)
-        assert self.bridge.queue.task_done.call_count == 1
-        assert future.exception.call_count == 1
-
-    async def test_action_done(self):
-        item_in = {
-            "target": asynctest.MagicMock(),
-            "post": asynctest.MagicMock(),
-            "count": 0
-        }
-        future = asyncio.Future()
-        self.bridge.queue.task_done = asynctest.CoroutineMock(return_value=True)
-        self.bridge._put_to_queue = asynctest.CoroutineMock(return_value=True)
-        future.exception = asynctest.CoroutineMock(return_value=Exception("TestException"))
-        await self.bridge._action_done(future, item_in)
-        assert item_in["count"] == 1
-        assert self.bridge._put_to_queue.call_count == 1
-        assert self.bridge._put_to_queue.call_args == asynctest.call(item_in)
-        assert self.bridge.queue.task_done.call_count == 1
-
-    async def test_action_done_max_retries(self):
-        item_in = {
-            "target": asynctest.MagicMock(),
-            "post": asynctest.MagicMock(),
-            "count": 10
-        }
-        future = asyncio.Future()
-        self.bridge.queue.task_done = asynctest.CoroutineMock(return_value=True)
-        self.bridge._sleep = asynctest.CoroutineMock(return_value=True)
-        self.bridge._put_to_queue = asynctest.CoroutineMock(return_value=True)
-        future.exception = asynctest.CoroutineMock(return_value=Exception("TestException"))
-        await self.bridge._action_done(future, item_in)
-        assert item_in["count"] == 10
-        assert self.bridge._put_to_queue.call_count == 0
-        assert self.bridge._sleep.call_count == 0
-        assert self.bridge.queue.task_done.call_count == 1
-
-    async def test_process_action(self):
-        task = {
-            "target": asynctest.MagicMock(),
-            "post": asynctest.MagicMock(),
-            "count": 0
-        }
-        task["target"].handle_post = asynctest.CoroutineMock(return_value=True)
-        self.bridge._action_done = asynctest.CoroutineMock(return_value=True)
-        await self.bridge._process_action(task)
-        assert task["target"].handle_post.call_count == 1
-        assert task["target"].handle_post.call_args == asynctest.call(task["post"])
-
-    async def test_queue_consumer(self):
-        task = {
-            "target": asynctest.MagicMock(),
-            "post": asynctest.CoroutineMock(return_value=True),
-            "count": 0
-        }
-        self.bridge.queue.get = asynctest.CoroutineMock(side_effect=[task, Exception("Test")])
-        self.bridge.queue.task_done = asynctest.CoroutineMock(return_value=True)
-        self.bridge._process_action = asynctest.CoroutineMock(return_value=None)
-        await self.bridge._queue_consumer()
-        self.bridge.queue.get.call_count == 2
-        self.bridge._process_action.call_count == 1
-        self.bridge.queue.task_done.call_count == 1
-
-    async def test_queue_consumer_aborting(self):
-        item = {
-            "target": asynctest.MagicMock(),
-            "post": asynctest.MagicMock(),
-            "count": 11
-        }
-        self.bridge.queue.get = asynctest.CoroutineMock(side_effect=[item, asyncio.CancelledError()])
-        self.bridge._process_action = asynctest.CoroutineMock(return_value=None)
-        self.bridge.queue.task_done = asynctest.CoroutineMock()
-        await self.bridge._queue_consumer()
-        self.bridge._process_action.call_count == 1
-        self.bridge.queue.get.call_count == 2
-        self.bridge.queue.task_done.call_count == 1
+        assert lane.stop.call_count == 1
+        assert self.bridge.retries.pending(bridge=self.bridge) == []
 
     async def test_check_posts(self):
         self.bridge.new_posts = asynctest.CoroutineMock(return_value=None)
@@ -185,8 +579,9 @@ class LiveBridgeTest(asynctest.TestCase):
         self.bridge._put_to_queue = asynctest.CoroutineMock(return_value=True)
         res = await self.bridge.check_posts()
         assert res is True
+        assert self.bridge.last_poll_count == 2
         assert self.bridge.api_client.poll.call_count == 1
-        self.bridge.new_posts.assert_called_once_with(["one", "two"])
+        self.bridge.new_posts.assert_called_once_with(["one", "two"], wait=False)
 
     async def test_check_posts_empty(self):
         self.bridge.source.get = asynctest.CoroutineMock(side_effect=Exception)
@@ -195,6 +590,19 @@ class LiveBridgeTest(asynctest.TestCase):
         res = await self.bridge.check_posts()
         assert res is True
 
+    async def test_check_posts_timeout(self):
+        async def poll():
+            await asyncio.sleep(1)
+
+        self.bridge.poll_timeout = 0.01
+        self.bridge.source.poll = poll
+        self.bridge.new_posts = asynctest.CoroutineMock()
+        assert await self.bridge.check_posts() is True
+        assert self.bridge.last_poll_count is None
+        assert self.bridge.new_posts.call_count == 0
+        assert metrics.get("poll_timeouts_total", source=self.bridge.source.type, bridge=self.bridge.hash) == 1
+        metrics.clear()
+
     async def test_check_posts_failing(self):
         self.bridge.source.poll = asynctest.CoroutineMock(side_effect=Exception)
         assert self.bridge.source.last_updated is None
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asynctest
+import os
+import time
+from livebridge import config
+from livebridge.cluster import HashRing, ClusterMixin, ClusterController, ClusterSupervisor
+from livebridge.components import get_hash, get_source_key
+from livebridge.controller import Controller
+from livebridge.metrics import metrics
+from livebridge.storages import SQLStorage
+
+
+class BaseNode(object):
+    """Stands in for the controller, records running bridges."""
+
+    def __init__(self):
+        self.shutdown = False
+        self.running = {}
+        self.removed = []
+
+    async def add_bridges(self, bridge_configs):
+        for bridge_config in bridge_configs:
+            self.running[get_hash(bridge_config)] = bridge_config
+
+    async def remove_bridges(self, bridge_configs):
+        for bridge_config in bridge_configs:
+            del self.running[get_hash(bridge_config)]
+            self.removed.append(bridge_config)
+
+    async def update_bridges(self, changes):
+        for change in changes:
+            del self.running[get_hash(change["old"])]
+            self.running[get_hash(change["new"])] = change["new"]
+
+    async def run(self):
+        return True
+
+    async def clean_shutdown(self):
+        self.shutdown = True
+        self.running = {}
+
+
+class Node(ClusterMixin, BaseNode):
+    pass
+
+
+class HashRingTest(asynctest.TestCase):
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_node_for(self):
+        assert HashRing([]).node_for("foo") is None
+        ring = HashRing(["a", "b", "c"])
+        keys = [get_hash(x) for x in range(300)]
+        nodes = [ring.node_for(key) for key in keys]
+        assert nodes == [HashRing(["c", "b", "a"]).node_for(key) for key in keys]
+        for node in ["a", "b", "c"]:
+            assert 50 < nodes.count(node) < 150
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_minimal_movement(self):
+        keys = [get_hash(x) for x in range(300)]
+        before = HashRing(["a", "b", "c"])
+        after = HashRing(["a", "b", "c", "d"])
+        moved = [key for key in keys if before.node_for(key) != after.node_for(key)]
+        # only keys moving to the new node
+        assert all(after.node_for(key) == "d" for key in moved)
+        assert len(moved) < 150
+
+
+class ClusterTest(asynctest.TestCase):
+
+    async def setUp(self):
+        self.db = SQLStorage(dsn="sqlite:///tests/tests_cluster.db", table_name="test_table",
+                             lease_table_name="test_leases")
+        self.db._engine = None
+        await self.db.setup()
+        self.bridges = [{"source_id": x, "targets": []} for x in range(20)]
+
+    async def tearDown(self):
+        self.db._engine = None
+        self.db.lease_table_name = None
+        metrics.clear()
+        if os.path.exists("./tests/tests_cluster.db"):
+            os.remove("./tests/tests_cluster.db")
+
+    def _node(self, node_id):
+        node = Node()
+        node.node_id = node_id
+        node.lease_db = self.db
+        return node
+
+    async def test_share_bridges(self):
+        one = self._node("one")
+        await one.add_bridges(self.bridges)
+        assert len(one.running) == 20
+        assert one.members == ["one"]
+        two = self._node("two")
+        await two.add_bridges(self.bridges)
+        # bridges of node one are still leased
+        assert two.members == ["one", "two"]
+        assert len(two.running) == 0
+        # node one hands off bridges of node two
+        await one.rebalance()
+        await two.rebalance()
+        assert 0 < len(one.running) < 20
+        assert len(one.running) + len(two.running) == 20
+        assert set(one.running).isdisjoint(two.running)
+        assert metrics.get("cluster_nodes") == 2
+        assert metrics.get("cluster_bridges", node="two") == len(two.running)
+        # removed bridge
+        await one.remove_bridges(self.bridges[:10])
+        await two.remove_bridges(self.bridges[:10])
+        assert len(one.running) + len(two.running) == 10
+        assert len(await self.db.get_leases(prefix="source:")) == 10
+        # leaving node releases its leases
+        await two.clean_shutdown()
+        assert [lease["owner"] for lease in await self.db.get_leases()] == ["one"] * (len(one.owned) + 1)
+        await one.rebalance()
+        assert len(one.running) == 10
+
+    async def test_update_bridges(self):
+        one = self._node("one")
+        await one.add_bridges(self.bridges)
+        changed = [dict(b, targets=[{"type": "foo"}]) for b in self.bridges[:5]]
+        await one.update_bridges([{"old": o, "new": n} for o, n in zip(self.bridges, changed)])
+        assert len(one.running) == 20
+        assert all(get_hash(b) in one.running for b in changed)
+        assert not any(get_hash(b) in one.owned for b in self.bridges[:5])
+        # patched in place
+        assert one.removed == []
+
+    async def test_update_bridges_keeps_lease(self):
+        one, two = self._node("one"), self._node("two")
+        await one.add_bridges(self.bridges)
+        await two.add_bridges(self.bridges)
+        await one.rebalance()
+        await two.rebalance()
+        one.removed = []
+        leases = await self.db.get_leases(prefix="source:")
+        expires = dict(one.expires)
+        old = [b for b in self.bridges if get_hash(b) in one.owned][0]
+        other = [b for b in self.bridges if get_hash(b) in two.owned][0]
+        changes = [{"old": b, "new": dict(b, targets=[{"type": "foo", "rate_limit": 5}])} for b in [old, other]]
+        await one.update_bridges(changes)
+        # bridge keeps running with its lease
+        assert one.removed == []
+        assert get_hash(changes[0]["new"]) in one.running
+        assert get_hash(old) not in one.running
+        assert get_hash(changes[1]["new"]) not in one.running
+        assert one.expires == expires
+        assert await self.db.get_leases(prefix="source:") == leases
+        # bridges of other nodes are only tracked as candidates
+        assert get_hash(changes[1]["new"]) in one.candidates
+        await one.rebalance()
+        assert one.removed == []
+        assert len(one.running) == len(one.owned)
+
+    async def test_takeover(self):
+        one = self._node("one")
+        one.lease_ttl = 0.2
+        await one.add_bridges(self.bridges)
+        two = self._node("two")
+        await two.add_bridges(self.bridges)
+        assert len(two.running) == 0
+        # node one dies, its leases expire
+        time.sleep(0.25)
+        await two.rebalance()
+        assert two.members == ["two"]
+        assert len(two.running) == 20
+
+    async def test_lost_lease(self):
+        one = self._node("one")
+        await one.add_bridges(self.bridges[:1])
+        bridge_hash, source_key = get_hash(self.bridges[0]), get_source_key(self.bridges[0])
+        assert bridge_hash in one.running
+        await self.db.release_lease("source:" + source_key, "one")
+        assert await self.db.acquire_lease("source:" + source_key, "other", time.time() + 30, time.time())
+        # stopped, when the lease can expire before next renewal
+        await one.rebalance()
+        assert bridge_hash in one.running
+        one.expires[source_key] = time.time() + 1
+        await one.rebalance()
+        assert bridge_hash not in one.running
+        assert one.expires == {}
+
+    async def test_source_lease(self):
+        one = self._node("one")
+        bridges = [{"source_id": 1, "targets": [{"type": x}]} for x in ["a", "b", "c"]]
+        await one.add_bridges(bridges)
+        assert len(one.running) == 3
+        # one lease for all bridges of the source
+        assert [lease["name"] for lease in await self.db.get_leases(prefix="source:")] == \
+            ["source:" + get_source_key(bridges[0])]
+        await one.remove_bridges(bridges[:2])
+        assert len(one.running) == 1
+        assert len(await self.db.get_leases(prefix="source:")) == 1
+        await one.remove_bridges(bridges[2:])
+        assert await self.db.get_leases(prefix="source:") == []
+
+    async def test_bounded_renewal(self):
+        one = self._node("one")
+        one.lease_concurrency = 3
+        running, peak = 0, 0
+        acquire = self.db.acquire_lease
+
+        async def slow_acquire(*args):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asynctest.asyncio.sleep(0.01)
+            running -= 1
+            return await acquire(*args)
+        one.lease_db = asynctest.MagicMock(wraps=self.db)
+        one.lease_db.acquire_lease = slow_acquire
+        one.lease_db.get_leases = asynctest.CoroutineMock(return_value=[])
+        await one.add_bridges(self.bridges)
+        assert len(one.running) == 20
+        assert peak == 3
+        # node leases are queried by prefix
+        one.lease_db.get_leases.assert_called_with(prefix="node:")
+        assert metrics.histograms[("cluster_rebalance_seconds", ())]["count"] == 1
+
+    async def test_node_lease_failing(self):
+        one = self._node("one")
+        await one.add_bridges(self.bridges)
+        one.lease_db = asynctest.MagicMock()
+        one.lease_db.acquire_lease = asynctest.CoroutineMock(return_value=False)
+        one.lease_db.get_leases = asynctest.CoroutineMock(return_value=[])
+        one.lease_db.release_lease = asynctest.CoroutineMock(return_value=False)
+        await one.rebalance()
+        assert one.members == []
+        assert one.running == {}
+
+    async def test_run(self):
+        one = self._node("one")
+        one.lease_ttl = 0.03
+        one.rebalance = asynctest.CoroutineMock(side_effect=[Exception("Test"), None, None, None])
+        assert await one.run() is True
+        await asynctest.asyncio.sleep(0.05)
+        assert one.rebalance.call_count >= 2
+        await one.clean_shutdown()
+        calls = one.rebalance.call_count
+        await asynctest.asyncio.sleep(0.05)
+        assert one.rebalance.call_count == calls
+
+    async def test_controllers(self):
+        assert issubclass(ClusterController, Controller)
+        node = ClusterSupervisor(config, None, workers=2)
+        assert node.workers == 2
+        assert node.node_id
+        assert node.lease_ttl == config.CLUSTER_LEASE_TTL
@@ -210,6 +210,39 @@ class ControlDataTests(asynctest.TestCase):
         assert len(self.control.removed_bridges) == 1
         assert self.control.removed_bridges == self.control.list_removed_bridges()
 
+    async def test_load_detect_changed_targets(self):
+        source = {"type": "liveblog", "source_id": "one", "endpoint": "http://foo"}
+        target_a = {"type": "acme", "channel": "a"}
+        target_b = {"type": "acme", "channel": "b"}
+        target_c = {"type": "acme", "channel": "c"}
+        old = dict(source, targets=[target_a, target_b])
+        other = {"type": "liveblog", "source_id": "two", "targets": [target_a]}
+        self.control._set_client = asynctest.CoroutineMock()
+        self.control.load_control_doc = asynctest.CoroutineMock(
+            return_value={"auth": {}, "bridges": [old, other]})
+        await self.control.load("/tmp/foo")
+        assert len(self.control.list_new_bridges()) == 2
+        assert self.control.list_changed_bridges() == []
+
+        new = dict(source, targets=[target_b, target_c])
+        self.control.load_control_doc = asynctest.CoroutineMock(
+            return_value={"auth": {}, "bridges": [new, dict(other, source_id="three")]})
+        await self.control.load("/tmp/foo")
+        assert self.control.list_changed_bridges() == [
+            {"old": old, "new": new, "changed": [], "added": [target_c], "removed": [target_a]}]
+        # source changes replace the bridge
+        assert self.control.list_new_bridges() == [dict(other, source_id="three")]
+        assert self.control.list_removed_bridges() == [other]
+
+        # changed settings of a target are no new target
+        changed = dict(target_b, auth={"user": "foo"}, rate_limit=2)
+        newer = dict(source, targets=[changed, target_c])
+        self.control.load_control_doc = asynctest.CoroutineMock(
+            return_value={"auth": {}, "bridges": [newer, dict(other, source_id="three")]})
+        await self.control.load("/tmp/foo")
+        assert self.control.list_changed_bridges() == [
+            {"old": new, "new": newer, "changed": [{"old": target_b, "new": changed}], "added": [], "removed": []}]
+
     async def test_load_control_doc_sorted(self):
         sorted_doc = {
             "auth":{},
@@ -244,6 +277,7 @@ class ControlDataTests(asynctest.TestCase):
     def test_remove_inactives(self):
         doc1 = {
             "auth":{"foo":{"user":"foo", "pwd": "baz"}},
+            "limits": {"scribble": {"concurrency": 2}},
             "bridges": [
                 {"label": "One", "active": False},
                 {"label": "Two", "active": True},
@@ -252,10 +286,15 @@ class ControlDataTests(asynctest.TestCase):
         res = self.control._remove_inactives(doc1)
         assert res == {
             "auth":{"foo":{"user":"foo", "pwd": "baz"}},
+            "limits": {"scribble": {"concurrency": 2}},
             "bridges": [
                 {"label": "Two", "active": True},
                 {"label": "Three"},
             ]}
+        # limits are kept
+        assert self.control._remove_doubles(res)["limits"] == {"scribble": {"concurrency": 2}}
+        self.control.control_data = res
+        assert self.control.list_limits() == {"scribble": {"concurrency": 2}}
 
     @asynctest.fail_on(unused_loop=False)
     def test_list_new_bridges(self):
@@ -267,6 +306,11 @@ class ControlDataTests(asynctest.TestCase):
         self.control.removed_bridges = ["foo", "baz"]
         assert self.control.list_removed_bridges() == ["foo", "baz"]
 
+    @asynctest.fail_on(unused_loop=False)
+    def test_list_changed_bridges(self):
+        self.control.changed_bridges = [{"old": "foo", "new": "bar"}]
+        assert self.control.list_changed_bridges() == [{"old": "foo", "new": "bar"}]
+
     async def test_auto_update(self):
         self.control.control_client = ControlFile()
         assert self.control.control_client.auto_update is True
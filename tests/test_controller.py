@@ -21,6 +21,9 @@ from livebridge.controller import Controller
 from livebridge.controldata import ControlData
 from livebridge.bridge import LiveBridge
 from livebridge.components import SOURCE_MAP, get_hash
+from livebridge.lastupdated import clear_last_updated, get_last_updated_index
+from livebridge.metrics import metrics
+from livebridge.polling import get_poll_scheduler
 from livebridge import config
 
 
@@ -44,6 +47,7 @@ class ControllerTests(asynctest.TestCase):
         bridge.check_posts = asynctest.CoroutineMock()
         bridge.source = asynctest.MagicMock()
         bridge.source.stop = asynctest.CoroutineMock()
+        bridge.drain = asynctest.CoroutineMock(return_value=True)
         return bridge
 
     @asynctest.fail_on(unused_loop=False)
@@ -84,10 +88,14 @@ class ControllerTests(asynctest.TestCase):
 
     async def test_run(self):
         self.controller.remove_old_bridges = asynctest.CoroutineMock(return_value=True)
+        self.controller.update_changed_bridges = asynctest.CoroutineMock(return_value=True)
         self.controller.add_new_bridges = asynctest.CoroutineMock(return_value=True)
+        self.controller.set_limits = MagicMock()
         assert self.controller.control_data is None
         await self.controller.run()
+        self.controller.set_limits.assert_called_once_with(self.controller.control_data.list_limits())
         assert self.controller.remove_old_bridges.call_count == 1
+        assert self.controller.update_changed_bridges.call_count == 1
         assert self.controller.add_new_bridges.call_count == 1
 
     async def test_run_with_watcher(self):
@@ -207,6 +215,18 @@ class ControllerTests(asynctest.TestCase):
         assert self.controller.shutdown is True
         assert len(self.controller.bridges) == 0
         assert self.controller.close_control_data.call_count == 1
+        assert bridge1.drain.call_count == 1
+        assert bridge2.drain.call_count == 1
+
+    async def test_clean_shutdown_timeout(self):
+        bridge = self._get_mock_bridge()
+        self.controller.bridges = {bridge: None}
+        self.controller.close_control_data = asynctest.CoroutineMock(return_value=True)
+        self.controller.drain_timeout = 0.05
+        await self.controller.clean_shutdown()
+        # runner did not end, shutdown goes on after the deadline
+        assert len(self.controller.bridges) == 1
+        assert bridge.drain.call_count == 1
 
     async def test_add_new_bridge(self):
         bridge = asynctest.MagicMock()
@@ -219,13 +239,30 @@ class ControllerTests(asynctest.TestCase):
         assert self.controller.append_bridge.call_count == 2
         assert self.controller.append_bridge.call_args_list == [call({"foo": "baz"}), call({"bar": "baz"})]
 
+    async def test_load_last_updated(self):
+        db_client = asynctest.MagicMock()
+        db_client.get_last_updated_sources = asynctest.CoroutineMock(return_value={"one": "tstamp"})
+        with asynctest.patch("livebridge.controller.get_db_client", return_value=db_client):
+            await self.controller.load_last_updated([{"source_id": "one"}, {"source_id": "two"}, {"foo": "baz"}])
+            assert sorted(db_client.get_last_updated_sources.call_args[0][0]) == ["one", "two"]
+            assert get_last_updated_index().get("one") == "tstamp"
+            assert get_last_updated_index().fresh("two") is True
+
+            # no sources, no query
+            await self.controller.load_last_updated([{"foo": "baz"}])
+            assert db_client.get_last_updated_sources.call_count == 1
+        clear_last_updated()
+
     async def test_remove_old_bridges(self):
         bridge1 = asynctest.MagicMock(hash=get_hash({"foo": "baz"}))
         bridge2 = asynctest.MagicMock(hash=get_hash({"bar": "baz"}))
+        bridge1.drain = asynctest.CoroutineMock(return_value=True)
+        bridge2.drain = asynctest.CoroutineMock(return_value=False)
         self.controller.bridges = {
             bridge1: asynctest.CoroutineMock(return_value=True),
             bridge2: asynctest.CoroutineMock(return_value=True)
         }
+        self.controller.drain_timeout = 3
         self.controller.control_data = asynctest.MagicMock()
         self.controller.control_data.list_removed_bridges = MagicMock(return_value=[{"foo": "baz"}, {"bar": "baz"}])
         self.controller.remove_bridge = asynctest.CoroutineMock(return_value=True)
@@ -233,25 +270,104 @@ class ControllerTests(asynctest.TestCase):
         assert self.controller.remove_bridge.call_count == 2
         assert self.controller.bridges[bridge1].close.call_count == 1
         assert self.controller.bridges[bridge2].close.call_count == 1
-        assert bridge1.stop.call_count == 1
-        assert bridge2.stop.call_count == 1
+        bridge1.drain.assert_called_once_with(3)
+        bridge2.drain.assert_called_once_with(3)
+
+    async def test_update_bridges(self):
+        old = {"type": "test", "source_id": 1, "targets": [{"type": "a"}, {"type": "b"}]}
+        new = {"type": "test", "source_id": 1, "targets": [{"type": "b"}, {"type": "c"}]}
+        bridge = asynctest.MagicMock(hash=get_hash(old))
+        target_a, target_b, target_c = MagicMock(), MagicMock(), MagicMock()
+        bridge.targets = [target_a, target_b]
+        self.controller.bridges = {bridge: asynctest.CoroutineMock()}
+        self.controller.control_data = asynctest.MagicMock()
+        self.controller.control_data.list_changed_bridges = MagicMock(return_value=[
+            {"old": old, "new": new, "added": [{"type": "c"}], "removed": [{"type": "a"}]}])
+        self.controller.add_bridges = asynctest.CoroutineMock()
+        with asynctest.patch("livebridge.controller.get_target", return_value=target_c) as patched:
+            await self.controller.update_changed_bridges()
+            patched.assert_called_once_with({"type": "c"})
+        bridge.reconfigure.assert_called_once_with(new, [target_b, target_c], replaced={})
+        assert self.controller.add_bridges.call_count == 0
+
+        # not running, gets added
+        bridge.hash = "foo"
+        await self.controller.update_changed_bridges()
+        self.controller.add_bridges.assert_called_once_with([new])
+
+        # changed target gets a new client replacing the old one
+        changed = {"type": "test", "source_id": 1, "targets": [{"type": "a", "auth": "x"}, {"type": "b"}]}
+        self.controller.control_data.list_changed_bridges = MagicMock(return_value=[
+            {"old": old, "new": changed, "changed": [{"old": {"type": "a"}, "new": {"type": "a", "auth": "x"}}],
+             "added": [], "removed": []}])
+        bridge.hash = get_hash(old)
+        bridge.reconfigure.reset_mock()
+        with asynctest.patch("livebridge.controller.get_target", return_value=target_c) as patched:
+            await self.controller.update_changed_bridges()
+            patched.assert_called_once_with({"type": "a", "auth": "x"})
+        bridge.reconfigure.assert_called_once_with(changed, [target_c, target_b], replaced={target_a: target_c})
 
     async def test_run_poller(self):
-        # mock coroutine, will set shutdown flag when called
-        async def mock_routine():
-            self.controller.shutdown = True
-
-        self.controller.sleep = asynctest.CoroutineMock(return_value=True)
+        scheduler = get_poll_scheduler()
+        scheduler.jitter = 0
 
         # mock bridge
         bridge1 = self._get_mock_bridge()
-        bridge1.check_posts = mock_routine
-
+        bridge1.saturated = False
         self.controller.bridges = {bridge1: bridge1}
 
-        # run and stop bridge1
-        await self.controller.run_poller(bridge=bridge1, interval=2)
-        assert self.controller.sleep.call_count == 1
+        # run bridge1 until first poll, then stop it
+        self.controller.sleep = asynctest.CoroutineMock()
+        task = asyncio.ensure_future(self.controller.run_poller(bridge=bridge1, interval=2))
+        while not bridge1.check_posts.call_count:
+            await asyncio.sleep(0.01)
+        # the bridge doesn't wake up while waiting for shutdown
+        assert self.controller.sleep.call_count == 0
+        assert task.done() is False
+        self.controller.shutdown = True
+        await task
+        assert bridge1.check_posts.call_count == 1
+        assert scheduler.entries == {}
+        assert self.controller.bridges == {}
+        scheduler.stop()
+
+    async def test_wait_shutdown(self):
+        waiter = asyncio.ensure_future(self.controller.wait_shutdown())
+        await asyncio.sleep(0.01)
+        assert waiter.done() is False
+        self.controller.shutdown = True
+        await asyncio.wait_for(waiter, 1)
+        # returns at once after shutdown
+        await asyncio.wait_for(self.controller.wait_shutdown(), 1)
+
+    async def test_poll(self):
+        bridge = self._get_mock_bridge()
+        bridge.saturated = False
+        bridge.last_poll_count = 3
+        assert await self.controller.poll(bridge) == 3
+        assert bridge.check_posts.call_count == 1
+
+    async def test_wake(self):
+        scheduler = get_poll_scheduler()
+        bridge = asynctest.MagicMock(hash="abc", source_id=123, hashes=["def"])
+        scheduler.add(bridge, 100, asynctest.CoroutineMock())
+        scheduler.wake = MagicMock()
+        assert self.controller.wake("123") == 1
+        assert self.controller.wake("abc") == 1
+        assert self.controller.wake("def") == 1
+        assert self.controller.wake("unknown") == 0
+        assert scheduler.wake.call_args_list == [call(bridge)] * 3
+        del scheduler.wake
+        scheduler.stop()
+
+    async def test_poll_saturated(self):
+        bridge = self._get_mock_bridge()
+        bridge.saturated = True
+        bridge.hash = "foo"
+        assert await self.controller.poll(bridge) is None
+        assert bridge.check_posts.call_count == 0
+        assert metrics.get("poll_skipped", reason="backpressure", bridge="foo") == 1
+        metrics.clear()
 
     async def test_run_poller_stopped(self):
         # mock bridges
@@ -276,7 +392,7 @@ class ControllerTests(asynctest.TestCase):
             await asyncio.sleep(2)
             self.controller.shutdown = True
 
-        async def mock_routine():
+        async def mock_routine(callback=None):
             asyncio.Task(stop())
 
         bridge = MagicMock()
@@ -329,6 +445,11 @@ class ControllerTests(asynctest.TestCase):
         for bridge in self.controller.bridges.keys():
             assert type(bridge) == LiveBridge
             assert bridge.source.mode == "polling"
+        assert self.controller.run_poller.call_args[1]["adaptive"] is None
+        config["poll_max_interval"] = 300
+        self.controller.append_bridge(config)
+        assert self.controller.run_poller.call_args[1]["adaptive"].maximum == 300
+        assert self.controller.run_poller.call_args[1]["adaptive"].minimum == 10
 
     async def test_remove_bridge(self):
         # mock bridges
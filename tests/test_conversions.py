@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import asynctest
+from livebridge.base import ConversionResult
+from livebridge.conversions import ConversionCache, get_conversion_cache
+from livebridge.metrics import metrics
+
+
+class ConversionCacheTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.cache = ConversionCache(ttl=0)
+        self.converter = asynctest.MagicMock()
+        self.converted = asyncio.Event()
+
+        async def convert(data):
+            await self.converted.wait()
+            return ConversionResult("converted {}".format(data["id"]), ["/tmp/image.jpg"])
+
+        self.converter.convert = asynctest.CoroutineMock(side_effect=convert)
+        self.converter.remove_images = asynctest.CoroutineMock()
+        self.post = asynctest.MagicMock(source="liveblog", data={"id": 1})
+
+    def tearDown(self):
+        metrics.clear()
+
+    async def test_single_flight(self):
+        first = asyncio.ensure_future(self.cache.acquire(self.converter, self.post, "scribble"))
+        second = asyncio.ensure_future(self.cache.acquire(self.converter, self.post, "scribble"))
+        other = asyncio.ensure_future(self.cache.acquire(self.converter, self.post, "slack"))
+        await asyncio.sleep(0)
+        self.converted.set()
+        one, two, three = await asyncio.gather(first, second, other)
+        assert one is two
+        assert one is not three
+        assert one.result.content == "converted 1"
+        assert one.refs == 2
+        assert self.converter.convert.call_count == 2
+        assert metrics.get("conversion_cache_total", result="hit") == 1
+        assert metrics.get("conversion_cache_total", result="miss") == 2
+
+        # images are removed after the last consumer
+        await self.cache.release(one)
+        assert self.converter.remove_images.call_count == 0
+        await self.cache.release(two)
+        self.converter.remove_images.assert_called_once_with(["/tmp/image.jpg"])
+        assert list(self.cache.entries) == [three.key]
+
+    async def test_ttl(self):
+        self.cache.ttl = 0.05
+        self.converted.set()
+        entry = await self.cache.acquire(self.converter, self.post, "scribble")
+        await self.cache.release(entry)
+        # reused by a target delivering later
+        assert await self.cache.acquire(self.converter, self.post, "scribble") is entry
+        assert entry.expiry is None
+        await self.cache.release(entry)
+        await asyncio.sleep(0.1)
+        assert self.cache.entries == {}
+        assert self.converter.remove_images.call_count == 1
+        assert self.converter.convert.call_count == 1
+
+        # changed post gets converted again
+        self.post.data = {"id": 2}
+        entry = await self.cache.acquire(self.converter, self.post, "scribble")
+        assert entry.result.content == "converted 2"
+        await self.cache.release(entry)
+        await self.cache.clear()
+        assert self.cache.entries == {}
+        assert self.converter.remove_images.call_count == 2
+
+    async def test_failing(self):
+        self.converter.convert = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        with self.assertRaises(Exception):
+            await self.cache.acquire(self.converter, self.post, "scribble")
+        await asyncio.sleep(0)
+        assert self.cache.entries == {}
+        # failed conversions are not cached
+        with self.assertRaises(Exception):
+            await self.cache.acquire(self.converter, self.post, "scribble")
+        assert self.converter.convert.call_count == 2
+        assert self.converter.remove_images.call_count == 0
+
+    async def test_cancelled_consumer(self):
+        first = asyncio.ensure_future(self.cache.acquire(self.converter, self.post, "scribble"))
+        second = asyncio.ensure_future(self.cache.acquire(self.converter, self.post, "scribble"))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        self.converted.set()
+        entry = await second
+        await asyncio.sleep(0)
+        assert entry.refs == 1
+        await self.cache.release(entry)
+        assert self.converter.remove_images.call_count == 1
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_get_conversion_cache(self):
+        assert get_conversion_cache() is get_conversion_cache()
+        assert get_conversion_cache().collect in metrics.collectors
+        assert list(self.cache.collect()) == [("conversions_cached", {}, 0)]
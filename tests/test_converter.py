@@ -17,6 +17,9 @@ import asynctest
 import os.path
 from livebridge.components import get_converter, add_converter
 from livebridge.base import BaseConverter
+from livebridge.downloads import get_downloader
+from livebridge.images import get_image_cache
+from tests import fetch
 
 
 class MockConverter(BaseConverter):
@@ -30,12 +33,17 @@ class ConverterTest(asynctest.TestCase):
         self.converter = MockConverter()
         add_converter(MockConverter)
 
+    async def tearDown(self):
+        await get_downloader().close()
+
     @asynctest.fail_on(unused_loop=False)
     def test_get_converter(self):
         converter = get_converter("foo", "baz")
         assert type(converter) == MockConverter
         assert converter.source == "foo"
         assert converter.target == "baz"
+        # targets share one instance
+        assert get_converter("foo", "baz") is converter
 
         assert get_converter("foo", "foobaz") is None
 
@@ -54,10 +62,14 @@ class ConverterTest(asynctest.TestCase):
             "mimetype": "image/jpeg",
         }
         filepath = await self.converter._download_image(pic_data)
-        assert filepath.startswith("/tmp/") is True
-        assert filepath.endswith("-{}.jpg".format(os.path.basename(pic_data["media"]))) is True
+        assert filepath.startswith(get_image_cache().path) is True
+        assert filepath.endswith(".jpg") is True
         assert os.path.exists(filepath) is True
-        await self.converter.remove_images([filepath])
+        # same image, same file
+        assert await self.converter._download_image(pic_data) == filepath
+        await self.converter.remove_images([filepath, filepath])
+        assert get_image_cache().files[os.path.basename(filepath)[:-4]].refs == 0
+        await get_image_cache().clear()
         assert os.path.exists(filepath) is False
 
     async def test_download_image_with_file_ext(self):
@@ -68,13 +80,34 @@ class ConverterTest(asynctest.TestCase):
             "mimetype": "image/jpeg",
         }
         filepath = await self.converter._download_image(pic_data)
-        assert filepath.startswith("/tmp/") is True
+        assert filepath.startswith(get_image_cache().path) is True
         assert filepath.endswith(".jpg.jpg") is False
-        assert filepath.endswith("-{}".format(os.path.basename(pic_data["media"]))) is True
+        assert filepath.endswith(".jpg") is True
         assert os.path.exists(filepath) is True
         await self.converter.remove_images([filepath])
+        await get_image_cache().clear()
         assert os.path.exists(filepath) is False
 
     async def test_remove_invalid_images(self):
         res = await self.converter.remove_images(["/non/path/file"])
         assert res is None
+
+    async def test_remove_own_images(self):
+        filepath = os.path.join(os.path.dirname(__file__), "files", "own-image.jpg")
+        open(filepath, "wb").close()
+        # files not from the image cache get deleted
+        await self.converter.remove_images([filepath])
+        assert os.path.exists(filepath) is False
+
+    async def test_download_image_cached(self):
+        pic_data = {"href": "http://example.com/image", "media": "image", "mimetype": "image/png"}
+        cache = get_image_cache()
+        with asynctest.patch.object(cache, "_fetch", fetch(cache.path, 200, {}, b"png")) as mocked:
+            filepath = await self.converter._download_image(pic_data)
+            assert filepath.endswith(".png") is True
+            assert await self.converter._download_image(pic_data) == filepath
+            assert mocked.call_count == 1
+        await self.converter.remove_images([filepath, filepath])
+        assert os.path.exists(filepath) is True
+        await cache.clear()
+        assert os.path.exists(filepath) is False
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import asynctest
+from livebridge.delivery import DeliveryLane, DeliveryScheduler, get_scheduler
+from livebridge.metrics import metrics
+
+
+class DeliveryLaneTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.processed = []
+        self.scheduler = DeliveryScheduler(workers=2)
+        self.target = asynctest.MagicMock(target_id="target")
+        self.lane = DeliveryLane("bridge", self.target, self.process, scheduler=self.scheduler)
+
+    def tearDown(self):
+        self.lane.stop()
+        self.scheduler.stop()
+
+    async def process(self, lane, item):
+        self.processed.append(item)
+        lane.done(item)
+
+    def _item(self, post_id, version=0):
+        return {"post": asynctest.MagicMock(id=post_id, version=version), "target": self.target, "count": 0}
+
+    async def test_put(self):
+        items = [self._item("one"), self._item("two"), self._item("three")]
+        for item in items:
+            self.lane.put(item)
+        assert len(self.lane) == 3
+        await self.lane.join()
+        assert self.processed == items
+        assert len(self.lane) == 0
+        assert self.lane.pending == {}
+
+    async def test_hold_back_busy_post(self):
+        async def process(lane, item):
+            self.processed.append((item["post"].id, item["post"].version))
+            await asyncio.sleep(0.05)
+            lane.done(item)
+
+        self.lane.process = process
+        first, second, other = self._item("one", 0), self._item("one", 1), self._item("two")
+        self.lane.put(first)
+        self.lane.put(other)
+        await asyncio.sleep(0.01)
+        # first one is in flight
+        assert self.lane.put(second) == []
+        assert self.lane.pending["one"] == [second]
+        await self.lane.join()
+        assert self.processed == [("one", 0), ("two", 0), ("one", 1)]
+        assert self.lane.pending == {}
+        assert self.lane.heads == {}
+
+    async def test_coalesce_queued(self):
+        self.lane.process = asynctest.CoroutineMock(side_effect=self.process)
+        first, second, third = self._item("one", 0), self._item("one", 1), self._item("one", 2)
+        assert self.lane.put(first) == []
+        superseded = self.lane.put(second)
+        assert [i["post"].version for i in superseded] == [0]
+        superseded = self.lane.put(third)
+        assert [i["post"].version for i in superseded] == [1]
+        assert len(self.lane) == 1
+        assert self.lane.coalesced == 2
+        await self.lane.join()
+        assert [i["post"].version for i in self.processed] == [2]
+
+    async def test_coalesce_held(self):
+        async def process(lane, item):
+            self.processed.append(item["post"].version)
+            await asyncio.sleep(0.05)
+            lane.done(item)
+
+        self.lane.process = process
+        self.lane.put(self._item("one", 0))
+        await asyncio.sleep(0.01)
+        assert self.lane.put(self._item("one", 1)) == []
+        superseded = self.lane.put(self._item("one", 2))
+        assert [i["post"].version for i in superseded] == [1]
+        await self.lane.join()
+        assert self.processed == [0, 2]
+
+    async def test_coalesce_retry(self):
+        async def process(lane, item):
+            self.processed.append((item["post"].version, item["count"]))
+            if item["post"].version == 0:
+                # simulate a retry of the first version
+                item["count"] = 1
+                asyncio.get_event_loop().call_later(0.1, lane.retry, item)
+                return
+            lane.done(item)
+
+        self.lane.process = process
+        self.lane.put(self._item("one", 0))
+        await asyncio.sleep(0.05)
+        # waiting for retry, gets replaced
+        superseded = self.lane.put(self._item("one", 1))
+        assert [(i["post"].version, i["count"]) for i in superseded] == [(0, 1)]
+        await asyncio.sleep(0.2)
+        assert self.processed == [(0, 0), (1, 0)]
+        assert self.lane.pending == {}
+
+    async def test_batch(self):
+        batches = []
+
+        async def process_batch(lane, items):
+            batches.append([i["post"].id for i in items])
+            for item in items:
+                lane.done(item)
+
+        lane = DeliveryLane("batch", self.target, self.process, scheduler=self.scheduler,
+                            process_batch=process_batch, batch_size=2)
+        for post_id in ["one", "two", "three"]:
+            lane.put(self._item(post_id))
+        await lane.join()
+        assert batches == [["one", "two"], ["three"]]
+        assert self.processed == []
+        lane.stop()
+
+        # no batches without process_batch
+        lane = DeliveryLane("batch", self.target, self.process, scheduler=self.scheduler, batch_size=2)
+        assert lane.batch_size == 1
+        lane.stop()
+
+    async def test_stop(self):
+        self.lane.put(self._item("one"))
+        self.lane.stop()
+        assert len(self.lane.items) == 0
+        assert "bridge" not in self.scheduler.lanes
+        self.lane.put(self._item("two"))
+        assert len(self.lane.items) == 0
+        await self.lane.join()
+        assert self.processed == []
+
+
+class DeliverySchedulerTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.scheduler = DeliveryScheduler(workers=2)
+        self.processed = []
+        self.running = 0
+        self.max_running = 0
+
+    def tearDown(self):
+        self.scheduler.stop()
+        metrics.clear()
+
+    async def process(self, lane, item):
+        self.running += 1
+        self.max_running = max(self.running, self.max_running)
+        await asyncio.sleep(0.01)
+        self.processed.append((lane.bridge, item["post"].id))
+        self.running -= 1
+        lane.done(item)
+
+    def _lane(self, bridge, target="target"):
+        return DeliveryLane(bridge, target, self.process, scheduler=self.scheduler)
+
+    def _item(self, post_id):
+        return {"post": asynctest.MagicMock(id=post_id), "target": "target", "count": 0}
+
+    async def test_worker_limit(self):
+        lanes = [self._lane("bridge-{}".format(x)) for x in range(5)]
+        for lane in lanes:
+            lane.put(self._item("one"))
+        assert len(self.scheduler.tasks) == 0 or len(self.scheduler.tasks) == 2
+        await asyncio.gather(*[lane.join() for lane in lanes])
+        assert len(self.processed) == 5
+        assert self.max_running == 2
+        assert len(self.scheduler.tasks) == 2
+
+    async def test_fairness(self):
+        busy = self._lane("busy")
+        quiet = self._lane("quiet")
+        for x in range(10):
+            busy.put(self._item("busy-{}".format(x)))
+        quiet.put(self._item("quiet-0"))
+        quiet.put(self._item("quiet-1"))
+        await asyncio.gather(busy.join(), quiet.join())
+        # quiet bridge does not wait for the backlog of the busy one
+        order = [p[1] for p in self.processed]
+        assert order.index("quiet-1") < 5
+        assert [p for p in order if p.startswith("busy")] == ["busy-{}".format(x) for x in range(10)]
+
+    async def test_one_item_per_lane(self):
+        lane = self._lane("bridge")
+        for x in range(4):
+            lane.put(self._item(str(x)))
+        await lane.join()
+        assert self.max_running == 1
+        assert [p[1] for p in self.processed] == ["0", "1", "2", "3"]
+
+    async def test_process_failing(self):
+        async def process(lane, item):
+            raise Exception("Test")
+
+        lane = DeliveryLane("bridge", "target", process, scheduler=self.scheduler)
+        lane.put(self._item("one"))
+        await lane.join()
+        assert self.scheduler.busy == 0
+        assert lane.active is False
+
+    async def test_stats(self):
+        async def process(lane, item):
+            await asyncio.sleep(10)
+
+        lane = DeliveryLane("bridge", "target", process, scheduler=self.scheduler)
+        lane.put(self._item("one"))
+        lane.put(self._item("two"))
+        lane.put(self._item("three"))
+        await asyncio.sleep(0.05)
+        stats = self.scheduler.stats()
+        assert stats == {"workers": 2, "busy": 1, "queued": 2, "bridges": {"bridge": 3}}
+        gauges = metrics.snapshot()["gauges"]
+        assert {"labels": {"bridge": "bridge", "label": "-"}, "value": 3} in gauges["delivery_queue_depth"]
+        assert list(self.scheduler.collect())[1] == ("delivery_workers_busy", {}, 1)
+
+    async def test_get_scheduler(self):
+        scheduler = get_scheduler()
+        assert isinstance(scheduler, DeliveryScheduler)
+        assert get_scheduler() is scheduler
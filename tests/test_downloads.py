@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from aiohttp import web
+from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
+from livebridge.downloads import Downloader, DownloadError, get_downloader
+from livebridge.metrics import metrics
+
+
+class DownloaderTest(AioHTTPTestCase):
+
+    async def get_application(self):
+        self.running = self.max_running = 0
+        app = web.Application()
+        app.router.add_get("/image", self.image)
+        app.router.add_get("/large", self.large)
+        app.router.add_get("/slow", self.slow)
+        app.router.add_get("/cached", self.cached)
+        return app
+
+    async def image(self, request):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.02)
+        self.running -= 1
+        return web.Response(body=b"x" * 100000, headers={"ETag": "v1"})
+
+    async def large(self, request):
+        # streamed without Content-Length
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        for _ in range(10):
+            await resp.write(b"x" * 1000)
+        return resp
+
+    async def slow(self, request):
+        await asyncio.sleep(1)
+        return web.Response(body=b"x")
+
+    async def cached(self, request):
+        return web.Response(status=304)
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        metrics.clear()
+        super().tearDown()
+
+    @unittest_run_loop
+    async def test_download(self):
+        downloader = Downloader(concurrency=2, timeout=5, max_size=200000)
+        download = await downloader.download(self.server.make_url("/image"), self.tmpdir)
+        assert download.status == 200
+        assert download.headers["ETag"] == "v1"
+        assert download.size == 100000
+        assert download.digest == hashlib.sha256(b"x" * 100000).hexdigest()
+        assert os.path.dirname(download.path) == self.tmpdir
+        with open(download.path, "rb") as file:
+            assert file.read() == b"x" * 100000
+        assert metrics.get("image_download_bytes_total") == 100000
+        # connections are pooled by one session
+        session = downloader.session
+        await downloader.download(self.server.make_url("/image"), self.tmpdir)
+        assert downloader.session is session
+        await downloader.close()
+        assert session.closed is True
+
+    @unittest_run_loop
+    async def test_concurrency(self):
+        downloader = Downloader(concurrency=2, timeout=5, max_size=200000)
+        downloads = await asyncio.gather(
+            *[downloader.download(self.server.make_url("/image"), self.tmpdir) for _ in range(5)])
+        assert len(set(d.path for d in downloads)) == 5
+        assert self.max_running == 2
+        await downloader.close()
+
+    @unittest_run_loop
+    async def test_max_size(self):
+        downloader = Downloader(concurrency=2, timeout=5, max_size=5000)
+        # by Content-Length
+        with self.assertRaises(DownloadError):
+            await downloader.download(self.server.make_url("/image"), self.tmpdir)
+        # while streaming
+        with self.assertRaises(DownloadError):
+            await downloader.download(self.server.make_url("/large"), self.tmpdir)
+        assert os.listdir(self.tmpdir) == []
+        assert metrics.get("image_downloads_total", result="too_large") == 2
+        await downloader.close()
+
+    @unittest_run_loop
+    async def test_timeout(self):
+        downloader = Downloader(concurrency=2, timeout=0.1, max_size=5000)
+        with self.assertRaises(DownloadError):
+            await downloader.download(self.server.make_url("/slow"), self.tmpdir)
+        assert metrics.get("image_downloads_total", result="timeout") == 1
+        await downloader.close()
+
+    @unittest_run_loop
+    async def test_not_modified(self):
+        downloader = Downloader(concurrency=2, timeout=5, max_size=5000)
+        download = await downloader.download(
+            self.server.make_url("/cached"), self.tmpdir, headers={"If-None-Match": "v1"})
+        assert download.status == 304
+        assert download.path is None
+        assert os.listdir(self.tmpdir) == []
+        await downloader.close()
+
+    @unittest_run_loop
+    async def test_get_downloader(self):
+        assert get_downloader() is get_downloader()
+        assert get_downloader().loop is self.loop
@@ -95,6 +95,12 @@ class DummyStorageTests(asynctest.TestCase):
         res = await self.client.get_known_posts("foo", "baz")
         assert res == []
 
+    async def test_get_source_post_ids(self):
+        assert await self.client.get_source_post_ids("foo") == []
+
+    async def test_get_posts(self):
+        assert await self.client.get_posts("foo", ["baz"]) == {}
+
     async def test_get_post(self):
         res = await self.client.get_post("target", "post")
         assert res is None
@@ -103,6 +109,16 @@ class DummyStorageTests(asynctest.TestCase):
         res = await self.client.delete_post("target", "post")
         assert res is True
 
+    async def test_outbox_items(self):
+        assert await self.client.save_outbox_item(id="foo") is True
+        assert await self.client.get_outbox_items("bridge") == []
+        assert await self.client.delete_outbox_item("bridge", "foo") is True
+
+    async def test_leases(self):
+        assert await self.client.acquire_lease("foo", "node", 2.0, 1.0) is True
+        assert await self.client.release_lease("foo", "node") is True
+        assert await self.client.get_leases() == []
+
     async def test_get_control(self):
         updated = datetime(2017, 6, 1, 11, 3, 2)
         res = await self.client.get_control(updated=updated)
@@ -15,7 +15,7 @@
 # limitations under the License.
 import asynctest
 from datetime import datetime
-from botocore.exceptions import ParamValidationError, BotoCoreError
+from botocore.exceptions import ParamValidationError, BotoCoreError, ClientError
 from livebridge.storages.base import BaseStorage
 from livebridge.storages import DynamoClient
 from livebridge.components import get_db_client
@@ -267,6 +267,21 @@ class DynamoClientTests(asynctest.TestCase):
             ScanIndexForward=False,
             TableName='livebridge_test')
 
+    async def test_get_source_post_ids(self):
+        db = await self.client.db
+        db.query = asynctest.CoroutineMock(side_effect=[
+            {"Items": [{"post_id": {"S": "one"}}], "LastEvaluatedKey": {"post_id": {"S": "one"}}},
+            {"Items": [{"post_id": {"S": "two"}}, {"post_id": {"S": "one"}}]},
+        ])
+        res = await self.client.get_source_post_ids("source-id")
+        assert sorted(res) == ["one", "two"]
+        assert db.query.call_count == 2
+        assert db.query.call_args[1]["ExclusiveStartKey"] == {"post_id": {"S": "one"}}
+        assert db.query.call_args[1]["ProjectionExpression"] == "post_id"
+
+        db.query = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        assert await self.client.get_source_post_ids("source-id") is None
+
     async def test_get_known_posts_failing(self):
         db = await self.client.db
         db.query = asynctest.CoroutineMock(side_effect=Exception())
@@ -296,6 +311,30 @@ class DynamoClientTests(asynctest.TestCase):
             ScanIndexForward=False,
             TableName='livebridge_test')
 
+    async def test_get_posts(self):
+        item = {"post_id": {"S": "one"}, "target_id": {"S": self.target_id},
+                "target_doc": {"S": '{"id": 1}'}, "updated": {"S": "2016-04-06T14:36:37+00:00"}}
+        db = await self.client.db
+        db.batch_get_item = asynctest.CoroutineMock(side_effect=[
+            {"Responses": {"livebridge_test": [item]}, "UnprocessedKeys": {"livebridge_test": {"Keys": ["two"]}}},
+            {"Responses": {"livebridge_test": []}},
+            {"Responses": {"livebridge_test": []}},
+        ])
+        post_ids = ["one", "one"] + [str(x) for x in range(100)]
+        with asynctest.patch("asyncio.sleep", new=asynctest.CoroutineMock()):
+            res = await self.client.get_posts(self.target_id, post_ids)
+        assert list(res) == ["one"]
+        assert res["one"]["target_doc"] == {"id": 1}
+        assert res["one"]["target_id"] == self.target_id
+        # 101 unique keys in two requests, unprocessed keys are requested again
+        request = db.batch_get_item.call_args_list[0][1]["RequestItems"]["livebridge_test"]
+        assert len(request["Keys"]) == 100
+        assert db.batch_get_item.call_args_list[1][1]["RequestItems"] == {"livebridge_test": {"Keys": ["two"]}}
+        assert len(db.batch_get_item.call_args_list[2][1]["RequestItems"]["livebridge_test"]["Keys"]) == 1
+
+        db.batch_get_item = asynctest.CoroutineMock(side_effect=BotoCoreError)
+        assert await self.client.get_posts(self.target_id, ["one"]) is None
+
     async def test_get_post_failing(self):
         post_id = "urn:newsml:localhost:2016-04-06T14:36:37.255055:f2266f58-1e5c-4021-85af-e39087d94372"
         db = await self.client.db
@@ -325,6 +364,103 @@ class DynamoClientTests(asynctest.TestCase):
         res = await self.client.delete_post("target-id", "baz")
         assert res is False
 
+    async def test_insert_update_posts(self):
+        posts = [{"target_id": "target-id", "post_id": str(x), "source_id": "source-id", "text": "Text",
+                  "created": datetime.utcnow(), "updated": datetime.utcnow()} for x in range(30)]
+        db = await self.client.db
+        unprocessed = {self.table_name: [{"PutRequest": {"Item": {}}}]}
+        db.batch_write_item = asynctest.CoroutineMock(side_effect=[
+            {"UnprocessedItems": unprocessed}, {"UnprocessedItems": {}}, {}])
+        assert await self.client.insert_posts(posts) is True
+        calls = db.batch_write_item.call_args_list
+        assert len(calls) == 3
+        assert len(calls[0][1]["RequestItems"][self.table_name]) == 25
+        assert calls[1][1]["RequestItems"] == unprocessed
+        assert len(calls[2][1]["RequestItems"][self.table_name]) == 5
+
+        db.batch_write_item = asynctest.CoroutineMock(return_value={})
+        assert await self.client.update_posts(posts[:3]) is True
+        assert db.batch_write_item.call_count == 1
+
+        # failing
+        db.batch_write_item = asynctest.CoroutineMock(side_effect=BotoCoreError)
+        assert await self.client.insert_posts(posts) is False
+
+    async def test_outbox_items(self):
+        self.client.outbox_table_name = "test_outbox"
+        api_res = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        item = {"id": "abc", "bridge": "bridge", "target": "target", "source": "liveblog", "post_id": "one",
+                "data": "{}", "count": 1, "dead": False, "created": 1.5}
+        db = await self.client.db
+        db.put_item = asynctest.CoroutineMock(return_value=api_res)
+        db.delete_item = asynctest.CoroutineMock(return_value=api_res)
+        assert await self.client.save_outbox_item(**item) is True
+        params = db.put_item.call_args[1]
+        assert params["TableName"] == "test_outbox"
+        assert params["Item"]["count"] == {"N": "1"}
+        assert params["Item"]["dead"] == {"BOOL": False}
+        db.query = asynctest.CoroutineMock(side_effect=[
+            {"Items": [params["Item"]], "LastEvaluatedKey": {"id": {"S": "abc"}}},
+            {"Items": []}])
+        assert await self.client.get_outbox_items("bridge") == [item]
+        assert db.query.call_args[1]["ExclusiveStartKey"] == {"id": {"S": "abc"}}
+        assert await self.client.delete_outbox_item("bridge", "abc") is True
+        assert db.delete_item.call_args[1]["Key"] == {"bridge": {"S": "bridge"}, "id": {"S": "abc"}}
+
+        # failing
+        db.put_item.side_effect = BotoCoreError
+        db.query.side_effect = BotoCoreError
+        db.delete_item.side_effect = BotoCoreError
+        assert await self.client.save_outbox_item(**item) is False
+        assert await self.client.get_outbox_items("bridge") == []
+        assert await self.client.delete_outbox_item("bridge", "abc") is False
+        self.client.outbox_table_name = None
+
+    async def test_leases(self):
+        self.client.lease_table_name = "test_leases"
+        assert self.client.lease_table_schema["ProvisionedThroughput"] == \
+            {"ReadCapacityUnits": 5, "WriteCapacityUnits": 25}
+        api_res = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        db = await self.client.db
+        db.put_item = asynctest.CoroutineMock(return_value=api_res)
+        db.delete_item = asynctest.CoroutineMock(return_value=api_res)
+        assert await self.client.acquire_lease("foo", "node", 2.5, 1.5) is True
+        params = db.put_item.call_args[1]
+        assert params["Item"] == {"kind": {"S": "foo"}, "name": {"S": "foo"}, "owner": {"S": "node"},
+                                  "expires": {"N": "2.5"}}
+        assert params["ExpressionAttributeValues"] == {":owner": {"S": "node"}, ":now": {"N": "1.5"}}
+        assert "attribute_not_exists" in params["ConditionExpression"]
+        db.scan = asynctest.CoroutineMock(side_effect=[
+            {"Items": [params["Item"]], "LastEvaluatedKey": {"name": {"S": "foo"}}},
+            {"Items": []}])
+        assert await self.client.get_leases() == [{"name": "foo", "owner": "node", "expires": 2.5}]
+        assert db.scan.call_args[1]["ExclusiveStartKey"] == {"name": {"S": "foo"}}
+        assert await self.client.release_lease("foo", "node") is True
+        assert db.delete_item.call_args[1]["Key"] == {"kind": {"S": "foo"}, "name": {"S": "foo"}}
+        # leases of a kind are queried from their partition
+        db.query = asynctest.CoroutineMock(return_value={"Items": [
+            {"kind": {"S": "node"}, "name": {"S": "node:a"}, "owner": {"S": "a"}, "expires": {"N": "2.5"}}]})
+        assert await self.client.get_leases(prefix="node:") == [{"name": "node:a", "owner": "a", "expires": 2.5}]
+        assert db.query.call_args[1]["ExpressionAttributeValues"] == {":kind": {"S": "node"}, ":prefix": {"S": "node:"}}
+
+        # held by other owner
+        failed = ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem")
+        db.put_item.side_effect = failed
+        db.delete_item.side_effect = failed
+        assert await self.client.acquire_lease("foo", "node", 2.5, 1.5) is False
+        assert await self.client.release_lease("foo", "node") is True
+
+        # failing
+        db.put_item.side_effect = ClientError({"Error": {"Code": "ProvisionedThroughputExceededException"}}, "PutItem")
+        db.delete_item.side_effect = BotoCoreError
+        db.scan.side_effect = BotoCoreError
+        assert await self.client.acquire_lease("foo", "node", 2.5, 1.5) is False
+        db.put_item.side_effect = BotoCoreError
+        assert await self.client.acquire_lease("foo", "node", 2.5, 1.5) is False
+        assert await self.client.release_lease("foo", "node") is False
+        assert await self.client.get_leases() == []
+        self.client.lease_table_name = None
+
     async def test_get_control(self):
         api_res = {'Count': 1, 'ScannedCount': 1, 'Items': [
                    {'id': {'S': 'control'}, 'data': {'S': '{"bridges": [{"foo": "bla"}], "auth": {"foo": "baz"}}'}}
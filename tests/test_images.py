@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import asynctest
+import os
+import tempfile
+from livebridge.images import ImageCache, get_image_cache
+from livebridge.metrics import metrics
+from tests import fetch
+
+
+class ImageCacheTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ImageCache(self.tmpdir, max_size=100, ttl=60, max_age=60)
+        self.cache._fetch = fetch(self.cache.path, 200, {"ETag": "v1"}, b"image")
+
+    async def tearDown(self):
+        await self.cache.clear()
+        os.rmdir(self.tmpdir)
+        metrics.clear()
+
+    async def test_get(self):
+        path = await self.cache.get("http://example.com/one.jpg", ext=".jpg")
+        assert path.startswith(os.path.join(self.tmpdir, str(os.getpid()))) is True
+        assert path.endswith(".jpg") is True
+        with open(path, "rb") as file:
+            assert file.read() == b"image"
+        # same content from another url shares the file
+        assert await self.cache.get("http://example.com/two.jpg", ext=".jpg") == path
+        assert await self.cache.get("http://example.com/one.jpg") == path
+        assert self.cache._fetch.call_count == 2
+        # download of the duplicate got removed
+        assert os.listdir(self.cache.path) == [os.path.basename(path)]
+        assert self.cache.files[os.path.basename(path)[:-4]].refs == 3
+        assert self.cache.size == 5
+        assert metrics.get("image_cache_total", result="hit") == 1
+        assert metrics.get("image_cache_total", result="miss") == 2
+        assert list(self.cache.collect()) == [("image_cache_files", {}, 1), ("image_cache_bytes", {}, 5)]
+
+    async def test_single_flight(self):
+        paths = await asyncio.gather(*[self.cache.get("http://example.com/one.jpg") for _ in range(3)])
+        assert len(set(paths)) == 1
+        assert self.cache._fetch.call_count == 1
+        assert self.cache.locks == {}
+
+    async def test_revalidate(self):
+        self.cache.max_age = 0
+        path = await self.cache.get("http://example.com/one.jpg")
+        self.cache._fetch = fetch(self.cache.path, 304, {})
+        assert await self.cache.get("http://example.com/one.jpg") == path
+        self.cache._fetch.assert_called_once_with("http://example.com/one.jpg", {"If-None-Match": "v1"})
+        assert metrics.get("image_cache_total", result="revalidated") == 1
+
+        # cached file is used, when the server fails
+        self.cache._fetch = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        assert await self.cache.get("http://example.com/one.jpg") == path
+
+        # changed image gets a new file
+        self.cache._fetch = fetch(
+            self.cache.path, 200, {"Last-Modified": "Tue, 31 Jan 2017 13:01:08 GMT"}, b"changed")
+        changed = await self.cache.get("http://example.com/one.jpg")
+        assert changed != path
+        assert self.cache.urls["http://example.com/one.jpg"].last_modified == "Tue, 31 Jan 2017 13:01:08 GMT"
+
+    async def test_failing(self):
+        self.cache._fetch = fetch(self.cache.path, 404, {})
+        with self.assertRaises(IOError):
+            await self.cache.get("http://example.com/one.jpg")
+        self.cache._fetch = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        with self.assertRaises(Exception):
+            await self.cache.get("http://example.com/one.jpg")
+        assert self.cache.files == {}
+
+    async def test_release_evict(self):
+        path = await self.cache.get("http://example.com/one.jpg")
+        assert self.cache.release("/tmp/unknown.jpg") is False
+        assert self.cache.release(path) is True
+        # unused files are kept until ttl or max. size is reached
+        assert os.path.exists(path) is True
+        self.cache._fetch = fetch(self.cache.path, 200, {}, b"x" * 100)
+        other = await self.cache.get("http://example.com/two.jpg")
+        await self.cache.wait_removed()
+        assert os.path.exists(path) is False
+        assert "http://example.com/one.jpg" not in self.cache.urls
+        assert self.cache.size == 100
+        # referenced files are not evicted
+        assert os.path.exists(other) is True
+        self.cache.ttl = -1
+        self.cache.release(other)
+        assert self.cache.size == 0
+        assert other in self.cache.removing
+        await self.cache.wait_removed()
+        assert os.path.exists(other) is False
+        assert self.cache.removing == {}
+
+    async def test_evict_expired(self):
+        self.cache.evict_interval = 0.05
+        path = await self.cache.get("http://example.com/one.jpg")
+        assert self.cache.evict_timer is not None
+        self.cache.release(path)
+        self.cache.ttl = 0.01
+        # expired without further traffic
+        await asyncio.sleep(0.1)
+        await self.cache.wait_removed()
+        assert os.path.exists(path) is False
+        assert self.cache.files == {}
+        assert self.cache.evict_timer is None
+
+    async def test_store_removed(self):
+        path = await self.cache.get("http://example.com/one.jpg")
+        self.cache.ttl = -1
+        self.cache.release(path)
+        # same content stored again while removing
+        self.cache.ttl = 60
+        assert await self.cache.get("http://example.com/one.jpg") == path
+        await self.cache.wait_removed()
+        assert os.path.exists(path) is True
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_get_image_cache(self):
+        assert get_image_cache() is get_image_cache()
+        assert get_image_cache().collect in metrics.collectors
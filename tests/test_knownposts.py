@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asynctest
+from livebridge.knownposts import BloomFilter, KnownPosts, get_known_posts, remember_posts, forget_post, \
+    clear_known_posts, collect
+from livebridge.metrics import metrics
+
+
+class BloomFilterTest(asynctest.TestCase):
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_contains(self):
+        bloom = BloomFilter(1000, 0.01)
+        for x in range(1000):
+            bloom.add("post-{}".format(x))
+        assert bloom.count == 1000
+        # no false negatives
+        assert all("post-{}".format(x) in bloom for x in range(1000))
+        false_positives = sum(1 for x in range(1000, 11000) if "post-{}".format(x) in bloom)
+        assert false_positives < 300
+
+
+class KnownPostsTest(asynctest.TestCase):
+
+    def tearDown(self):
+        clear_known_posts()
+        metrics.clear()
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_lru(self):
+        cache = KnownPosts("source", size=2, bloom=False)
+        cache.add(["one", "two"])
+        assert cache.lookup(["one"]) == ({"one"}, set(), [])
+        cache.add(["three"])
+        # two was used least recently
+        assert list(cache.ids) == ["one", "three"]
+        assert cache.lookup(["two", "three"]) == ({"three"}, set(), ["two"])
+        cache.discard("three")
+        assert len(cache) == 1
+        assert metrics.get("known_posts_cache_total", result="hit") == 2
+        assert metrics.get("known_posts_cache_total", result="miss") == 1
+
+    async def test_warm_bloom(self):
+        db_client = asynctest.MagicMock()
+        db_client.get_source_post_ids = asynctest.CoroutineMock(return_value=["one", "two", "three"])
+        cache = KnownPosts("source", size=2, bloom=True)
+        assert await cache.warm(db_client) is True
+        assert cache.warmed is True
+        db_client.get_source_post_ids.assert_called_once_with("source")
+        known, unknown, missing = cache.lookup(["one", "three", "four"])
+        assert known == {"three"}
+        assert unknown == {"four"}
+        assert missing == ["one"]
+        assert metrics.get("known_posts_cache_total", result="bloom") == 1
+        cache.add(["four"])
+        assert "four" in cache.bloom
+
+    async def test_warm_failing(self):
+        db_client = asynctest.MagicMock()
+        db_client.get_source_post_ids = asynctest.CoroutineMock(return_value=None)
+        cache = KnownPosts("source", size=10, bloom=True)
+        assert await cache.warm(db_client) is False
+        assert cache.bloom is None
+        assert cache.lookup(["one"]) == (set(), set(), ["one"])
+
+        db_client.get_source_post_ids = asynctest.CoroutineMock(side_effect=NotImplementedError())
+        assert await cache.warm(db_client) is False
+        assert cache.warmed is True
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_full_bloom(self):
+        cache = KnownPosts("source", size=10, bloom=True)
+        cache.bloom = BloomFilter(2)
+        cache.add(["one", "two"])
+        assert cache.bloom is not None
+        cache.add(["three"])
+        assert cache.bloom is None
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_process_wide(self):
+        remember_posts("source", ["one"])
+        assert get_known_posts("source") is get_known_posts("source")
+        assert len(get_known_posts("source")) == 0
+        remember_posts("source", ["one", "two"])
+        forget_post("one")
+        assert list(get_known_posts("source").ids) == ["two"]
+        assert list(collect()) == [("known_posts_cached", {}, 1)]
+        with asynctest.patch("livebridge.knownposts.KNOWN_POSTS_CACHE_SIZE", 0):
+            assert get_known_posts("other") is None
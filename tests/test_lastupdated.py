@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asynctest
+from datetime import datetime, timedelta, timezone
+from livebridge.lastupdated import LastUpdatedIndex, get_last_updated_index, advance_last_updated, \
+    clear_last_updated, collect
+
+
+class LastUpdatedIndexTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.tstamp = datetime(2017, 1, 1, 12, 0)
+
+    def tearDown(self):
+        clear_last_updated()
+
+    async def test_load(self):
+        db_client = asynctest.MagicMock()
+        db_client.get_last_updated_sources = asynctest.CoroutineMock(return_value={1: self.tstamp})
+        index = LastUpdatedIndex(mode="local")
+        assert await index.load(db_client, [1, 2, 1]) is True
+        assert sorted(db_client.get_last_updated_sources.call_args[0][0]) == [1, 2]
+        assert index.get(1) == self.tstamp
+        assert index.get("1") == self.tstamp
+        # sources without posts are known too
+        assert index.fresh(2) is True
+        assert index.get(2) is None
+        assert index.fresh(3) is False
+
+        db_client.get_last_updated_sources = asynctest.CoroutineMock(return_value=None)
+        assert await index.load(db_client, [3]) is False
+        db_client.get_last_updated_sources = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        assert await index.load(db_client, [3]) is False
+        assert await index.load(db_client, []) is False
+        assert index.fresh(3) is False
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_advance(self):
+        index = LastUpdatedIndex(mode="local")
+        index.advance("one", self.tstamp)
+        assert index.fresh("one") is False
+        index.set("one", None)
+        index.advance("one", self.tstamp)
+        assert index.get("one") == self.tstamp
+        # older posts don't go back in time
+        index.advance("one", self.tstamp - timedelta(days=1))
+        index.set("one", self.tstamp - timedelta(days=1))
+        assert index.get("one") == self.tstamp
+        aware = datetime(2017, 1, 2, tzinfo=timezone.utc)
+        index.advance("one", aware)
+        assert index.get("one") == aware
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_shared(self):
+        index = LastUpdatedIndex(mode="shared", ttl=60)
+        index.set("one", self.tstamp)
+        assert index.fresh("one") is True
+        index.ttl = 0
+        assert index.fresh("one") is False
+        assert index.get("one") == self.tstamp
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_process_wide(self):
+        advance_last_updated("one", self.tstamp)
+        index = get_last_updated_index()
+        assert index is get_last_updated_index()
+        assert index.mode == "local"
+        index.set("one", None)
+        advance_last_updated("one", self.tstamp)
+        assert index.get("one") == self.tstamp
+        assert list(collect()) == [("last_updated_cached", {}, 1)]
+        clear_last_updated()
+        with asynctest.patch("livebridge.lastupdated.LAST_UPDATED_CACHE", "shared"):
+            assert get_last_updated_index().mode == "shared"
+        clear_last_updated()
+        with asynctest.patch("livebridge.lastupdated.LAST_UPDATED_CACHE", "off"):
+            assert get_last_updated_index() is None
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import asynctest
+from livebridge.base import BaseTarget
+from livebridge.limits import TokenBucket, Limiter, get_limiter, get_type_limiter, set_type_limits
+
+
+class LimitedTarget(BaseTarget):
+    type = "limited"
+    concurrency = 2
+    rate_limit = 100
+
+
+class LimitsTest(asynctest.TestCase):
+
+    async def test_token_bucket(self):
+        bucket = TokenBucket(10, burst=2)
+        start = self.loop.time()
+        for _ in range(4):
+            await bucket.acquire()
+        # two requests at once, two more at 10/s
+        assert 0.15 <= self.loop.time() - start < 0.4
+
+    async def test_token_bucket_burst(self):
+        bucket = TokenBucket(0.5)
+        assert bucket.burst == 1
+        start = self.loop.time()
+        await bucket.acquire()
+        assert self.loop.time() - start < 0.05
+
+    async def test_limiter_concurrency(self):
+        limiter = Limiter(concurrency=2)
+        running = []
+
+        async def request():
+            await limiter.acquire()
+            try:
+                running.append(1)
+                assert len(running) <= 2
+                await asyncio.sleep(0.05)
+                running.pop()
+            finally:
+                limiter.release()
+
+        await asyncio.gather(*[request() for _ in range(6)])
+        assert limiter.semaphore._value == 2
+
+    async def test_limiter_cancel(self):
+        limiter = Limiter(concurrency=1, rate=1, burst=1)
+        await limiter.acquire()
+        limiter.release()
+        task = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0)
+        assert limiter.semaphore._value == 1
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_from_config(self):
+        assert Limiter.from_config({"type": "foo"}) is None
+        limiter = Limiter.from_config({"concurrency": 3})
+        assert limiter.semaphore._value == 3
+        assert limiter.bucket is None
+        limiter = Limiter.from_config({"rate_limit": 5, "rate_burst": 10})
+        assert limiter.semaphore is None
+        assert limiter.bucket.rate == 5
+        assert limiter.bucket.burst == 10
+        assert repr(limiter) == "<Limiter concurrency=None rate=5.0>"
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_get_type_limiter(self):
+        assert get_type_limiter(BaseTarget) is None
+        limiter = get_type_limiter(LimitedTarget)
+        assert limiter.semaphore._value == 2
+        assert limiter.bucket.rate == 100
+        assert get_type_limiter(LimitedTarget) is limiter
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_get_limiter(self):
+        assert get_limiter("foo", {"type": "foo"}) is None
+        limiter = get_limiter("foo", {"type": "foo", "concurrency": 2})
+        assert limiter.semaphore._value == 2
+        # shared by targets of the same entry
+        assert get_limiter("foo", {"type": "foo", "concurrency": 2}) is limiter
+        assert get_limiter("bar", {"type": "foo", "concurrency": 2}) is not limiter
+        # changed limits
+        changed = get_limiter("foo", {"type": "foo", "concurrency": 3})
+        assert changed is not limiter
+        assert changed.semaphore._value == 3
+        assert get_limiter("foo", {"type": "foo"}) is None
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_type_limits(self):
+        limiter = get_type_limiter(LimitedTarget)
+        set_type_limits({"limited": {"rate_limit": 5}, "other": {"concurrency": 1}})
+        try:
+            changed = get_type_limiter(LimitedTarget)
+            assert changed is not limiter
+            assert changed.semaphore._value == 2
+            assert changed.bucket.rate == 5
+            assert get_type_limiter(LimitedTarget) is changed
+            assert get_type_limiter(BaseTarget) is None
+            set_type_limits({"limited": {"concurrency": None, "rate_limit": None}})
+            assert get_type_limiter(LimitedTarget) is None
+        finally:
+            set_type_limits(None)
+        assert get_type_limiter(LimitedTarget).bucket.rate == 100
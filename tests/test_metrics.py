@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import unittest
+from livebridge.metrics import Metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_counter(self):
+        self.metrics.incr("foo")
+        self.metrics.incr("foo", 2)
+        self.metrics.incr("foo", target="bar")
+        assert self.metrics.get("foo") == 3
+        assert self.metrics.get("foo", target="bar") == 1
+        assert self.metrics.get("baz") is None
+
+    def test_gauge(self):
+        self.metrics.set("foo", 5, bridge="one")
+        self.metrics.set("foo", 3, bridge="one")
+        assert self.metrics.get("foo", bridge="one") == 3
+
+    def test_histogram(self):
+        self.metrics.observe("duration", 0.2, source="test")
+        self.metrics.observe("duration", 3, source="test")
+        hist = self.metrics.snapshot()["histograms"]["duration"][0]
+        assert hist["labels"] == {"source": "test"}
+        assert hist["value"]["count"] == 2
+        assert hist["value"]["sum"] == 3.2
+        assert hist["value"]["buckets"]["0.1"] == 0
+        assert hist["value"]["buckets"]["0.25"] == 1
+        assert hist["value"]["buckets"]["5"] == 2
+        assert hist["value"]["buckets"]["+Inf"] == 2
+
+    def test_collectors(self):
+        def collector():
+            yield ("depth", {"bridge": "one"}, 4)
+
+        def failing():
+            raise Exception("Test")
+
+        self.metrics.add_collector(collector)
+        self.metrics.add_collector(collector)
+        self.metrics.add_collector(failing)
+        assert len(self.metrics.collectors) == 2
+        snapshot = self.metrics.snapshot()
+        assert snapshot["gauges"] == {"depth": [{"labels": {"bridge": "one"}, "value": 4}]}
+        json.dumps(snapshot)
+
+        self.metrics.remove_collector(collector)
+        self.metrics.remove_collector(failing)
+        assert self.metrics.snapshot()["gauges"] == {}
+
+    def test_clear(self):
+        self.metrics.incr("foo")
+        self.metrics.set("bar", 1)
+        self.metrics.observe("baz", 1)
+        self.metrics.clear()
+        assert self.metrics.snapshot() == {"counters": {}, "gauges": {}, "histograms": {}}
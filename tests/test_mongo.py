@@ -14,8 +14,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import asynctest
+import re
 from datetime import datetime
 from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
 from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorCollection, AsyncIOMotorCursor
 from livebridge.storages.base import BaseStorage
 from livebridge.storages import MongoStorage
@@ -134,6 +136,18 @@ class MongoStorageTests(asynctest.TestCase):
         res = await self.client.get_last_updated("source")
         assert res is None
 
+    async def test_get_last_updated_sources(self):
+        tstamp = datetime(2016, 10, 19, 10, 13, 43)
+        coll = asynctest.MagicMock(spec=AsyncIOMotorCollection)
+        coll.aggregate.return_value = MockGenerator([{"_id": "one", "updated": tstamp}])
+        self.client._db = {self.table_name: coll}
+        res = await self.client.get_last_updated_sources(["one", "two"])
+        assert res == {"one": tstamp}
+        assert coll.aggregate.call_args[0][0][0] == {"$match": {"source_id": {"$in": ["one", "two"]}}}
+
+        coll.aggregate.side_effect = Exception("Test-Error")
+        assert await self.client.get_last_updated_sources(["one"]) is None
+
     async def test_get_last_updated_failing(self):
         coll = asynctest.MagicMock(spec=AsyncIOMotorCollection)
         coll.find.side_effect = Exception("Test-Error")
@@ -215,6 +229,17 @@ class MongoStorageTests(asynctest.TestCase):
         res = await self.client.get_known_posts("source-id", [b"oneoneoneone"])
         assert res == []
 
+    async def test_get_source_post_ids(self):
+        coll = asynctest.MagicMock(spec=AsyncIOMotorCollection)
+        coll.find.return_value = MockGenerator([{"_id": "twotwotwotwo"}, {"_id": "sixsixsixsix"}])
+        self.client._db = {self.table_name: coll}
+        res = await self.client.get_source_post_ids("source-id")
+        assert sorted(res) == ["sixsixsixsix", "twotwotwotwo"]
+        assert coll.find.call_args[0][0] == {"source_id": "source-id"}
+
+        coll.find.side_effect = Exception("Test-Error")
+        assert await self.client.get_source_post_ids("source-id") is None
+
     async def test_get_post(self):
         item = {
             "_id": ObjectId(b"012345678901"),
@@ -228,6 +253,19 @@ class MongoStorageTests(asynctest.TestCase):
         assert res["target_doc"] == {'target': 'doc'}
         assert res["updated"] == item["updated"]
 
+    async def test_get_posts(self):
+        item = {"_id": ObjectId(b"012345678901"), "post_id": "one", "target_doc": {"target": "doc"}}
+        coll = asynctest.MagicMock(spec=AsyncIOMotorCollection)
+        coll.find.return_value = MockGenerator([item])
+        self.client._db = {self.table_name: coll}
+        res = await self.client.get_posts("target", ["one", "one"])
+        assert list(res) == ["one"]
+        assert res["one"]["_id"] == str(item["_id"])
+        assert coll.find.call_args[0][0] == {"target_id": "target", "post_id": {"$in": ["one"]}}
+
+        coll.find.side_effect = Exception("Test-Error")
+        assert await self.client.get_posts("target", ["one"]) is None
+
     async def test_get_post_failing(self):
         coll = asynctest.MagicMock(spec=AsyncIOMotorCollection)
         coll.find_one.side_effect = Exception("Test-Error")
@@ -253,6 +291,76 @@ class MongoStorageTests(asynctest.TestCase):
         assert res is False
         assert coll.delete_one.call_count == 1
 
+    async def test_insert_update_posts(self):
+        coll = asynctest.MagicMock(spec=AsyncIOMotorCollection)
+        coll.insert_many = asynctest.CoroutineMock(return_value=True)
+        coll.bulk_write = asynctest.CoroutineMock(return_value=True)
+        self.client._db = {self.table_name: coll}
+        posts = [{"target_id": "target", "post_id": "one", "sticky": True}, {"target_id": "target", "post_id": 2}]
+        assert await self.client.insert_posts(posts) is True
+        docs = coll.insert_many.call_args[0][0]
+        assert [d["post_id"] for d in docs] == ["one", "2"]
+        assert docs[0]["sticky"] == "1"
+        assert await self.client.update_posts(posts) is True
+        requests = coll.bulk_write.call_args[0][0]
+        assert len(requests) == 2
+        assert requests[0]._filter == {"target_id": "target", "post_id": "one"}
+
+        # failing
+        coll.insert_many.side_effect = Exception("Test-Error")
+        coll.bulk_write.side_effect = Exception("Test-Error")
+        assert await self.client.insert_posts(posts) is False
+        assert await self.client.update_posts(posts) is False
+
+    async def test_outbox_items(self):
+        coll = asynctest.MagicMock(spec=AsyncIOMotorCollection)
+        coll.replace_one = asynctest.CoroutineMock(return_value=True)
+        coll.delete_one = asynctest.CoroutineMock(return_value=True)
+        self.client.outbox_table_name = "test_outbox"
+        self.client._db = {"test_outbox": coll}
+        assert await self.client.save_outbox_item(id="abc", bridge="bridge") is True
+        assert coll.replace_one.call_args == asynctest.call(
+            {"_id": "abc"}, {"_id": "abc", "id": "abc", "bridge": "bridge"}, upsert=True)
+        assert await self.client.delete_outbox_item("bridge", "abc") is True
+        assert coll.delete_one.call_args == asynctest.call({"_id": "abc"})
+
+        # failing
+        coll.replace_one.side_effect = Exception("Test-Error")
+        coll.delete_one.side_effect = Exception("Test-Error")
+        coll.find.side_effect = Exception("Test-Error")
+        assert await self.client.save_outbox_item(id="abc", bridge="bridge") is False
+        assert await self.client.delete_outbox_item("bridge", "abc") is False
+        assert await self.client.get_outbox_items("bridge") == []
+        self.client.outbox_table_name = None
+
+    async def test_leases(self):
+        coll = asynctest.MagicMock(spec=AsyncIOMotorCollection)
+        coll.update_one = asynctest.CoroutineMock(return_value=True)
+        coll.delete_one = asynctest.CoroutineMock(return_value=True)
+        self.client.lease_table_name = "test_leases"
+        self.client._db = {"test_leases": coll}
+        assert await self.client.acquire_lease("foo", "node", 2.0, 1.0) is True
+        assert coll.update_one.call_args == asynctest.call(
+            {"_id": "foo", "$or": [{"owner": "node"}, {"expires": {"$lt": 1.0}}]},
+            {"$set": {"owner": "node", "expires": 2.0}}, upsert=True)
+        # held by other owner
+        coll.update_one.side_effect = DuplicateKeyError("Test-Error")
+        assert await self.client.acquire_lease("foo", "node", 2.0, 1.0) is False
+        assert await self.client.release_lease("foo", "node") is True
+        assert coll.delete_one.call_args == asynctest.call({"_id": "foo", "owner": "node"})
+        coll.find.return_value = MockGenerator([{"_id": "node:a", "owner": "a", "expires": 2.0}])
+        assert await self.client.get_leases(prefix="node:") == [{"name": "node:a", "owner": "a", "expires": 2.0}]
+        assert coll.find.call_args == asynctest.call({"_id": {"$regex": "^" + re.escape("node:")}})
+
+        # failing
+        coll.update_one.side_effect = Exception("Test-Error")
+        coll.delete_one.side_effect = Exception("Test-Error")
+        coll.find.side_effect = Exception("Test-Error")
+        assert await self.client.acquire_lease("foo", "node", 2.0, 1.0) is False
+        assert await self.client.release_lease("foo", "node") is False
+        assert await self.client.get_leases() == []
+        self.client.lease_table_name = None
+
     async def test_get_control(self):
         updated = datetime(2017, 6, 1, 11, 3, 2)
         item = {
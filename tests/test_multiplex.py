@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import asynctest
+from livebridge import config
+from livebridge.bridge import LiveBridge
+from livebridge.components import get_source_key
+from livebridge.controller import Controller
+from livebridge.multiplex import SharedSource
+from livebridge.polling import get_poll_scheduler
+
+
+class SharedSourceTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.conf = {"type": "liveblog", "endpoint": "https://example.com/api", "source_id": 1}
+        self.one = LiveBridge(dict(self.conf, label="One", poll_interval=60))
+        self.two = LiveBridge(dict(self.conf, label="Two", auth={"user": "foo"}))
+        self.one.api_client = asynctest.MagicMock()
+        self.shared = SharedSource(self.one.source_key)
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_source_key(self):
+        assert self.one.source_key == self.two.source_key == get_source_key(self.conf)
+        assert LiveBridge(dict(self.conf, source_id=2)).source_key != self.one.source_key
+        assert self.one.outbox_key == self.one.source_key
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_add_remove(self):
+        self.shared.add(self.one)
+        self.shared.add(self.two)
+        self.shared.add(self.two)
+        assert self.shared.bridges == [self.one, self.two]
+        assert self.two.source is self.one.source
+        assert self.shared.hashes == [self.one.hash, self.two.hash]
+        assert self.shared.label == "One, Two"
+        assert self.shared.source_id == 1
+        assert self.shared.remove(self.one) is True
+        assert self.shared.remove(self.two) is False
+        assert self.shared.bridges == []
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_poll_settings(self):
+        assert self.shared.poll_settings() == (None, None)
+        self.shared.polls[self.one] = (60, None, None)
+        self.shared.polls[self.two] = (20, None, "skip")
+        assert self.shared.poll_settings() == (self.two, (20, None, "skip"))
+
+    async def test_check_posts(self):
+        self.shared.add(self.one)
+        self.shared.add(self.two)
+        self.one.api_client.poll = asynctest.CoroutineMock(return_value=["post"])
+        self.one.new_posts = asynctest.CoroutineMock()
+        self.two.new_posts = asynctest.CoroutineMock()
+        assert await self.shared.check_posts() is True
+        assert self.one.api_client.poll.call_count == 1
+        self.one.new_posts.assert_called_once_with(["post"], wait=False)
+        self.two.new_posts.assert_called_once_with(["post"], wait=False)
+        assert self.shared.last_poll_count == 1
+
+        # draining bridges get no more posts
+        self.one.draining = True
+        await self.shared.check_posts()
+        assert self.one.api_client.poll.call_count == 2
+        assert self.one.new_posts.call_count == 1
+        assert self.two.new_posts.call_count == 2
+
+        # paused intake of one bridge skips the shared poll
+        self.one.draining = False
+        self.two.paused = True
+        await self.shared.check_posts()
+        assert self.one.api_client.poll.call_count == 2
+
+    async def test_new_posts(self):
+        self.shared.add(self.one)
+        self.shared.add(self.two)
+        self.one.new_posts = asynctest.CoroutineMock()
+        self.two.new_posts = asynctest.CoroutineMock()
+        await self.shared.new_posts(["post"])
+        self.one.new_posts.assert_called_once_with(["post"])
+        self.two.new_posts.assert_called_once_with(["post"])
+
+
+class ControllerSharingTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.controller = Controller(config=config, control_file=None)
+        self.scheduler = get_poll_scheduler()
+        self.scheduler.jitter = 0
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def _bridge(self, **kwargs):
+        bridge = LiveBridge(dict({"type": "liveblog", "endpoint": "https://example.com/api", "source_id": 1},
+                                 **kwargs))
+        bridge.api_client = asynctest.MagicMock()
+        bridge.api_client.poll = asynctest.CoroutineMock(return_value=[])
+        bridge.api_client.stop = asynctest.CoroutineMock()
+        return bridge
+
+    async def test_poll_once(self):
+        one, two = self._bridge(label="One"), self._bridge(label="Two")
+        self.controller.sleep = lambda seconds: asyncio.sleep(0.01)
+        self.controller.bridges = {one: None, two: None}
+        runners = [asyncio.ensure_future(self.controller.run_poller(bridge=one, interval=60)),
+                   asyncio.ensure_future(self.controller.run_poller(bridge=two, interval=0.05))]
+        await asyncio.sleep(0.12)
+        shared = self.controller.sources[one.source_key]
+        assert shared.bridges == [one, two]
+        assert list(self.scheduler.entries) == [shared]
+        # polled once for both bridges at the shorter interval
+        assert self.scheduler.entries[shared].interval == 0.05
+        assert 2 <= one.api_client.poll.call_count <= 3
+        assert two.source is one.source
+
+        self.controller.shutdown = True
+        await asyncio.gather(*runners)
+        assert self.controller.sources == {}
+        assert self.scheduler.entries == {}
+        assert one.api_client.stop.call_count == 1
+
+    async def test_remove_shared_bridge(self):
+        one, two = self._bridge(label="One"), self._bridge(label="Two")
+        self.controller.bridges = {one: None, two: None}
+        shared = self.controller.share_source(one)
+        self.controller.share_source(two)
+        await self.controller.remove_bridge(one)
+        # source is still used by bridge two
+        assert one.api_client.stop.call_count == 0
+        assert shared.bridges == [two]
+        await self.controller.remove_bridge(two)
+        assert one.api_client.stop.call_count == 1
+        assert self.controller.sources == {}
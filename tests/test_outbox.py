@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asynctest
+import os
+from livebridge import config
+from livebridge import outbox
+from livebridge.components import POST_MAP
+from livebridge.outbox import BaseOutbox, LocalOutbox, StorageOutbox, get_outbox
+
+
+class TestPost(object):
+    source = "test"
+
+    def __init__(self, data, **kwargs):
+        self.data = data
+
+    @property
+    def id(self):
+        return self.data["id"]
+
+
+class OutboxTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.path = "./tests/outbox.db"
+        self.outbox = LocalOutbox(self.path)
+        POST_MAP["test"] = TestPost
+
+    async def tearDown(self):
+        await self.outbox.close()
+        del POST_MAP["test"]
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def _item(self, post_id, count=0):
+        return {"post": TestPost({"id": post_id, "text": "foo"}), "target": "target", "count": count}
+
+    async def test_base(self):
+        box = BaseOutbox()
+        with self.assertRaises(NotImplementedError):
+            await box.save({})
+        with self.assertRaises(NotImplementedError):
+            await box.delete({})
+        with self.assertRaises(NotImplementedError):
+            await box.get_items("bridge")
+        assert await box.close() is None
+        assert await box.pending("bridge") == []
+        assert await box.dead_letters("bridge") == []
+        record = box.record("bridge", "target", self._item("one"))
+        assert await box.put(record) is False
+        assert await box.remove(record) is False
+
+    async def test_record(self):
+        record = self.outbox.record("bridge", "target", self._item("one", count=2))
+        assert record["bridge"] == "bridge"
+        assert record["target"] == "target"
+        assert record["source"] == "test"
+        assert record["post_id"] == "one"
+        assert record["count"] == 2
+        assert record["dead"] is False
+        assert record["id"] in self.outbox.active
+        post = self.outbox.restore(record)
+        assert post.data == {"id": "one", "text": "foo"}
+        assert self.outbox.restore(dict(record, source="unknown")) is None
+
+    async def test_claim_release(self):
+        record = self.outbox.record("bridge", "target", self._item("one"))
+        assert self.outbox.claim(record) is False
+        self.outbox.release([record])
+        assert self.outbox.claim(record) is True
+
+    async def test_local(self):
+        one = self.outbox.record("bridge", "target", self._item("one"))
+        two = self.outbox.record("bridge", "target", self._item("two"))
+        other = self.outbox.record("other", "target", self._item("three"))
+        for record in [one, two, other]:
+            assert await self.outbox.put(record) is True
+        assert [r["id"] for r in await self.outbox.pending("bridge")] == [one["id"], two["id"]]
+
+        # update
+        one["count"] = 3
+        await self.outbox.put(one)
+        items = await self.outbox.pending("bridge")
+        assert items[0] == one
+
+        # dead letter
+        assert await self.outbox.bury(two) is True
+        assert [r["id"] for r in await self.outbox.pending("bridge")] == [one["id"]]
+        assert [r["id"] for r in await self.outbox.dead_letters("bridge")] == [two["id"]]
+
+        # remove
+        assert await self.outbox.remove(one) is True
+        assert await self.outbox.pending("bridge") == []
+        assert one["id"] not in self.outbox.active
+
+        # survives reopening
+        await self.outbox.close()
+        box = LocalOutbox(self.path)
+        assert [r["id"] for r in await box.pending("other")] == [other["id"]]
+        await box.close()
+
+    async def test_storage(self):
+        db = asynctest.MagicMock()
+        db.save_outbox_item = asynctest.CoroutineMock(return_value=True)
+        db.delete_outbox_item = asynctest.CoroutineMock(return_value=True)
+        db.get_outbox_items = asynctest.CoroutineMock(return_value=[
+            {"id": "b", "created": 2, "dead": False}, {"id": "a", "created": 1, "dead": False}])
+        box = StorageOutbox(db)
+        record = box.record("bridge", "target", self._item("one"))
+        assert await box.put(record) is True
+        assert db.save_outbox_item.call_args == asynctest.call(**record)
+        assert await box.remove(record) is True
+        assert db.delete_outbox_item.call_args == asynctest.call("bridge", record["id"])
+        assert [r["id"] for r in await box.pending("bridge")] == ["a", "b"]
+
+        # failing
+        db.save_outbox_item.return_value = False
+        db.delete_outbox_item.return_value = False
+        assert await box.put(record) is False
+        assert await box.remove(record) is False
+
+    async def test_get_outbox(self):
+        outbox._outbox = None
+        assert get_outbox() is None
+        config.OUTBOX = "foo"
+        assert get_outbox() is None
+        config.OUTBOX = "local"
+        assert isinstance(get_outbox(), LocalOutbox)
+        assert get_outbox() is get_outbox()
+        outbox._outbox = None
+        config.OUTBOX = "storage"
+        assert isinstance(get_outbox(), StorageOutbox)
+        outbox._outbox = None
+        config.OUTBOX = None
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import asynctest
+from livebridge.metrics import metrics
+from livebridge.polling import PollScheduler, AdaptiveInterval, get_poll_scheduler
+
+
+class PollSchedulerTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.scheduler = PollScheduler(concurrency=2, jitter=0)
+        self.polls = []
+
+    def tearDown(self):
+        self.scheduler.stop()
+        metrics.clear()
+
+    async def _poll(self, bridge):
+        self.polls.append(bridge)
+        await asyncio.sleep(0.05)
+
+    async def test_add(self):
+        entry = self.scheduler.add("one", 0.1, self._poll)
+        assert self.scheduler.entries == {"one": entry}
+        assert entry.due <= self.scheduler.loop.time()
+        await asyncio.sleep(0.28)
+        assert self.polls == ["one", "one", "one"]
+        assert metrics.histograms[("poll_lag_seconds", ())]["count"] == 3
+        # remove doesn't cancel running poll
+        await asyncio.sleep(0.03)
+        assert entry.running is True
+        assert self.scheduler.remove("one") is entry
+        assert self.scheduler.remove("one") is None
+        await asyncio.sleep(0.2)
+        assert entry.running is False
+        assert self.polls == ["one"] * 4
+        assert self.scheduler.heap == []
+
+    async def test_jitter(self):
+        self.scheduler.jitter = 1
+        now = self.scheduler.loop.time()
+        dues = [self.scheduler.add(x, 10, self._poll).due for x in range(20)]
+        assert all(now <= due <= now + 10.1 for due in dues)
+        assert len(set(dues)) > 1
+        assert self.scheduler.timer_due == min(dues)
+
+    async def test_concurrency(self):
+        for bridge in ["one", "two", "three"]:
+            self.scheduler.add(bridge, 10, self._poll)
+        await asyncio.sleep(0.01)
+        assert self.polls == ["one", "two"]
+        assert self.scheduler.running == 2
+        assert list(self.scheduler.waiting)[0].bridge == "three"
+        assert dict((name, value) for name, labels, value in self.scheduler.collect()) == \
+            {"poll_bridges": 3, "poll_running": 2, "poll_waiting": 1}
+        await asyncio.sleep(0.07)
+        assert self.polls == ["one", "two", "three"]
+        assert self.scheduler.running == 1
+
+    async def test_failing_poll(self):
+        async def fail(bridge):
+            self.polls.append(bridge)
+            raise Exception("Test")
+
+        entry = self.scheduler.add("one", 0.05, fail)
+        await asyncio.sleep(0.08)
+        assert self.polls == ["one", "one"]
+        assert self.scheduler.running == 0
+        assert entry.running is False
+
+    async def test_stop(self):
+        self.scheduler.add("one", 1, self._poll)
+        self.scheduler.add("two", 1, self._poll)
+        self.scheduler.stop()
+        assert self.scheduler.entries == {}
+        assert self.scheduler.timer is None
+        await asyncio.sleep(0.01)
+        assert self.polls == []
+
+    async def test_adaptive(self):
+        results = [0, 0, 3, None, 0]
+
+        async def poll(bridge):
+            self.polls.append(bridge)
+            return results.pop(0)
+
+        adaptive = AdaptiveInterval(0.02, 0.1)
+        entry = self.scheduler.add("one", 60, poll, adaptive=adaptive)
+        assert entry.interval == 0.02
+        intervals = []
+        while results:
+            await asyncio.sleep(0.005)
+            if not intervals or intervals[-1] != (len(self.polls), entry.interval):
+                intervals.append((len(self.polls), entry.interval))
+        await asyncio.sleep(0.005)
+        assert [i for c, i in intervals if c] == [0.04, 0.08, 0.02, 0.02, 0.04]
+        assert self.scheduler.info()[0]["interval"] == 0.04
+        assert self.scheduler.info()[0]["adaptive"] == {"min": 0.02, "max": 0.1}
+
+    async def test_adaptive_interval(self):
+        adaptive = AdaptiveInterval(10, 60, factor=3)
+        assert [adaptive.update(0) for _ in range(3)] == [30, 60, 60]
+        assert adaptive.update(2) == 10
+        adaptive.update(0)
+        assert adaptive.reset() == 10
+        assert AdaptiveInterval.from_config({"poll_interval": 20}, 20) is None
+        adaptive = AdaptiveInterval.from_config({"poll_max_interval": 600}, 20)
+        assert (adaptive.minimum, adaptive.maximum, adaptive.factor) == (20, 600, 2)
+        adaptive = AdaptiveInterval.from_config({"poll_min_interval": 5, "poll_backoff": 1.5}, 20)
+        assert (adaptive.minimum, adaptive.maximum, adaptive.factor) == (5, 50, 1.5)
+
+    async def test_wake(self):
+        self.scheduler.jitter = 1
+        entry = self.scheduler.add("one", 10, self._poll, adaptive=AdaptiveInterval(1, 10))
+        entry.interval = entry.adaptive.interval = 8
+        assert self.scheduler.wake("one") is True
+        assert self.scheduler.wake("two") is False
+        assert entry.interval == 1
+        assert entry.due <= self.scheduler.loop.time()
+        await asyncio.sleep(0.01)
+        assert self.polls == ["one"]
+        # stale heap node of first schedule doesn't trigger another poll
+        assert self.scheduler.wake("one") is True
+        await asyncio.sleep(0.1)
+        assert self.polls == ["one"]
+
+    async def test_overrun(self):
+        async def poll(bridge):
+            self.polls.append(bridge)
+            await asyncio.sleep(0.12)
+
+        bridge = asynctest.MagicMock(hash="foo")
+        bridge.source.type = "test"
+        entry = self.scheduler.add(bridge, 0.05, poll)
+        assert entry.overrun == "remaining"
+        await asyncio.sleep(0.13)
+        # next poll right away
+        assert len(self.polls) == 2
+        hist = metrics.histograms[("poll_overrun_seconds", (("source", "test"),))]
+        assert hist["count"] == 1
+        assert 0.05 <= hist["sum"] < 0.1
+        assert metrics.histograms[("poll_duration_seconds", (("source", "test"),))]["count"] == 1
+
+    async def test_overrun_skip(self):
+        async def poll(bridge):
+            self.polls.append(bridge)
+            await asyncio.sleep(0.12)
+
+        bridge = asynctest.MagicMock(hash="foo")
+        entry = self.scheduler.add(bridge, 0.05, poll, overrun="skip")
+        start = entry.due
+        await asyncio.sleep(0.13)
+        # missed polls at 0.05 and 0.1 are skipped
+        assert len(self.polls) == 1
+        assert abs(entry.due - (start + 0.15)) < 0.001
+        assert metrics.get("poll_skipped", reason="overrun", bridge="foo") == 2
+        assert self.scheduler.add(bridge, 1, poll, overrun="foo").overrun == "remaining"
+
+    async def test_get_poll_scheduler(self):
+        scheduler = get_poll_scheduler()
+        assert isinstance(scheduler, PollScheduler)
+        assert get_poll_scheduler() is scheduler
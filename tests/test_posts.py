@@ -13,6 +13,9 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import copy
+import json
+import pickle
 import unittest
 from unittest.mock import MagicMock
 from livebridge.components import get_post, add_post
@@ -99,3 +102,48 @@ class PostTest(unittest.TestCase):
         self.post.set_existing({"foo": "baz"})
         assert self.post.get_existing() == {"foo": "baz"}
         assert self.post.is_known is True
+
+    def test_view(self):
+        data = {"item": {"media": [1, 2, 3]}}
+        post = MockPost(data, content="foo", images=["/tmp/one.jpg"])
+        post.set_existing({"target_id": "baz", "target_doc": {"doc": "foo"}})
+        view = post.view()
+        assert type(view) == MockPost
+        # source data is shared read-only
+        assert view.data == post.data
+        assert str(view.data) == str(post.data)
+        with self.assertRaises(TypeError):
+            view.data["foo"] = "baz"
+        with self.assertRaises(TypeError):
+            view.data["item"].update({"foo": "baz"})
+        with self.assertRaises(TypeError):
+            view.data.get("item")["media"].append(4)
+        with self.assertRaises(TypeError):
+            [v for v in view.data.values()][0]["media"][0:1] = [5]
+        assert post.data == {"item": {"media": [1, 2, 3]}}
+        assert json.loads(json.dumps(view.data)) == post.data
+        # copies are mutable
+        data = copy.deepcopy(view.data)
+        data["item"]["media"].append(4)
+        assert type(data) == dict
+        assert type(pickle.loads(pickle.dumps(view.data))) == dict
+        assert post.data == {"item": {"media": [1, 2, 3]}}
+        assert view.view().data == post.data
+        assert view.content == "foo"
+        assert view.images == ["/tmp/one.jpg"]
+        assert view.get_existing() == post.get_existing()
+        # target related state is separated
+        view.content = "converted"
+        view.images.append("/tmp/two.jpg")
+        view.get_existing()["target_id"] = "foo"
+        view.target_doc = {"doc": "baz"}
+        view._target_id = "foo"
+        assert post.content == "foo"
+        assert post.images == ["/tmp/one.jpg"]
+        assert post.get_existing()["target_id"] == "baz"
+        assert post.target_doc == {"doc": "foo"}
+        assert post._target_id is None
+        # target id is not inherited, but read from the existing doc
+        post._target_id = "bar"
+        assert post.view()._target_id is None
+        assert post.view().target_id == "baz"
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import asynctest
+from unittest.mock import MagicMock
+from livebridge.retries import RetryScheduler, get_retry_scheduler
+
+
+class RetrySchedulerTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.scheduler = RetryScheduler(base=5, max_delay=60)
+        self.called = []
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def _item(self, post_id, target="target", count=1):
+        return {"post": MagicMock(id=post_id), "target": MagicMock(target_id=target), "count": count}
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_backoff(self):
+        for _ in range(50):
+            assert 0 <= self.scheduler.backoff(1) <= 5
+            assert 0 <= self.scheduler.backoff(3) <= 20
+            assert 0 <= self.scheduler.backoff(10) <= 60
+        assert max(self.scheduler.backoff(10) for _ in range(100)) > 5
+
+    async def test_schedule(self):
+        first = self._item("one")
+        second = self._item("two")
+        third = self._item("three")
+        self.scheduler.schedule(second, self.called.append, bridge="foo", delay=0.2)
+        self.scheduler.schedule(first, self.called.append, bridge="foo", delay=0.1)
+        self.scheduler.schedule(third, self.called.append, bridge="bar", delay=0.3)
+        assert len(self.scheduler) == 3
+        assert self.scheduler.timer_due == self.scheduler.pending()[0].due
+        await asyncio.sleep(0.5)
+        assert self.called == [first, second, third]
+        assert len(self.scheduler) == 0
+        assert self.scheduler.timer is None
+
+    async def test_schedule_backoff(self):
+        self.scheduler.backoff = MagicMock(return_value=0.05)
+        item = self._item("one", count=3)
+        self.scheduler.schedule(item, self.called.append)
+        assert self.scheduler.backoff.call_args == asynctest.call(3)
+        await asyncio.sleep(0.1)
+        assert self.called == [item]
+
+    async def test_pending(self):
+        one = self._item("one", target="a")
+        two = self._item("two", target="b")
+        three = self._item("three", target="a")
+        self.scheduler.schedule(one, self.called.append, bridge="foo", delay=3)
+        self.scheduler.schedule(two, self.called.append, bridge="foo", delay=1)
+        self.scheduler.schedule(three, self.called.append, bridge="bar", delay=2)
+        assert [e.item for e in self.scheduler.pending()] == [two, three, one]
+        assert [e.item for e in self.scheduler.pending(bridge="foo")] == [two, one]
+        assert [e.item for e in self.scheduler.pending(target=one["target"])] == [one]
+        assert self.scheduler.pending(bridge="baz") == []
+
+    async def test_cancel(self):
+        one = self._item("one")
+        two = self._item("two")
+        self.scheduler.schedule(one, self.called.append, bridge="foo", delay=0.1)
+        self.scheduler.schedule(two, self.called.append, bridge="bar", delay=0.1)
+        assert self.scheduler.cancel(bridge="foo") == 1
+        assert self.scheduler.cancel(bridge="foo") == 0
+        assert len(self.scheduler) == 1
+        await asyncio.sleep(0.2)
+        assert self.called == [two]
+
+    async def test_cancel_target(self):
+        one = self._item("one")
+        self.scheduler.schedule(one, self.called.append, bridge="foo", delay=0.1)
+        assert self.scheduler.cancel(target=one["target"]) == 1
+        assert self.scheduler.heap == []
+        assert self.scheduler.timer is None
+
+    async def test_callback_failing(self):
+        callback = MagicMock(side_effect=Exception("Test"))
+        self.scheduler.schedule(self._item("one"), callback, delay=0)
+        self.scheduler.schedule(self._item("two"), self.called.append, delay=0)
+        await asyncio.sleep(0.05)
+        assert callback.call_count == 1
+        assert len(self.called) == 1
+
+    async def test_collect(self):
+        self.scheduler.schedule(self._item("one"), self.called.append, bridge="foo", delay=1)
+        assert list(self.scheduler.collect()) == [("retries_pending", {"bridge": "foo", "label": "-"}, 1)]
+
+    async def test_get_retry_scheduler(self):
+        scheduler = get_retry_scheduler()
+        assert isinstance(scheduler, RetryScheduler)
+        assert get_retry_scheduler() is scheduler
@@ -14,8 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import asynctest
-from datetime import datetime
+from datetime import datetime, timedelta
 from livebridge.base import BaseSource, PollingSource, StreamingSource
+from livebridge.knownposts import clear_known_posts, get_known_posts
+from livebridge.lastupdated import clear_last_updated, get_last_updated_index
+from livebridge.metrics import metrics
 from livebridge.storages.base import BaseStorage
 from livebridge.components import get_source, add_source
 
@@ -29,6 +32,11 @@ class MockSource(StreamingSource):
 
 class BaseSourcesTest(asynctest.TestCase):
 
+    def tearDown(self):
+        clear_known_posts()
+        clear_last_updated()
+        metrics.clear()
+
     async def test_base_source(self):
         source = BaseSource()
         db = source._db
@@ -42,6 +50,9 @@ class BaseSourcesTest(asynctest.TestCase):
         with self.assertRaises(NotImplementedError):
             await source.stop()
 
+        assert await source.pause() is None
+        assert await source.resume() is None
+
     async def test_polling_methods(self):
         source = PollingSource()
         with self.assertRaises(NotImplementedError):
@@ -72,11 +83,53 @@ class BaseSourcesTest(asynctest.TestCase):
         assert new_ids == ["one", "three", "six"]
         source._db_client.get_known_posts.assert_called_once_with("source_id", post_ids)
 
-        # empty list
+        # empty list, nothing to look up
         source._db_client.get_known_posts = asynctest.CoroutineMock(return_value=[])
         new_ids = await source.filter_new_posts("source_id", [])
         assert new_ids == []
-        source._db_client.get_known_posts.assert_called_once_with("source_id", [])
+        assert source._db_client.get_known_posts.call_count == 0
+
+    async def test_filter_new_posts_cached(self):
+        source = BaseSource()
+        source._db_client = asynctest.MagicMock()
+        source._db_client.get_source_post_ids = asynctest.CoroutineMock(return_value=["one"])
+        source._db_client.get_known_posts = asynctest.CoroutineMock(return_value=["two"])
+        new_ids = await source.filter_new_posts("source_id", ["one", "two", "three"])
+        assert new_ids == ["three"]
+        # warmed with known posts of the source
+        source._db_client.get_known_posts.assert_called_once_with("source_id", ["two", "three"])
+        assert get_known_posts("source_id").warmed is True
+
+        source._db_client.get_known_posts = asynctest.CoroutineMock(return_value=[])
+        new_ids = await source.filter_new_posts("source_id", ["one", "two", "three", "four"])
+        assert new_ids == ["three", "four"]
+        source._db_client.get_known_posts.assert_called_once_with("source_id", ["three", "four"])
+        assert source._db_client.get_source_post_ids.call_count == 1
+        assert metrics.get("known_posts_cache_total", result="hit") == 3
+        assert metrics.get("known_posts_cache_total", result="miss") == 4
+
+    async def test_filter_new_posts_chunked(self):
+        async def get_known_posts(source_id, post_ids):
+            calls.append(post_ids)
+            return [p for p in post_ids if p % 3 == 0]
+
+        calls = []
+        source = BaseSource()
+        source._db_client = asynctest.MagicMock(known_posts_chunk_size=4)
+        source._db_client.get_known_posts = get_known_posts
+        post_ids = list(range(10)) + [3, 4]
+        new_ids = await source.filter_new_posts("source_id", post_ids)
+        assert new_ids == [1, 2, 4, 5, 7, 8, 4]
+        assert sorted(calls) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+        # one failing chunk fails the lookup
+        async def failing(source_id, post_ids):
+            if 5 in post_ids:
+                raise Exception("Test")
+            return []
+
+        source._db_client.get_known_posts = failing
+        assert await source.filter_new_posts("source_id", post_ids) == []
 
     async def test_filter_new_posts_failing(self):
         source = BaseSource()
@@ -98,5 +151,32 @@ class BaseSourcesTest(asynctest.TestCase):
 
         # no data from storage
         source._db_client.get_last_updated = asynctest.CoroutineMock(return_value=None)
-        last_updated = await source.get_last_updated("foo")
+        last_updated = await source.get_last_updated("bar")
         assert last_updated is None
+
+    async def test_get_last_updated_index(self):
+        source = BaseSource()
+        source._db_client = asynctest.MagicMock()
+        tstamp = datetime.utcnow()
+        source._db_client.get_last_updated = asynctest.CoroutineMock(return_value=tstamp)
+        assert await source.get_last_updated("foo") == tstamp
+        assert await source.get_last_updated("foo") == tstamp
+        assert source._db_client.get_last_updated.call_count == 1
+        assert metrics.get("last_updated_cache_total", result="hit") == 1
+        assert metrics.get("last_updated_cache_total", result="miss") == 1
+
+        # advanced by written posts
+        get_last_updated_index().advance("foo", tstamp + timedelta(seconds=5))
+        assert await source.get_last_updated("foo") == tstamp + timedelta(seconds=5)
+        assert source._db_client.get_last_updated.call_count == 1
+
+        # shared mode asks the storage again, stale entry is used when the query fails
+        get_last_updated_index().mode = "shared"
+        get_last_updated_index().ttl = 0
+        source._db_client.get_last_updated = asynctest.CoroutineMock(return_value=None)
+        assert await source.get_last_updated("foo") == tstamp + timedelta(seconds=5)
+        assert source._db_client.get_last_updated.call_count == 1
+
+        with asynctest.patch("livebridge.lastupdated.LAST_UPDATED_CACHE", "off"):
+            assert await source.get_last_updated("foo") is None
+            assert source._db_client.get_last_updated.call_count == 2
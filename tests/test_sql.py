@@ -97,6 +97,20 @@ class SQLStorageTests(asynctest.TestCase):
         res = await self.client.get_last_updated("source")
         assert res is None
 
+    async def test_get_last_updated_sources(self):
+        tstamp = datetime(2016, 10, 19, 10, 13, 43)
+        db_res = asynctest.MagicMock(spec=AsyncioResultProxy)
+        db_res.fetchall = asynctest.CoroutineMock(return_value=[("one", tstamp)])
+        self.client._engine = asynctest.MagicMock()
+        self.client._engine.execute = asynctest.CoroutineMock(return_value=db_res)
+        res = await self.client.get_last_updated_sources(["one", "two"])
+        assert res == {"one": tstamp}
+        assert self.client._engine.execute.call_count == 1
+        assert "GROUP BY" in str(self.client._engine.execute.call_args[0][0])
+
+        self.client._engine.execute = asynctest.CoroutineMock(side_effect=Exception())
+        assert await self.client.get_last_updated_sources(["one"]) is None
+
     async def test_get_last_updated_failing(self):
         self.client._engine = asynctest.MagicMock()
         self.client._engine.execute = asynctest.CoroutineMock(side_effect=Exception())
@@ -122,6 +136,32 @@ class SQLStorageTests(asynctest.TestCase):
         res = await self.client.insert_post(**params)
         assert res is False
 
+    async def test_insert_update_posts(self):
+        self.client._engine = None
+        await self.client.setup()
+        posts = [{"target_id": "target-id", "post_id": post_id, "source_id": "source-id", "text": "Text",
+                  "created": datetime(2017, 1, 1), "sticky": False, "updated": datetime(2017, 1, 1),
+                  "target_doc": {"id": post_id}} for post_id in ["one", "two"]]
+        assert await self.client.insert_posts(posts) is True
+        res = await self.client.get_post("target-id", "two")
+        assert res["target_doc"] == {"id": "two"}
+        for post in posts:
+            post["text"] = "Updated {}".format(post["post_id"])
+            post["updated"] = datetime(2017, 1, 2)
+        assert await self.client.update_posts(posts) is True
+        res = await self.client.get_post("target-id", "one")
+        assert res["text"] == "Updated one"
+        assert res["updated"] == datetime(2017, 1, 2)
+        res = await self.client.get_post("target-id", "two")
+        assert res["text"] == "Updated two"
+        self.client._engine = None
+
+    async def test_insert_update_posts_failing(self):
+        self.client._engine = asynctest.MagicMock()
+        self.client._engine.execute = asynctest.CoroutineMock(side_effect=Exception())
+        assert await self.client.insert_posts([{"post_id": "one"}]) is False
+        assert await self.client.update_posts([{"post_id": "one"}]) is False
+
     async def test_update_post(self):
         params = {"target_id": "target-id",
                   "post_id": "post-id",
@@ -160,6 +200,16 @@ class SQLStorageTests(asynctest.TestCase):
         res = await self.client.get_known_posts("source-id", ["one"])
         assert res == []
 
+    async def test_get_source_post_ids(self):
+        db_res = asynctest.MagicMock(spec=AsyncioResultProxy)
+        db_res.fetchall = asynctest.CoroutineMock(return_value=[("one",), ("three",)])
+        self.client._engine = asynctest.MagicMock()
+        self.client._engine.execute = asynctest.CoroutineMock(return_value=db_res)
+        assert await self.client.get_source_post_ids("source-id") == ["one", "three"]
+
+        self.client._engine.execute = asynctest.CoroutineMock(side_effect=Exception())
+        assert await self.client.get_source_post_ids("source-id") is None
+
     async def test_get_post(self):
         item = {
             "updated": datetime.strptime("2016-10-19T10:13:43+00:00", "%Y-%m-%dT%H:%M:%S+00:00"),
@@ -173,6 +223,22 @@ class SQLStorageTests(asynctest.TestCase):
         assert res["target_doc"] == {'target': 'doc'}
         assert res["updated"] == item["updated"]
 
+    async def test_get_posts(self):
+        item = {"post_id": "one", "target_doc": '{"target":"doc"}'}
+        db_res = asynctest.MagicMock(spec=AsyncioResultProxy)
+        db_res.fetchall = asynctest.CoroutineMock(return_value=[item])
+        self.client._engine = asynctest.MagicMock()
+        self.client._engine.execute = asynctest.CoroutineMock(return_value=db_res)
+        res = await self.client.get_posts("target", ["one", "two"])
+        assert res == {"one": {"post_id": "one", "target_doc": {"target": "doc"}}}
+        assert self.client._engine.execute.call_count == 1
+        # chunks stay below the limit of bound parameters
+        await self.client.get_posts("target", [str(x) for x in range(501)])
+        assert self.client._engine.execute.call_count == 3
+
+        self.client._engine.execute = asynctest.CoroutineMock(side_effect=Exception())
+        assert await self.client.get_posts("target", ["one"]) is None
+
     async def test_get_post_failing(self):
         self.client._engine = asynctest.MagicMock()
         self.client._engine.execute = asynctest.CoroutineMock(side_effect=Exception())
@@ -191,6 +257,67 @@ class SQLStorageTests(asynctest.TestCase):
         res = await self.client.delete_post("target", "post")
         assert res is False
 
+    async def test_outbox_items(self):
+        self.client._engine = None
+        self.client.outbox_table_name = "test_outbox_table"
+        assert await self.client.setup() is True
+        item = {"id": "abc", "bridge": "bridge", "target": "target", "source": "liveblog", "post_id": "one",
+                "data": "{}", "count": 0, "dead": False, "created": 1.5}
+        assert await self.client.save_outbox_item(**item) is True
+        assert await self.client.save_outbox_item(**dict(item, id="def", created=2.5)) is True
+        # replace
+        assert await self.client.save_outbox_item(**dict(item, count=2, dead=True)) is True
+        items = await self.client.get_outbox_items("bridge")
+        assert items[0] == dict(item, count=2, dead=True)
+        assert [i["id"] for i in items] == ["abc", "def"]
+        assert await self.client.get_outbox_items("other") == []
+        assert await self.client.delete_outbox_item("bridge", "abc") is True
+        assert [i["id"] for i in await self.client.get_outbox_items("bridge")] == ["def"]
+        self.client._engine = None
+        self.client.outbox_table_name = None
+
+    async def test_leases(self):
+        self.client._engine = None
+        self.client.lease_table_name = "test_lease_table"
+        assert await self.client.setup() is True
+        assert await self.client.acquire_lease("foo", "node-1", 20.0, 10.0) is True
+        # held by other node
+        assert await self.client.acquire_lease("foo", "node-2", 25.0, 15.0) is False
+        # renewed by owner
+        assert await self.client.acquire_lease("foo", "node-1", 30.0, 20.0) is True
+        # taken over after expiry
+        assert await self.client.acquire_lease("foo", "node-2", 41.0, 31.0) is True
+        assert await self.client.acquire_lease("baz", "node-1", 41.0, 31.0) is True
+        assert [lease["name"] for lease in await self.client.get_leases(prefix="fo")] == ["foo"]
+        leases = sorted(await self.client.get_leases(), key=lambda lease: lease["name"])
+        assert leases == [{"name": "baz", "owner": "node-1", "expires": 41.0},
+                          {"name": "foo", "owner": "node-2", "expires": 41.0}]
+        # only owner releases
+        assert await self.client.release_lease("foo", "node-1") is True
+        assert len(await self.client.get_leases()) == 2
+        assert await self.client.release_lease("foo", "node-2") is True
+        assert [lease["name"] for lease in await self.client.get_leases()] == ["baz"]
+        self.client._engine = None
+        self.client.lease_table_name = None
+
+    async def test_leases_failing(self):
+        self.client._engine = asynctest.MagicMock()
+        self.client._engine.execute = asynctest.CoroutineMock(side_effect=Exception())
+        self.client.lease_table_name = "test_lease_table"
+        assert await self.client.acquire_lease("foo", "node", 2.0, 1.0) is False
+        assert await self.client.release_lease("foo", "node") is False
+        assert await self.client.get_leases() == []
+        self.client._engine = None
+        self.client.lease_table_name = None
+
+    async def test_outbox_items_failing(self):
+        self.client._engine = asynctest.MagicMock()
+        self.client._engine.execute = asynctest.CoroutineMock(side_effect=Exception())
+        self.client._engine.connect = asynctest.CoroutineMock(side_effect=Exception())
+        assert await self.client.save_outbox_item(id="abc") is False
+        assert await self.client.get_outbox_items("bridge") == []
+        assert await self.client.delete_outbox_item("bridge", "abc") is False
+
     async def test_get_control(self):
         updated = datetime(2017, 6, 1, 11, 3, 2)
         db_item = {
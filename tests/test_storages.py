@@ -49,8 +49,52 @@ class StoragesTest(asynctest.TestCase):
         with self.assertRaises(NotImplementedError):
             await self.storage.get_known_posts(source_id="one", post_ids=["two"])
 
+        with self.assertRaises(NotImplementedError):
+            await self.storage.get_source_post_ids("one")
+
         with self.assertRaises(NotImplementedError):
             await self.storage.get_control()
 
         with self.assertRaises(NotImplementedError):
             await self.storage.save_control(data={})
+
+        with self.assertRaises(NotImplementedError):
+            await self.storage.insert_posts([{"post_id": "one"}])
+
+        with self.assertRaises(NotImplementedError):
+            await self.storage.update_posts([{"post_id": "one"}])
+
+        with self.assertRaises(NotImplementedError):
+            await self.storage.save_outbox_item(id="foo")
+
+        with self.assertRaises(NotImplementedError):
+            await self.storage.get_outbox_items("bridge")
+
+        with self.assertRaises(NotImplementedError):
+            await self.storage.delete_outbox_item("bridge", "foo")
+
+        with self.assertRaises(NotImplementedError):
+            await self.storage.acquire_lease("foo", "node", 2.0, 1.0)
+
+        with self.assertRaises(NotImplementedError):
+            await self.storage.release_lease("foo", "node")
+
+        with self.assertRaises(NotImplementedError):
+            await self.storage.get_leases()
+
+    async def test_bulk_fallback(self):
+        self.storage.insert_post = asynctest.CoroutineMock(side_effect=[True, False])
+        self.storage.update_post = asynctest.CoroutineMock(return_value=True)
+        assert await self.storage.insert_posts([{"post_id": "one"}, {"post_id": "two"}]) is False
+        assert self.storage.insert_post.call_args_list == [asynctest.call(post_id="one"), asynctest.call(post_id="two")]
+        assert await self.storage.update_posts([{"post_id": "one"}]) is True
+        assert self.storage.update_post.call_args == asynctest.call(post_id="one")
+
+        self.storage.get_post = asynctest.CoroutineMock(side_effect=[{"post_id": "one"}, None])
+        assert await self.storage.get_posts("target", ["one", "two"]) == {"one": {"post_id": "one"}}
+        assert self.storage.get_post.call_args_list == [
+            asynctest.call("target", "one"), asynctest.call("target", "two")]
+
+    async def test_last_updated_sources_fallback(self):
+        self.storage.get_last_updated = asynctest.CoroutineMock(side_effect=["tstamp", None])
+        assert await self.storage.get_last_updated_sources(["one", "two"]) == {"one": "tstamp", "two": None}
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2016, 2017 dpa-infocom GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import asynctest
+import multiprocessing
+import os
+from unittest.mock import MagicMock
+from livebridge import config
+from livebridge.components import get_hash, get_source_key
+from livebridge.metrics import metrics
+from livebridge.supervisor import Supervisor, Worker
+
+
+def exit_worker(index, conn):
+    os._exit(3)
+
+
+class WorkerTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.conn, self.child_conn = multiprocessing.Pipe()
+        self.worker = Worker(1, self.child_conn)
+        self.worker.loop = MagicMock()
+        self.worker.controller = asynctest.MagicMock()
+        self.worker.controller.add_bridges = asynctest.CoroutineMock()
+        self.worker.controller.remove_bridges = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        self.worker.controller.update_bridges = asynctest.CoroutineMock()
+
+    def tearDown(self):
+        self.conn.close()
+        self.child_conn.close()
+
+    async def test_receive(self):
+        self.conn.send(("add", [{"source_id": 1}]))
+        self.conn.send(("remove", [{"source_id": 2}]))
+        self.conn.send(("update", [{"old": {"source_id": 3}, "new": {"source_id": 3}}]))
+        self.conn.send(("limits", {"scribble": {"concurrency": 2}}))
+        self.conn.send(("wake", "123"))
+        self.conn.send(("foo", None))
+        self.worker.receive()
+        await asyncio.sleep(0.01)
+        self.worker.controller.add_bridges.assert_called_once_with([{"source_id": 1}])
+        self.worker.controller.remove_bridges.assert_called_once_with([{"source_id": 2}])
+        self.worker.controller.update_bridges.assert_called_once_with(
+            [{"old": {"source_id": 3}, "new": {"source_id": 3}}])
+        self.worker.controller.set_limits.assert_called_once_with({"scribble": {"concurrency": 2}})
+        self.worker.controller.wake.assert_called_once_with("123")
+        assert self.worker.loop.stop.call_count == 0
+        self.conn.send(("stop", None))
+        self.worker.receive()
+        assert self.worker.loop.stop.call_count == 1
+
+    async def test_receive_closed(self):
+        self.conn.close()
+        self.worker.receive()
+        assert self.worker.loop.stop.call_count == 1
+
+
+class SupervisorTest(asynctest.TestCase):
+
+    def setUp(self):
+        self.supervisor = Supervisor(config, None, workers=3)
+        self.supervisor.stop_timeout = 0.5
+        self.bridges = [{"source_id": x, "targets": []} for x in range(30)]
+
+    def tearDown(self):
+        if self.supervisor.monitor_timer:
+            self.supervisor.monitor_timer.cancel()
+        metrics.clear()
+
+    def _mock_processes(self):
+        for index in range(3):
+            self.supervisor.processes[index] = (MagicMock(), MagicMock())
+
+    @asynctest.fail_on(unused_loop=False)
+    def test_worker_of(self):
+        workers = [self.supervisor.worker_of(b) for b in self.bridges]
+        assert workers == [int(get_source_key(b), 16) % 3 for b in self.bridges]
+        # bridges of a source run on the same worker
+        assert self.supervisor.worker_of(dict(self.bridges[0], label="Other")) == workers[0]
+        assert set(workers) == {0, 1, 2}
+        assert workers == [Supervisor(config, None, workers=3).worker_of(b) for b in self.bridges]
+
+    async def test_add_remove_bridges(self):
+        self._mock_processes()
+        await self.supervisor.add_bridges(self.bridges)
+        assert sum(len(b) for b in self.supervisor.assigned.values()) == 30
+        for index, (process, conn) in self.supervisor.processes.items():
+            command, data = conn.send.call_args[0][0]
+            assert command == "add"
+            assert all(self.supervisor.worker_of(b) == index for b in data)
+        await self.supervisor.remove_bridges(self.bridges[:10])
+        assert sum(len(b) for b in self.supervisor.assigned.values()) == 20
+        sent = [c.send.call_args[0][0] for p, c in self.supervisor.processes.values() if c.send.call_count == 2]
+        assert sorted(b["source_id"] for command, data in sent for b in data) == list(range(10))
+        assert all(command == "remove" for command, data in sent)
+
+    async def test_update_bridges(self):
+        self._mock_processes()
+        await self.supervisor.add_bridges(self.bridges)
+        changes = [{"old": b, "new": dict(b, targets=[{"type": "foo"}])} for b in self.bridges]
+        await self.supervisor.update_bridges(changes)
+        for index, (process, conn) in self.supervisor.processes.items():
+            command, data = conn.send.call_args[0][0]
+            assert command == "update"
+            # updated bridges stay on their worker
+            assert all(self.supervisor.worker_of(c["old"]) == index for c in data)
+            assert list(self.supervisor.assigned[index].values()) == [c["new"] for c in data]
+        # removal is routed to the worker running the updated bridge
+        await self.supervisor.remove_bridges([c["new"] for c in changes])
+        assert sum(len(b) for b in self.supervisor.assigned.values()) == 0
+        for index, (process, conn) in self.supervisor.processes.items():
+            command, data = conn.send.call_args[0][0]
+            assert command == "remove"
+            assert all(self.supervisor.worker_of(dict(b, targets=[])) == index for b in data)
+
+    async def test_set_limits(self):
+        self._mock_processes()
+        limits = {"scribble": {"rate_limit": 5}}
+        self.supervisor.set_limits(limits)
+        self.supervisor.set_limits(dict(limits))
+        for process, conn in self.supervisor.processes.values():
+            conn.send.assert_called_once_with(("limits", limits))
+        # restarted workers get the limits before their bridges
+        self.supervisor.assigned[0] = {"foo": {"source_id": "foo"}}
+        with asynctest.patch("multiprocessing.get_context") as get_context:
+            conn = MagicMock()
+            get_context.return_value.Pipe.return_value = (conn, MagicMock())
+            self.supervisor.start_worker(0)
+        assert [c[0][0][0] for c in conn.send.call_args_list] == ["limits", "add"]
+
+    async def test_wake(self):
+        self._mock_processes()
+        await self.supervisor.add_bridges(self.bridges + [dict(self.bridges[0], label="Other")])
+        index = self.supervisor.worker_of(self.bridges[0])
+        conn = self.supervisor.processes[index][1]
+        # by source id, source key and hash of a bridge
+        assert self.supervisor.wake("0") == 2
+        conn.send.assert_called_with(("wake", "0"))
+        assert self.supervisor.wake(get_source_key(self.bridges[0])) == 2
+        assert self.supervisor.wake(get_hash(self.bridges[0])) == 1
+        conn.send.assert_called_with(("wake", get_hash(self.bridges[0])))
+        assert self.supervisor.wake("unknown") == 0
+        assert self.supervisor.runs_bridges is False
+
+    async def test_send_failing(self):
+        self._mock_processes()
+        self.supervisor.processes[0][1].send.side_effect = BrokenPipeError()
+        assert self.supervisor.send(0, "add", []) is False
+        assert self.supervisor.send(1, "add", []) is True
+        assert self.supervisor.send(5, "add", []) is False
+
+    async def test_check_workers(self):
+        self._mock_processes()
+        self.supervisor.processes[1][0].is_alive.return_value = False
+        self.supervisor.start_worker = MagicMock()
+        self.supervisor.check_workers()
+        self.supervisor.start_worker.assert_called_once_with(1)
+        assert metrics.get("workers_restarted_total", worker=1) == 1
+        assert self.supervisor.monitor_timer is not None
+        self.supervisor.shutdown = True
+        self.supervisor.monitor_timer.cancel()
+        self.supervisor.monitor_timer = None
+        self.supervisor.check_workers()
+        assert self.supervisor.start_worker.call_count == 1
+        assert self.supervisor.monitor_timer is None
+
+    async def test_start_worker(self):
+        self.supervisor.assigned[0] = {"foo": {"source_id": "foo"}}
+        with asynctest.patch("livebridge.supervisor.run_worker", new=exit_worker):
+            self.supervisor.start_workers()
+        assert len(self.supervisor.processes) == 3
+        for process, conn in self.supervisor.processes.values():
+            process.join(5)
+            assert process.exitcode == 3
+        collected = dict(((n, tuple(labels.items())), v) for n, labels, v in self.supervisor.collect())
+        assert collected[("workers_alive", ())] == 0
+        await self.supervisor.clean_shutdown()
+        assert self.supervisor.shutdown is True
+
+    async def test_clean_shutdown(self):
+        self._mock_processes()
+        process, conn = self.supervisor.processes[2]
+        process.is_alive.return_value = False
+        self.supervisor.close_control_data = asynctest.CoroutineMock()
+        await self.supervisor.clean_shutdown()
+        for index, (process, conn) in self.supervisor.processes.items():
+            conn.send.assert_called_once_with(("stop", None))
+            assert conn.close.call_count == 1
+            assert process.terminate.call_count == (0 if index == 2 else 1)
+            # workers are joined within the stop timeout
+            assert 0 <= process.join.call_args_list[0][0][0] <= self.supervisor.stop_timeout
+        assert self.supervisor.close_control_data.call_count == 1
+
+    async def test_run(self):
+        self.supervisor.start_workers = MagicMock()
+        with asynctest.patch("livebridge.controller.Controller.run") as run:
+            run.return_value = True
+            assert await self.supervisor.run() is True
+        assert self.supervisor.start_workers.call_count == 1
@@ -13,12 +13,18 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import asyncio
 import asynctest
 import livebridge.components
 from unittest.mock import MagicMock
 from livebridge.base import BaseTarget, BaseConverter, TargetResponse, ConversionResult
 from livebridge.storages import DynamoClient
 from livebridge.components import get_target, add_target
+from livebridge.conversions import get_conversion_cache
+from livebridge.knownposts import get_known_posts, clear_known_posts
+from livebridge.lastupdated import get_last_updated_index, clear_last_updated
+from livebridge.limits import Limiter
+from livebridge.metrics import metrics
 
 
 class MockTarget(BaseTarget):
@@ -37,6 +43,8 @@ class BaseTargetTests(asynctest.TestCase):
         self.converter.source = "liveblog"
         self.converter.target = "scribble"
         livebridge.components.add_converter(self.converter)
+        # images are removed as soon as the post is delivered
+        get_conversion_cache().ttl = 0
 
         self.target = BaseTarget()
         self.target.type = "test"
@@ -57,6 +65,17 @@ class BaseTargetTests(asynctest.TestCase):
         new_target = get_target(conf)
         assert new_target.type == target.type
         assert new_target.foo == conf["foo"]
+        assert new_target.limiter is None
+        assert new_target.breaker_key.startswith("test:")
+
+        conf["concurrency"] = 2
+        conf["rate_limit"] = 5
+        new_target = get_target(conf)
+        assert new_target.limiter.semaphore._value == 2
+        assert new_target.limiter.bucket.rate == 5
+        # bridges with the same target entry share its limits
+        assert get_target(dict(conf)).limiter is new_target.limiter
+        assert get_target(dict(conf, foo="other")).limiter is not new_target.limiter
 
     @asynctest.fail_on(unused_loop=False)
     def test_get_target_unkown(self):
@@ -91,6 +110,12 @@ class BaseTargetTests(asynctest.TestCase):
         with self.assertRaises(NotImplementedError):
             self.target.handle_extras(self.post)
 
+        with self.assertRaises(NotImplementedError):
+            self.target.post_items([self.post])
+
+        with self.assertRaises(NotImplementedError):
+            self.target.update_items([self.post])
+
     @asynctest.fail_on(unused_loop=False)
     def test_get_converter(self):
         target = BaseTarget()
@@ -109,6 +134,32 @@ class BaseTargetTests(asynctest.TestCase):
         self.target._get_converter.assert_called_once_with(self.post)
         self.target.handle_extras.called == 0
 
+    async def test_shared_conversion(self):
+        other = BaseTarget()
+        other.type = "test"
+        other.target_id = "other-target"
+        other._get_converter = MagicMock(return_value=self.converter)
+        self.post.get_action = MagicMock(return_value="ignore")
+        await asyncio.gather(self.target.handle_post(self.post), other.handle_post(self.post))
+        # converted once for both targets, images removed after both are done
+        assert self.converter.convert.call_count == 1
+        assert self.converter.remove_images.call_count == 1
+
+    async def test_handle_post_prefetched(self):
+        self.post.get_action = MagicMock(return_value="ignore")
+        self.post.prefetched = True
+        await self.target.handle_post(self.post)
+        assert self.target._db.get_post.call_count == 0
+        # retries read the doc again
+        assert self.post.prefetched is False
+        await self.target.handle_post(self.post)
+        self.target._db.get_post.assert_called_once_with(self.target.target_id, self.post.id)
+
+    async def test_prefetch_posts(self):
+        self.target._db.get_posts = asynctest.CoroutineMock(return_value={"one": {"post_id": "one"}})
+        assert await self.target.prefetch_posts(["one", "two"]) == {"one": {"post_id": "one"}}
+        self.target._db.get_posts.assert_called_once_with("test-target", ["one", "two"])
+
     async def test_handle_post_create(self):
         new_doc = TargetResponse({"doc": "foo"})
         self.post.get_action = MagicMock(return_value="create")
@@ -185,6 +236,105 @@ class BaseTargetTests(asynctest.TestCase):
         self.target._db.get_post.assert_called_once_with(self.target.target_id, self.post.id)
         self.target._get_converter.assert_called_once_with(self.post)
 
+    async def test_handle_posts_single(self):
+        self.target.handle_post = asynctest.CoroutineMock(side_effect=[None, Exception("Test"), None])
+        res = await self.target.handle_posts(["one", "two", "three"])
+        assert res[0] is None
+        assert str(res[1]) == "Test"
+        assert res[2] is None
+        assert self.target.handle_post.call_count == 3
+
+    def _batch_post(self, post_id, action):
+        post = MagicMock(id=post_id, content="", images=[], source_id="source", updated=post_id)
+        post.get_action = MagicMock(return_value=action)
+        return post
+
+    async def test_handle_posts_batch(self):
+        self.target.batch_size = 10
+        posts = [self._batch_post("one", "create"), self._batch_post("two", "update"),
+                 self._batch_post("three", "create"), self._batch_post("four", "delete"),
+                 self._batch_post("five", "ignore")]
+        self.target.post_items = asynctest.CoroutineMock(
+            return_value=[TargetResponse({"id": "one"}), TargetResponse({"id": "three"})])
+        self.target.update_items = asynctest.CoroutineMock(return_value=[TargetResponse({"id": "two"})])
+        self.target._handle_delete = asynctest.CoroutineMock(return_value=True)
+        self.target.handle_extras = asynctest.CoroutineMock(
+            side_effect=[None, None, TargetResponse({"id": "three", "sticky": 1})])
+        self.target._db.insert_posts = asynctest.CoroutineMock(return_value=True)
+        self.target._db.update_posts = asynctest.CoroutineMock(return_value=True)
+        self.target._db.insert_post = asynctest.CoroutineMock(return_value=True)
+        get_known_posts("source")
+        get_last_updated_index().set("source", None)
+
+        res = await self.target.handle_posts(posts)
+        assert res == [None] * 5
+        assert self.target.post_items.call_args == asynctest.call([posts[0], posts[2]])
+        assert self.target.update_items.call_args == asynctest.call([posts[1]])
+        assert self.target._handle_delete.call_args == asynctest.call(posts[3])
+        assert self.target.handle_extras.call_count == 3
+        inserted = self.target._db.insert_posts.call_args[0][0]
+        assert [p["post_id"] for p in inserted] == ["one", "three"]
+        assert inserted[1]["target_doc"] == {"id": "three", "sticky": 1}
+        updated = self.target._db.update_posts.call_args[0][0]
+        assert [p["post_id"] for p in updated] == ["two"]
+        assert self.target._db.insert_post.call_count == 0
+        assert self.converter.remove_images.call_count == 5
+        assert list(get_known_posts("source").ids) == ["one", "three"]
+        # written posts advance the last updated timestamp of the source
+        assert get_last_updated_index().get("source") == "two"
+        clear_known_posts()
+        clear_last_updated()
+
+    async def test_handle_posts_batch_failing(self):
+        self.target.batch_size = 10
+        posts = [self._batch_post("one", "create"), self._batch_post("two", "create"),
+                 self._batch_post("three", "update"), self._batch_post("four", "delete")]
+        posts[3].get_action.side_effect = Exception("Action")
+        self.target.post_items = asynctest.CoroutineMock(return_value=[TargetResponse({"id": "one"}), None])
+        self.target.update_items = asynctest.CoroutineMock(side_effect=Exception("Update"))
+        self.target.handle_extras = asynctest.CoroutineMock(return_value=None)
+        self.target._db.insert_posts = asynctest.CoroutineMock(return_value=True)
+        self.target._db.update_posts = asynctest.CoroutineMock(return_value=True)
+
+        res = await self.target.handle_posts(posts)
+        assert res[0] is None
+        assert "Target create of post two failed" in str(res[1])
+        assert "Target update of post three failed" in str(res[2])
+        assert str(res[3]) == "Action"
+        assert [p["post_id"] for p in self.target._db.insert_posts.call_args[0][0]] == ["one"]
+        assert self.target._db.update_posts.call_count == 0
+
+    async def test_handle_posts_batch_missing_docs(self):
+        self.target.batch_size = 10
+        posts = [self._batch_post("one", "create"), self._batch_post("two", "create"),
+                 self._batch_post("three", "update")]
+        # too few docs and no docs at all
+        self.target.post_items = asynctest.CoroutineMock(return_value=[TargetResponse({"id": "one"})])
+        self.target.update_items = asynctest.CoroutineMock(return_value=None)
+        self.target.handle_extras = asynctest.CoroutineMock(return_value=None)
+        self.target._db.insert_posts = asynctest.CoroutineMock(return_value=True)
+        self.target._db.update_posts = asynctest.CoroutineMock(return_value=True)
+
+        res = await self.target.handle_posts(posts)
+        assert res[0] is None
+        assert "Target create of post two failed" in str(res[1])
+        assert "Target update of post three failed" in str(res[2])
+        assert [p["post_id"] for p in self.target._db.insert_posts.call_args[0][0]] == ["one"]
+        assert self.target._db.update_posts.call_count == 0
+
+    async def test_handle_posts_batch_limited(self):
+        self.target.batch_size = 10
+        self.target.limiter = Limiter(rate=100)
+        self.target.post_items = asynctest.CoroutineMock(return_value=[TargetResponse({"id": "one"})] * 3)
+        self.target.handle_extras = asynctest.CoroutineMock(return_value=None)
+        self.target._db.insert_posts = asynctest.CoroutineMock(return_value=True)
+        posts = [self._batch_post(post_id, "create") for post_id in ["one", "two", "three"]]
+        assert await self.target.handle_posts(posts) == [None] * 3
+        # one request for the bulk create, one per post for extras
+        hist = metrics.snapshot()["histograms"]["target_limit_wait_seconds"][0]
+        assert hist["value"]["count"] == 4
+        metrics.clear()
+
     async def test_handle_post_failing(self):
         self.post.is_deleted = False
         self.converter.convert = asynctest.CoroutineMock(return_value=ConversionResult(None, []))
@@ -206,10 +356,14 @@ class BaseTargetTests(asynctest.TestCase):
         new_doc = {"doc": "foo"}
         self.target.delete_item = asynctest.CoroutineMock(return_value=new_doc)
         self.target._db.delete_post = asynctest.CoroutineMock(return_value=True)
+        get_known_posts("source").add([self.post.id])
         res = await self.target._handle_delete(self.post)
         assert res is True
         self.target.delete_item.assert_called_once_with(self.post)
         self.target._db.delete_post.assert_called_once_with(self.post.target_id, self.post.id)
+        # known post cache asks the storage again
+        assert self.post.id not in get_known_posts("source").ids
+        clear_known_posts()
 
     async def test_handle_delete_failing(self):
         self.target.delete_item = asynctest.CoroutineMock(return_value=None)
@@ -219,6 +373,57 @@ class BaseTargetTests(asynctest.TestCase):
         self.target.delete_item.assert_called_once_with(self.post)
         assert self.target._db.delete_post.call_count == 0
 
+    async def test_limited(self):
+        self.target.update_item = asynctest.CoroutineMock(return_value={})
+        await self.target._handle_update(self.post)
+        assert metrics.get("target_limit_wait_seconds", target="test") is None
+        assert "target_limit_wait_seconds" not in metrics.snapshot()["histograms"]
+
+        # limited by instance
+        self.target.limiter = Limiter(concurrency=1)
+        running = []
+
+        async def update_item(post):
+            running.append(post)
+            assert len(running) == 1
+            await asyncio.sleep(0.05)
+            running.pop()
+            return {"doc": post.id}
+
+        self.target.update_item = update_item
+        posts = [MagicMock(id=post_id) for post_id in ["one", "two", "three"]]
+        res = await asyncio.gather(*[self.target._handle_update(p) for p in posts])
+        assert res == [{"doc": "one"}, {"doc": "two"}, {"doc": "three"}]
+        assert self.target.limiter.semaphore._value == 1
+        hist = metrics.snapshot()["histograms"]["target_limit_wait_seconds"][0]
+        assert hist["labels"] == {"target": "test"}
+        assert hist["value"]["count"] == 3
+        assert hist["value"]["sum"] >= 0.15
+        metrics.clear()
+
+    async def test_limited_type_acquired_last(self):
+        type_limiter = Limiter(concurrency=1)
+        self.target.limiter = Limiter(rate=10, burst=1)
+        self.target.update_item = asynctest.CoroutineMock(return_value={"doc": "foo"})
+        with asynctest.patch("livebridge.base.targets.get_type_limiter", return_value=type_limiter):
+            await self.target._handle_update(self.post)
+            # waiting for its own token bucket without holding the slot of the type
+            task = asyncio.ensure_future(self.target._handle_update(self.post))
+            await asyncio.sleep(0.01)
+            assert task.done() is False
+            assert type_limiter.semaphore._value == 1
+            assert await task == {"doc": "foo"}
+        assert type_limiter.semaphore._value == 1
+        metrics.clear()
+
+    async def test_limited_failing(self):
+        self.target.limiter = Limiter(concurrency=1)
+        self.target.post_item = asynctest.CoroutineMock(side_effect=Exception("Test"))
+        with self.assertRaises(Exception):
+            await self.target._handle_new(self.post)
+        assert self.target.limiter.semaphore._value == 1
+        metrics.clear()
+
     async def test_handle_update(self):
         new_doc = {"doc": "foo", "update": 1}
         self.target.update_item = asynctest.CoroutineMock(return_value=new_doc)
@@ -14,9 +14,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import asynctest
+import hashlib
+import hmac
 import unittest
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
 from livebridge.web import WebApi
+from livebridge.breaker import get_breaker
+from livebridge.controller import Controller
+from livebridge.metrics import metrics
+from livebridge.polling import get_poll_scheduler, AdaptiveInterval
 
 
 class WebApiTestCase(AioHTTPTestCase):
@@ -30,6 +36,7 @@ class WebApiTestCase(AioHTTPTestCase):
             "port": 9990,
             "auth": {"user": "test", "password": "testpwd"}}
         self.controller = asynctest.MagicMock(spec="livebridge.controller.Controller")
+        self.controller.wake = lambda key: Controller.wake(self.controller, key)
         server = WebApi(config=self.config, controller=self.controller, loop=self.loop)
         return server.app
 
@@ -71,6 +78,10 @@ class WebApiTestCase(AioHTTPTestCase):
         urls = [
             ("GET", "/api/v1/controldata"),
             ("PUT", "/api/v1/controldata"),
+            ("GET", "/api/v1/metrics"),
+            ("GET", "/api/v1/breakers"),
+            ("GET", "/api/v1/polls"),
+            ("POST", "/api/v1/polls/foo/wake"),
         ]
         for u in urls:
             request = await self.client.request(u[0], u[1])
@@ -161,3 +172,87 @@ class WebApiTestCase(AioHTTPTestCase):
         assert res.status == 500
         assert (await res.json()) == {"error": "Internal Server Error"}
         assert self.controller.save_control_data.call_count == 1
+
+    @unittest_run_loop
+    async def test_get_metrics(self):
+        metrics.incr("test_counter", target="foo")
+        headers = {"X-Auth-Token": await self._get_token()}
+        res = await self.client.request("GET", "/api/v1/metrics", headers=headers)
+        assert res.status == 200
+        data = await res.json()
+        assert data["counters"]["test_counter"] == [{"labels": {"target": "foo"}, "value": 1}]
+        metrics.clear()
+
+    @unittest_run_loop
+    async def test_get_breakers(self):
+        get_breaker("test:web").failures = 2
+        headers = {"X-Auth-Token": await self._get_token()}
+        res = await self.client.request("GET", "/api/v1/breakers", headers=headers)
+        assert res.status == 200
+        data = await res.json()
+        assert {"key": "test:web", "state": "closed", "failures": 2, "parked": 0, "retry_in": None} \
+            in data["breakers"]
+
+    @unittest_run_loop
+    async def test_polls(self):
+        scheduler = get_poll_scheduler()
+        bridge = asynctest.MagicMock(hash="abc", label="Example", source_id=123)
+        scheduler.add(bridge, 100, asynctest.CoroutineMock(), adaptive=AdaptiveInterval(10, 300))
+        scheduler.entries[bridge].adaptive.interval = scheduler.entries[bridge].interval = 80
+        headers = {"X-Auth-Token": await self._get_token()}
+        res = await self.client.request("GET", "/api/v1/polls", headers=headers)
+        assert res.status == 200
+        data = await res.json()
+        assert data["polls"][0]["bridge"] == "abc"
+        assert data["polls"][0]["interval"] == 80
+        assert data["polls"][0]["adaptive"] == {"min": 10, "max": 300}
+        # wake up by source id
+        res = await self.client.request("POST", "/api/v1/polls/123/wake", headers=headers)
+        assert res.status == 200
+        assert await res.json() == {"woken": 1}
+        assert scheduler.entries[bridge].interval == 10
+        res = await self.client.request("POST", "/api/v1/polls/unknown/wake", headers=headers)
+        assert res.status == 404
+        scheduler.stop()
+
+    @unittest_run_loop
+    async def test_workers(self):
+        # bridges run in worker processes
+        self.controller.runs_bridges = False
+        self.controller.wake = asynctest.MagicMock(return_value=2)
+        headers = {"X-Auth-Token": await self._get_token()}
+        for path in ["/api/v1/polls", "/api/v1/breakers"]:
+            res = await self.client.request("GET", path, headers=headers)
+            assert res.status == 501
+            assert await res.json() == {"error": "Not available with worker processes."}
+        res = await self.client.request("POST", "/api/v1/polls/123/wake", headers=headers)
+        assert res.status == 200
+        assert await res.json() == {"woken": 2}
+        self.controller.wake.assert_called_once_with("123")
+
+    @unittest_run_loop
+    async def test_polls_wake_signed(self):
+        scheduler = get_poll_scheduler()
+        bridge = asynctest.MagicMock(hash="abc", label="Example", source_id=123)
+        scheduler.add(bridge, 100, asynctest.CoroutineMock())
+        body = b'{"event": "update"}'
+        signature = "sha256=" + hmac.new(b"hooksecret", body, hashlib.sha256).hexdigest()
+        headers = {"X-Livebridge-Signature": signature}
+        # no secret configured
+        res = await self.client.request("POST", "/api/v1/polls/123/wake", data=body, headers=headers)
+        assert res.status == 401
+        self.config["hook_secret"] = "hooksecret"
+        res = await self.client.request("POST", "/api/v1/polls/123/wake", data=body, headers=headers)
+        assert res.status == 200
+        assert await res.json() == {"woken": 1}
+        # invalid signatures
+        for signature in ["sha256=foo", "foo", signature.upper()]:
+            res = await self.client.request(
+                "POST", "/api/v1/polls/123/wake", data=body, headers={"X-Livebridge-Signature": signature})
+            assert res.status == 401
+        res = await self.client.request("POST", "/api/v1/polls/123/wake", data=b"other", headers=headers)
+        assert res.status == 401
+        # other routes still need a session token
+        res = await self.client.request("GET", "/api/v1/polls", headers=headers)
+        assert res.status == 401
+        scheduler.stop()